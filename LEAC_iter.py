@@ -4,8 +4,8 @@
 Created on Mon Jan 27 08:50:44 2020
 
 
-This is a python script to calculate the NPV and simple payback
-for a PV system where the tariff is not expected to be constant over 
+This is a python script to calculate the NPV and simple and discounted
+payback for a PV system where the tariff is not expected to be constant over 
 the lifetime of the system.  It was created for Adventist World Radio
 on Guam, a non-profit Christian shortwave radio station.  On Guam there
 is LEAC (fuel surcharge) that varies depending on the cost of electricity
@@ -28,9 +28,14 @@ This script assumes:
     you are using PySAM version 2.02
 You make an excel file with the rates as a function of time:
     Year, 50000 kWh rate, rest rate
-    I notice a 0.5% error higher for split simulation than single
-    when degradation is 0.5%.  This remains unresolved, but it
-    seems consistent and the error is small.
+    The split simulation used to differ from a single one when the
+    system degrades (-0.1% of the NPV at 0.5% a year): each segment
+    scaled the insurance rate up by the degradation and shrank the
+    capacity based O&M with the capacity, though both are for the
+    installed system.  Neither is done now, and with rates that do not
+    change the split agrees with a single run to rounding at any
+    degradation (testing checks this), and
+    cash_flow = 'lifetime' does without the split altogether.
     Compared to SAM 2020.1.17 beta, the amount of electricity produced
     is 0.3% lower than the PySAM simulation.  This is unresolved, but
     it doesn't bother me much, as it is small and consistent.'
@@ -46,268 +51,105 @@ You make an excel file with the rates as a function of time:
             and use one of those JSON files, you will get the error: 
                 “error: pvwattsv7 execution error. precheck input: variable
                 'array_type' required but not assigned”
+    To run without any dialogs or windows (e.g. on a server), use
+    python -m leac case.json rates.xlsx --years 1
 @author: frohro
 """
 
 import numpy as np
-import tkinter as tk
-from tkinter import filedialog
-import json
-import PySAM.Pvwattsv7 as PVWattsCommercial
-import PySAM.Utilityrate5 as UtilityRate
-import PySAM.Cashloan as Cashloan
-import PySAM.PySSC as pssc
-import xlrd as xlrd
-
-
-
-root = tk.Tk()  # For filedialogs
-root.withdraw()  # No root window
-
-ssc = pssc.PySSC()
+from leac import api, bills, cashflow, dialogs
 
 testing = False  # Make False if you are not running tests.
 verbose = False  # Make False if you don't want all the debugging info.
+exact_generation = False  # Make True to re-run PVWatts if the inverter clips.
+# 'numpy' replaces the per segment Cashloan runs with leac/cashflow.py, and
+# 'lifetime' the segments too, pricing each year at its own rates in one pass
+# (leac/lifetime.py).  Both only handle the nonprofit case; use 'pysam' if
+# you have taxes or debt.
+cash_flow = 'numpy'
 
 
-# Get the SAM json file, make the simulations we need for the commercial
-# PVWatts simulation.
-
-try:
+def main():
+    # Get the SAM json file, make the simulations we need for the commercial
+    # PVWatts simulation.
     if testing:
         json_file_path = '100kW_PVWatts_05degr.json'
     else:
-        json_file_path = filedialog.askopenfilename(defaultextension='.json',
-                title='Select the json file generated by SAM.',
-                filetypes=[('Json file','*.json'), ('All files','*.*'), ])
+        json_file_path = dialogs.ask_case_path()
     if verbose:
         print(json_file_path)
-  
-except NameError:
-    print('NameError: with the json file')
-else:
-    with open(json_file_path) as f:
-        dic = json.load(f)
-pv_dat = pssc.dict_to_ssc_table(dic, "pvwattsv7")
-ur_dat = pssc.dict_to_ssc_table(dic, "utilityrate5")
-cl_dat = pssc.dict_to_ssc_table(dic, "cashloan")
-pv = PVWattsCommercial.wrap(pv_dat)
-ur = UtilityRate.from_existing(pv, 'PVWattsCommercial')
-cl = Cashloan.from_existing(pv, 'PVWattsCommercial')
-ur.assign(UtilityRate.wrap(ur_dat).export())
-cl.assign(Cashloan.wrap(cl_dat).export())
-
-degradation = cl.SystemOutput.degradation[0]
-if testing:
-    pv.execute()
-    ur.execute()
-    cl.execute()
-    npv_single_stage = cl.Outputs.npv
-    if round(pv.Outputs.ac_annual) != 134580:
-        print('\nError: Annual AC Output doesn\'t agree with SAM!\n')
-    if round(cl.Outputs.npv) != 138348:
-        print('Error Net Present Value does\'t agree with SAM!\n')
-    if round(cl.Outputs.adjusted_installed_cost) != 223249:
-        print('Error: Net installed cost doesn\'t agree with SAM!\n')
-    if verbose:
-        print('Full analysis for testing with no degradation:')
-        print('Annual AC output: ', pv.Outputs.ac_annual, 
-              ' Should be 134580.')
-        print('ur_ec_tou_mat: ', ur.ElectricityRates.ur_ec_tou_mat, 
-              ' Should 1, 1, 55000, 0.23, 0.08, ...')
-        print('Should be 0.23. ', ur.ElectricityRates.ur_ec_tou_mat[0][4])
-        print('cl.Outputs.npv: ', cl.Outputs.npv, 
-              'Should be $138,348.')
-        print('cl.FinancialParameters.analysis_period: ', 
-              cl.FinancialParameters.analysis_period, ' Should be 25.')
-        print('cl.FinancialParameters.real_discount_rate: ',
-              cl.FinancialParameters.real_discount_rate, ' Shauld be 1.5')
-        print('cl.Outputs.adjusted_installed cost', 
-              cl.Outputs.adjusted_installed_cost, 
-              'Should be $223,249.') 
-        # print('cl.Outputs.cf_energy_value: ', cl.Outputs.cf_energy_value)
-        check_yearly_savings_tuple = tuple(np.subtract(cl.Outputs.cf_energy_value,
-                cl.Outputs.cf_operating_expenses))
-        print('check_yearly_savings_tuple: ', check_yearly_savings_tuple)
-        print()
-    check_payback = cl.Outputs.payback
-    check_discounted_payback = cl.Outputs.discounted_payback
-    if verbose:
-        print('check_payback: ', check_payback)
+    case = api.load_case(json_file_path)
 
-
-# Get the rate data from the excel spreadsheet.
-try:
     if testing:
-        xl_file_path = 'Rates_Flat.xlsx'
-    else:
-        xl_file_path = filedialog.askopenfilename(defaultextension='xlxs',
-            title='Select the excel file with rate data.',
-            filetypes=[('excel 2007+', '*.xlsx'), ('excel 2003-', '*.xls'),
-                           ('All files', '*.*')])
-except NameError:
-    print('NameError: with the excel file.')
-else:
-    with open(xl_file_path) as f:
-        wb = xlrd.open_workbook(xl_file_path)
-        try:
-            rate_sheet = wb.sheet_by_name('Rates')
-        except:
-            print('\nError:  Does you spreadsheet have a \"Rates\" sheet?\n')
-        
+        pv, ur, cl = api.single_stage(case)
+        npv_single_stage = cl.Outputs.npv
+        paybacks_single_stage = (cl.Outputs.payback,
+                                 cl.Outputs.discounted_payback)
+        for message in api.check_against_sam(pv, cl):
+            print('\nError: ' + message + '\n')
+        # The NumPy cash flow kernel has to reproduce this single stage run.
+        for message in cashflow.cross_check(ur, cl,
+                                            pv.SystemDesign.system_capacity):
+            print('Error: ' + message)
+        # So do the analytic bills standing in for Utilityrate5.
+        for message in bills.cross_check(ur):
+            print('Error: ' + message)
         if verbose:
-            print('The rates you have are:')   
-            for rowNumber in range(rate_sheet.nrows):
-                row = rate_sheet.row_values(rowNumber)
-                print(row)
+            print('Full analysis for testing with no degradation:')
+            print('Annual AC output: ', pv.Outputs.ac_annual,
+                  ' Should be 134580.')
+            print('ur_ec_tou_mat: ', ur.ElectricityRates.ur_ec_tou_mat,
+                  ' Should 1, 1, 55000, 0.23, 0.08, ...')
+            print('cl.Outputs.npv: ', cl.Outputs.npv,
+                  'Should be $138,348.')
+            print('cl.FinancialParameters.analysis_period: ',
+                  cl.FinancialParameters.analysis_period, ' Should be 25.')
+            print('cl.Outputs.adjusted_installed cost',
+                  cl.Outputs.adjusted_installed_cost,
+                  'Should be $223,249.')
+            check_yearly_savings_tuple = tuple(np.subtract(
+                cl.Outputs.cf_energy_value, cl.Outputs.cf_operating_expenses))
+            print('check_yearly_savings_tuple: ', check_yearly_savings_tuple)
+            print('check_payback: ', cl.Outputs.payback)
+            print('check_discounted_payback: ',
+                  cl.Outputs.discounted_payback)
             print()
-         
-npv = 0.0
-yearly_savings_tuple = ()
-discounted_yearly_savings_tuple = ()
-starting_system_capacity = pv.SystemDesign.system_capacity
-starting_insurance_rate = cl.FinancialParameters.insurance_rate
-if verbose:
-    print('Starting system capacity: ', starting_system_capacity)
-    print('Total analysis period: ',cl.FinancialParameters.analysis_period) 
-    print('rate_sheet.cell_value(1, 0) ', rate_sheet.cell_value(1, 0) )
-year = cl.FinancialParameters.analysis_period + \
-        rate_sheet.cell_value(1, 0)
-end_year = year
-if verbose:
-    print('Initially, year is: ', year) 
-    print('cl.FinancialParameters.real_discount_rate', cl.FinancialParameters.
-      real_discount_rate) 
-    print()
-
- 
-# iterate over the ranges of years with different rates, starting from
-# the last one, moving toward the earliers range.
-for i in range(rate_sheet.nrows-1, 0, -1):  # Ditch the titles.        
 
-    if verbose:
-        print(i, rate_sheet.cell_value(i,0))
-    
-    year = rate_sheet.cell_value(i, 0)
-    years_old = year - rate_sheet.cell_value(1, 0)
-    temp_list = [list(x) for x in ur.ElectricityRates.ur_ec_tou_mat]
-    temp_list[0][4] = rate_sheet.cell_value(i, 1)
-    temp_list[1][4] = rate_sheet.cell_value(i, 2)
-    ur.ElectricityRates.ur_ec_tou_mat = tuple(temp_list)
-    if verbose:
-        print('ur.ElectricityRates.ur_ec_tou_mat[0][4]', 
-              ur.ElectricityRates.ur_ec_tou_mat[0][4])
-    period = end_year - year
-    pv.SystemDesign.system_capacity = starting_system_capacity*\
-        (1 - 0.01*degradation)**(years_old)
-    if verbose:
-        print('System_Capacity (kW): ', pv.SystemDesign.system_capacity)
-        print('Year: ', year, 'Years Old: ', years_old,'Period: ', period)
-    cl.FinancialParameters.analysis_period = period
-    cl.FinancialParameters.insurance_rate = \
-            starting_insurance_rate / \
-            (1 - 0.01*degradation)**years_old
-    if verbose:
-        print('cl.FinancialParameters.insurance_rate', 
-          cl.FinancialParameters.insurance_rate)
-    pv.execute()
-    ur.execute()
-    cl.execute()
-    # We need to account for insurance when we turn down the initial install
-    # size, because in the full calculation, it is a percent of the initial
-    # installed cost.  If that cost goes down, we have a problem.
-
-    # net_installed_cost = (cl.Outputs.adjusted_installed_cost\
-    #     - 40000)*(1 - 0.01*dc_degradation)**(years_old) + 40000
-    net_installed_cost = cl.SystemCosts.total_installed_cost
-    if i != 1:
-        npv = npv + (cl.Outputs.npv + net_installed_cost)/\
-            (1+0.01*cl.FinancialParameters.real_discount_rate)**years_old
+    # Get the rate data from the excel spreadsheet.
+    if testing:
+        xl_file_path = 'Rates_Flat.xlsx'
     else:
-        npv = npv + cl.Outputs.npv  
-    end_year = year
+        xl_file_path = dialogs.ask_rates_path()
+    rates = api.load_rates(xl_file_path)
     if verbose:
-        print('End year: ', end_year)
-        print('Year: ', year, 'NPV: ', npv)
-        print('Annual AC output: ', pv.Outputs.ac_annual)
-        print('ur_ec_tou_mat: ', ur.ElectricityRates.ur_ec_tou_mat)
-        print('cl.Outputs.npv: ', cl.Outputs.npv)
-        print('cl.FinancialParameters.analysis_period: ', 
-          cl.FinancialParameters.analysis_period)
-        print('cl.FinancialParameters.real_discount_rate: ',
-          cl.FinancialParameters.real_discount_rate)
-        print('cl.Outputs.adjusted_installed cost', 
-          cl.Outputs.adjusted_installed_cost)
-        print('net_installed_cost', net_installed_cost)
-        print('cl.SystemCosts.total_installed_cost', 
-              cl.SystemCosts.total_installed_cost)
+        print('The rates you have are:')
+        for row in rates:
+            print(row)
         print()
-        
-    installed_cost = cl.Outputs.adjusted_installed_cost   
-    if verbose:
-        print('years_old: ', years_old)
-        print('cl.Outputs.cf_energy_value: ', cl.Outputs.cf_energy_value)
-        print('cl.Outputs.cf_operating_expenses: ', 
-              cl.Outputs.cf_operating_expenses)
-        print('yearly_savings_tuple: ', yearly_savings_tuple)
-    temp_tuple = tuple(np.subtract(cl.Outputs.cf_energy_value,
-                cl.Outputs.cf_operating_expenses)*\
-            (1 + 0.01*cl.FinancialParameters.inflation_rate)**(years_old))
-    yearly_savings_tuple = temp_tuple + yearly_savings_tuple
-    yearly_savings_tuple = yearly_savings_tuple[1: \
-                                len(yearly_savings_tuple)]
-    if verbose:
-        print('yearly_savings_tuple: ', yearly_savings_tuple)
-#     discounted_yearly_savings_tuple = tuple(np.subtract(\
-#         cl.Outputs.cf_energy_value,
-#         cl.Outputs.cf_operating_expenses)/ \
-# # This cannot work. It raises all values to the years_old.
-#         (1+0.01*cl.FinancialParameters.real_discount_rate)**years_old) + \
-#                 discounted_yearly_savings_tuple
-
-years_payback = 0
-sum_simple_savings = 0 
-for simple_savings in yearly_savings_tuple:
-        sum_simple_savings = sum_simple_savings + simple_savings
-        if sum_simple_savings < installed_cost:
-            years_payback = years_payback + 1
-        else:
-            previous_sum_simple_savings = sum_simple_savings - simple_savings
-            part_year = (installed_cost - previous_sum_simple_savings)\
-                /simple_savings
-            years_payback = years_payback + part_year
-            # The 2 is because the first element of the tuple is 0.0.
-            break  
-print('Simple Payback Period (years): ', years_payback)
-if verbose:
-    print('check_payback: ', check_payback)
-
-# discounted_years_payback = 0
-# sum_discounted_savings = 0 
-# for discounted_savings in discounted_yearly_savings_tuple:
-#         sum_discounted_savings = sum_discounted_savings + discounted_savings
-#         if sum_discounted_savings < installed_cost:
-#             discounted_years_payback = discounted_years_payback + 1
-#         else:
-#             previous_sum_discounted_savings = sum_discounted_savings - \
-#                 discounted_savings
-#             part_year = (installed_cost - previous_sum_discounted_savings)\
-#                 /simple_savings
-#             discounted_years_payback = discounted_years_payback - 2 + part_year
-#             # The 2 is because the first element of the tuple is 0.0.
-#             break  
-# print('Discounted Payback Period (years): ', discounted_years_payback)
-# if verbose:
-#     print('check_discounted_payback: ', check_discounted_payback)
-if testing:
-    if round(npv) != round(npv_single_stage):
-        print('\nError:  NPV computed by stages does not equal NPV computed '
-          'directly!  NPV directly is: ', npv_single_stage, '\n')
-        
-print('NPV: ', npv) 
-        
-        
-root = tk.Tk()
-root.withdraw()
-
 
+    # The system is installed in the first year of the rate table.
+    evaluation = api.evaluate(case, rates, [rates[0][0]], workers=1,
+                              cash_flow=cash_flow,
+                              exact_generation=exact_generation)
+    npv = evaluation.npv[0]
+    print('Simple Payback Period (years): ', evaluation.payback[0])
+    print('Discounted Payback Period (years): ',
+          evaluation.discounted_payback[0])
+    if verbose:
+        print('yearly_savings_tuple: ',
+              tuple(evaluation.results[0].yearly_savings))
+    if testing:
+        if round(npv) != round(npv_single_stage):
+            print('\nError:  NPV computed by stages does not equal NPV '
+                  'computed directly!  NPV directly is: ', npv_single_stage,
+                  '\n')
+        paybacks = (evaluation.payback[0], evaluation.discounted_payback[0])
+        if not np.allclose(paybacks, paybacks_single_stage):
+            print('\nError:  Paybacks computed by stages', paybacks,
+                  'do not equal the paybacks computed directly',
+                  paybacks_single_stage, '\n')
+    print('NPV: ', npv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by LEAC_iter.py and LEAC_plot_iter.py.
+
+The scripts evaluate a PVWatts Distributed Commercial system from a SAM
+JSON export against a tariff that changes over time (the Guam LEAC fuel
+surcharge).  The pieces that both scripts need, and that are worth keeping
+out of the hot loop, live here, along with a headless API (leac.api), a
+command line interface (python -m leac, see leac/cli.py), a batch runner
+for many cases (python -m leac.batch) and benchmarks (python -m
+leac.benchmark).
+
+License: MIT
+"""
+
+from leac.generation import GenerationCache, LifetimeGeneration
+from leac.models import build_models, base_values
+from leac.ratetable import RateTable
+from leac.segments import rate_window, evaluate_segments
+from leac.sweep import sweep
+from leac.montecarlo import MonteCarlo
+from leac.optimize import Optimum
+from leac.incremental import Evaluator
+from leac.api import (Case, Evaluation, load_case, load_rates, evaluate,
+                      single_stage, monte_carlo, evaluate_scenarios,
+                      battery_sizes)
+
+__all__ = ['GenerationCache', 'LifetimeGeneration', 'build_models',
+           'base_values', 'rate_window', 'evaluate_segments', 'sweep', 'Case',
+           'Evaluation', 'load_case', 'load_rates', 'evaluate',
+           'single_stage', 'MonteCarlo', 'monte_carlo', 'Evaluator',
+           'RateTable', 'Optimum', 'evaluate_scenarios', 'battery_sizes']
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""python -m leac: see leac/cli.py."""
+
+import sys
+
+from leac.cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+Importable, headless entry points.
+
+    case = load_case('100kW_PVWatts_05degr.json')
+    rates = load_rates('Rates.xlsx')
+    evaluation = evaluate(case, rates, range(2020, 2025))
+    print(evaluation.npv)
+    mc = monte_carlo(case, rates, range(2020, 2025), trajectories=10000)
+    best = optimize(case, rates, range(2020, 2025),
+                    bounds={'system_capacity': (50, 300), 'tilt': (0, 30)})
+    spread = evaluate_scenarios(case, rates, range(2020, 2025),
+                                loads='loads.npy')
+    sizes = battery_sizes(case, rates, range(2020, 2025),
+                          kwh=[0, 100, 200], kw=[50, 100])
+    swings = sensitivity(case, rates, range(2020, 2025),
+                         ranges={'degradation': (0.25, 1.0)})
+
+    what_if = evaluator(case)   # Re-evaluates only what a rate edit touches.
+    evaluation = evaluate(case, rates, range(2020, 2025), evaluator=what_if)
+
+Nothing here imports tkinter or matplotlib; the scripts and the command
+line interface (python -m leac) do that only when asked to show a dialog
+or draw a plot.
+
+License: MIT
+"""
+
+import collections
+import csv
+import json
+
+import numpy as np
+
+from leac import bills
+from leac import casecache
+from leac import incremental
+from leac import instrument
+from leac import lifetime
+from leac import montecarlo
+from leac import ratetable
+from leac import sensitivity as inputs_sensitivity
+from leac import storage
+from leac.generation import GenerationCache
+from leac.models import build_models, base_values
+from leac.optimize import Optimum, optimize as optimize_design
+from leac.results import CashFlowTable
+from leac.sweep import stream, sweep
+
+# inputs is models.model_inputs(dic) when the case came from the cache.
+Case = collections.namedtuple('Case', ['path', 'dic', 'inputs'],
+                              defaults=[None])
+
+# cash_flows is the results.CashFlowTable of the yearly cash flows, when
+# the NumPy cash flow kernel worked them out (cash_flow='numpy' or
+# 'lifetime', without an evaluator).
+Evaluation = collections.namedtuple('Evaluation', [
+    'install_years', 'npv', 'payback', 'discounted_payback', 'results',
+    'cash_flows'], defaults=[None])
+
+# How many install years the scripts look at by default.
+YEARS_TO_PLOT = 5
+
+
+def load_case(json_path, cache=True):
+    """
+    Read the JSON SAM writes with Generate code -> JSON for Inputs.  With
+    cache, repeat loads of the same file come from leac.casecache.
+    """
+    if cache:
+        dic, inputs = casecache.load(json_path)
+        return Case(json_path, dic, inputs)
+    with instrument.span('json.parse'), open(json_path) as f:
+        return Case(json_path, json.load(f))
+
+
+def load_rates(path, sheet='Rates'):
+    """
+    Read the rate table: Year, first block rate, remaining kWh rate, with a
+    title row.  Excel workbooks need a sheet called sheet; .csv files are
+    read as they are.  Returns a ratetable.RateTable, which also works as
+    the list of rows without the title row.
+    """
+    return ratetable.read(path, sheet)
+
+
+def default_install_years(rates, count=YEARS_TO_PLOT):
+    """count install years starting with the first year in the rate table."""
+    first = int(rates[0][0])
+    return range(first, first + count)
+
+
+def single_stage(case):
+    """
+    Run the whole analysis period once with the tariff in the JSON, as the
+    scripts' testing mode does.  Returns the executed pv, ur and cl.
+    """
+    pv, ur, cl = build_models(case.dic, case.inputs)
+    with instrument.span('pv.execute'):
+        pv.execute()
+    with instrument.span('ur.execute'):
+        ur.execute()
+    with instrument.span('cl.execute'):
+        cl.execute()
+    return pv, ur, cl
+
+
+def check_against_sam(pv, cl):
+    """
+    Compare a single_stage() run of 100kW_PVWatts_05degr.json with the
+    numbers SAM gives for it.  Returns a list of error messages.
+    """
+    messages = []
+    if round(pv.Outputs.ac_annual) != 134580:
+        messages.append('Annual AC Output doesn\'t agree with SAM!')
+    if round(cl.Outputs.npv) != 138348:
+        messages.append('Net Present Value doesn\'t agree with SAM!')
+    if round(cl.Outputs.adjusted_installed_cost) != 223249:
+        messages.append('Net installed cost doesn\'t agree with SAM!')
+    return messages
+
+
+def evaluator(case, exact_generation=False, analytic_bills=True):
+    """
+    An incremental.Evaluator for case, to pass to evaluate() while trying
+    out edits to the rate table.
+    """
+    return incremental.Evaluator(case.dic, case.inputs,
+                                 exact_generation=exact_generation,
+                                 analytic_bills=analytic_bills)
+
+
+def evaluate(case, rates, install_years=None, workers=None,
+             cash_flow='numpy', exact_generation=False, analytic_bills=True,
+             evaluator=None):
+    """
+    NPV and paybacks of case for each install year under the changing
+    rates.  See leac.sweep.sweep for workers, cash_flow, exact_generation
+    and analytic_bills; cash_flow='lifetime' evaluates every install year
+    in one pass over the whole analysis period instead (leac.lifetime, in
+    this process).  Raises ValueError if rates has rows past the end
+    of the first install year's analysis period.  With an evaluator (see
+    evaluator()) only the segments and install years that rate table edits
+    since its last use affect are recomputed, in this process; workers,
+    cash_flow and the rest are then ignored.  The yearly cash flows of
+    the NumPy kernel come back as Evaluation.cash_flows.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    table = None
+    if evaluator is None and cash_flow in ('numpy', 'lifetime'):
+        table = CashFlowTable(install_years, case.dic['analysis_period'])
+    if evaluator is not None:
+        results = evaluator.evaluate(rates, install_years)
+    elif cash_flow == 'lifetime':
+        results = lifetime.evaluate(case.dic, rates, install_years,
+                                    inputs=case.inputs,
+                                    analytic_bills=analytic_bills, out=table)
+    else:
+        results = sweep(case.dic, rates, install_years, workers=workers,
+                        exact_generation=exact_generation,
+                        cash_flow=cash_flow, inputs=case.inputs,
+                        analytic_bills=analytic_bills, out=table)
+    if table is not None and results:
+        return Evaluation(table.install_years, table.npv, table.payback,
+                          table.discounted_payback, results, table)
+    return collect(zip(install_years, results))
+
+
+def evaluate_stream(case, rates, install_years=None, workers=None,
+                    cash_flow='numpy', exact_generation=False,
+                    analytic_bills=True, cancel=None):
+    """
+    evaluate() one install year at a time: yields (install year,
+    segments.SegmentResult) as each install year finishes, in the order
+    they finish.  cancel is a threading.Event that stops the sweep when
+    set (see leac.sweep.stream).  cash_flow='lifetime' evaluates every
+    install year in its one pass and then yields them all.  collect()
+    makes an Evaluation of what came back.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    if cash_flow == 'lifetime':
+        results = lifetime.evaluate(case.dic, rates, install_years,
+                                    inputs=case.inputs,
+                                    analytic_bills=analytic_bills)
+        for year, result in zip(install_years, results):
+            if cancel is not None and cancel.is_set():
+                return
+            yield year, result
+        return
+    for index, result in stream(case.dic, rates, install_years,
+                                workers=workers,
+                                exact_generation=exact_generation,
+                                cash_flow=cash_flow, inputs=case.inputs,
+                                analytic_bills=analytic_bills,
+                                cancel=cancel):
+        yield install_years[index], result
+
+
+def collect(pairs):
+    """
+    An Evaluation of (install year, segments.SegmentResult) pairs, such
+    as evaluate_stream() yields, in the order given.
+    """
+    pairs = list(pairs)
+    results = [result for _, result in pairs]
+    return Evaluation(
+        install_years=np.array([year for year, _ in pairs], dtype=np.int64),
+        npv=np.array([result.npv for result in results]),
+        payback=np.array([result.payback for result in results]),
+        discounted_payback=np.array([result.discounted_payback
+                                     for result in results]),
+        results=results)
+
+
+def monte_carlo(case, rates, install_years=None, trajectories=1000,
+                rate_model='random_walk', spread=0.1, seed=None, annual=True,
+                workers=None, exact_generation=False, analytic_bills=True):
+    """
+    NPV and paybacks of case for each install year under trajectories
+    sampled rate paths around the rate table (see leac.montecarlo).
+
+    rate_model: 'random_walk' or 'per_year'.
+    spread:     yearly log standard deviation of the random walk, or the
+                relative standard deviation of the per year draws.
+    annual:     rates change every year rather than only in the rate
+                table's years.
+
+    Returns a montecarlo.MonteCarlo.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    if annual:
+        years = montecarlo.annual_years(rates, install_years,
+                                        case.dic['analysis_period'])
+    else:
+        years = ratetable.as_table(rates).year
+    if rate_model == 'random_walk':
+        paths = montecarlo.random_walk(rates, years, trajectories, spread,
+                                       seed=seed)
+    elif rate_model == 'per_year':
+        paths = montecarlo.per_year(rates, years, trajectories, spread,
+                                    seed=seed)
+    else:
+        raise ValueError('rate_model must be one of %s, not %r'
+                         % (', '.join(montecarlo.RATE_MODELS), rate_model))
+    return montecarlo.simulate(case.dic, years, paths, install_years,
+                               workers=workers,
+                               exact_generation=exact_generation,
+                               inputs=case.inputs,
+                               analytic_bills=analytic_bills)
+
+
+def optimize(case, rates, install_years=None, bounds=None, costs=None,
+             points=5, levels=4, workers=None, exact_generation=False,
+             analytic_bills=True):
+    """
+    The system_capacity, dc_ac_ratio and tilt with the largest NPV for
+    each install year, within bounds (see leac.optimize for bounds, costs,
+    points and levels).  Returns an optimize.Optimum.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    return optimize_design(case.dic, rates, install_years, bounds=bounds,
+                           costs=costs, points=points, levels=levels,
+                           workers=workers,
+                           exact_generation=exact_generation,
+                           inputs=case.inputs,
+                           analytic_bills=analytic_bills)
+
+
+def evaluate_scenarios(case, rates, install_years=None, loads=None,
+                       export_limits=None, chunk_size=None):
+    """
+    NPV and paybacks of case for each install year under each hourly load
+    and export limit scenario (see leac.scenarios).  loads and
+    export_limits are scenario files or (scenarios, 8760) arrays.
+    Returns a scenarios.Scenarios.
+    """
+    # Imported here so that python -m leac.scenarios runs the module once.
+    from leac import scenarios
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    if isinstance(loads, str):
+        loads = scenarios.open_profiles(loads)
+    if isinstance(export_limits, str):
+        export_limits = scenarios.open_profiles(export_limits)
+    return scenarios.evaluate(case.dic, rates, install_years, loads=loads,
+                              export_limits=export_limits,
+                              chunk_size=chunk_size or scenarios.CHUNK_SIZE,
+                              inputs=case.inputs)
+
+
+def battery_sizes(case, rates, install_years=None, kwh=(0.0,), kw=(0.0,),
+                  costs=None, workers=None, analytic_bills=True):
+    """
+    NPV and paybacks of case with a Battwatts battery of every kwh and kw
+    pair, for each install year (see leac.storage).  Returns a
+    storage.SizeSweep.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    return storage.size_sweep(case.dic, rates, install_years, kwh, kw,
+                              costs=costs, workers=workers,
+                              inputs=case.inputs,
+                              analytic_bills=analytic_bills)
+
+
+def sensitivity(case, rates, install_years=None, names=None,
+                step=inputs_sensitivity.STEP, ranges=None, workers=None,
+                exact_generation=False, analytic_bills=True):
+    """
+    NPV of case for each install year with each of names (by default the
+    sensitivity.DEFAULT_INPUTS that are not zero in the case) set -/+
+    step from the case's value, and each of ranges set to its (low,
+    high), one at a time (see leac.sensitivity).  Returns a
+    sensitivity.Sensitivity.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    rates.check_years(install_years, case.dic['analysis_period'])
+    return inputs_sensitivity.sensitivity(
+        case.dic, rates, install_years, names=names, step=step,
+        ranges=ranges, workers=workers, exact_generation=exact_generation,
+        inputs=case.inputs, analytic_bills=analytic_bills)
+
+
+def check_bills(case, rates, install_years=None):
+    """
+    Largest difference ($) between the leac.bills and the Utilityrate5
+    energy values over every segment of every install year.  Raises
+    bills.UnsupportedTariff if the case's tariff is not one leac.bills
+    models.
+    """
+    if install_years is None:
+        install_years = default_install_years(rates)
+    pv, ur, cl = build_models(case.dic, case.inputs)
+    gen_cache = GenerationCache()
+    gen_cache.seed(pv)
+    return bills.validate(pv, ur, cl, rates,
+                          [int(year) for year in install_years],
+                          base_values(pv, cl), gen_cache)
+
+
+def rows(evaluation):
+    """
+    One dictionary of plain Python numbers per install year, or per install
+    year and percentile for a montecarlo.MonteCarlo or a
+    scenarios.Scenarios.  An optimize.Optimum has its design in each row
+    too, and a storage.SizeSweep has a row per battery size and install
+    year.  A sensitivity.Sensitivity has a row per install year and input,
+    widest NPV swing first, as a tornado chart draws them.
+    """
+    from leac.scenarios import Scenarios
+    if isinstance(evaluation, (montecarlo.MonteCarlo, Scenarios)):
+        return _percentile_rows(evaluation)
+    if isinstance(evaluation, Optimum):
+        return _design_rows(evaluation)
+    if isinstance(evaluation, storage.SizeSweep):
+        return _size_rows(evaluation)
+    if isinstance(evaluation, inputs_sensitivity.Sensitivity):
+        return _sensitivity_rows(evaluation)
+    return [{'install_year': int(year), 'npv': float(npv),
+             'payback': float(payback),
+             'discounted_payback': float(discounted_payback)}
+            for year, npv, payback, discounted_payback in
+            zip(evaluation.install_years, evaluation.npv,
+                evaluation.payback, evaluation.discounted_payback)]
+
+
+def _percentile_rows(mc):
+    spread = montecarlo.percentiles(mc)
+    return [{'install_year': int(year), 'percentile': q,
+             'npv': float(spread['npv'][i, k]),
+             'payback': float(spread['payback'][i, k]),
+             'discounted_payback': float(spread['discounted_payback'][i, k])}
+            for k, year in enumerate(mc.install_years)
+            for i, q in enumerate(montecarlo.PERCENTILES)]
+
+
+def _design_rows(optimum):
+    return [{'install_year': int(year), 'system_capacity': float(capacity),
+             'dc_ac_ratio': float(ratio), 'tilt': float(tilt),
+             'npv': float(npv), 'payback': float(payback),
+             'discounted_payback': float(discounted_payback)}
+            for year, capacity, ratio, tilt, npv, payback, discounted_payback
+            in zip(optimum.install_years, optimum.system_capacity,
+                   optimum.dc_ac_ratio, optimum.tilt, optimum.npv,
+                   optimum.payback, optimum.discounted_payback)]
+
+
+def _size_rows(sizes):
+    return [{'install_year': int(year), 'batt_kwh': float(kwh),
+             'batt_kw': float(kw), 'npv': float(sizes.npv[i, k]),
+             'payback': float(sizes.payback[i, k]),
+             'discounted_payback': float(sizes.discounted_payback[i, k])}
+            for k, year in enumerate(sizes.install_years)
+            for i, (kwh, kw) in enumerate(zip(sizes.kwh, sizes.kw))]
+
+
+def _sensitivity_rows(result):
+    rows = []
+    for k, year in enumerate(result.install_years):
+        rows.extend({'install_year': int(year), 'input': result.names[i],
+                     'low': float(result.low[i]),
+                     'high': float(result.high[i]),
+                     'npv': float(result.npv[k]),
+                     'npv_low': float(result.npv_low[i, k]),
+                     'npv_high': float(result.npv_high[i, k]),
+                     'elasticity': float(result.elasticity[i, k])}
+                    for i in inputs_sensitivity.widest_first(result, k))
+    return rows
+
+
+def write_json(evaluation, f, **extra):
+    """Write the results as JSON; extra keys go in the top level object."""
+    document = dict(extra)
+    document['results'] = rows(evaluation)
+    with instrument.span('results.write'):
+        json.dump(document, f, indent=2)
+        f.write('\n')
+
+
+def write_csv(evaluation, f):
+    table = rows(evaluation)
+    writer = csv.DictWriter(f, fieldnames=list(table[0]) if table else
+                            ['install_year', 'npv', 'payback',
+                             'discounted_payback'])
+    with instrument.span('results.write'):
+        writer.writeheader()
+        writer.writerows(table)
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runs over many cases and rate tables, with a resumable results store.
+
+    python -m leac.batch manifest.csv results.sqlite --workers 8
+    python -m leac.batch manifest.csv results.sqlite --export results.csv
+
+The manifest lists one job per row: a SAM JSON export, a rate table and
+the install years, as CSV
+
+    case,rates,start,years
+    buildings/gym.json,tariffs/Rates.xlsx,2020,10
+    buildings/chapel.json,tariffs/Rates_Flat.xlsx,,
+
+or as JSON, a list of objects with the same keys.  Paths are relative to
+the manifest.  start defaults to the first year of the rate table and
+years to api.YEARS_TO_PLOT.
+
+Jobs run in a process pool, one job per task, each job's sweep running
+serially in its worker.  Every finished job is written to a SQLite
+database straight away, in its own transaction, so an interrupted run
+loses at most the jobs that were running.  A job is known by a hash of
+the contents of the case JSON, the weather file it names and the rate
+table, the install years and the evaluation options, so rerunning the
+manifest skips everything already in the store, as well as repeats of a
+job within the manifest, even under different file names, and runs a
+case again when its weather file changes.  Failed jobs are recorded with
+their error and tried again on the next run.
+
+The store has two tables:
+
+    jobs        key, case, rates, install_years, options, status ('done'
+                or 'failed'), error, seconds, finished
+    results     key, install_year, npv, payback, discounted_payback
+
+License: MIT
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import traceback
+
+from leac import api, casecache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    "case" TEXT,
+    rates TEXT,
+    install_years TEXT,
+    options TEXT,
+    status TEXT,
+    error TEXT,
+    seconds REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT,
+    install_year INTEGER,
+    npv REAL,
+    payback REAL,
+    discounted_payback REAL,
+    PRIMARY KEY (key, install_year)
+);
+"""
+
+
+def read_manifest(path):
+    """
+    The jobs in the CSV or JSON manifest at path: dictionaries with case,
+    rates (absolute paths), start and years (None if not given).
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = [row for row in csv.DictReader(f)
+                    if any((value or '').strip() for value in row.values())]
+    here = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        if not row.get('case') or not row.get('rates'):
+            raise ValueError('%s: job %d needs a case and a rates file.'
+                             % (path, number))
+        jobs.append({
+            'case': os.path.join(here, str(row['case']).strip()),
+            'rates': os.path.join(here, str(row['rates']).strip()),
+            'start': _optional_int(row.get('start')),
+            'years': _optional_int(row.get('years')),
+        })
+    return jobs
+
+
+def _optional_int(value):
+    if value is None or str(value).strip() == '':
+        return None
+    return int(float(value))
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _weather_hash(case_path):
+    """
+    _file_hash() of the weather file the case names, found as leac.weather
+    finds it (the path as given, from the working directory), or None if
+    there is no such file.
+    """
+    with open(case_path) as f:
+        path = json.load(f).get('solar_resource_file')
+    if not path or not os.path.isfile(path):
+        return None
+    return _file_hash(path)
+
+
+def job_key(job, options):
+    """
+    Content hash of a job: case, weather and rates bytes, years and
+    options.
+    """
+    blob = json.dumps([_file_hash(job['case']), _weather_hash(job['case']),
+                       _file_hash(job['rates']), job['start'], job['years'],
+                       options, casecache.pysam_version()], sort_keys=True)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def connect(path):
+    """Open (creating if needed) the results store at path."""
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def finished_keys(db):
+    return set(key for key, in
+               db.execute("SELECT key FROM jobs WHERE status = 'done'"))
+
+
+def _record(db, key, job, outcome, options):
+    status, seconds, evaluation, error = outcome
+    install_years = (list(map(int, evaluation.install_years))
+                     if evaluation is not None else None)
+    with db:  # One transaction per job.
+        db.execute('DELETE FROM results WHERE key = ?', (key,))
+        if evaluation is not None:
+            db.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?)',
+                [(key, row['install_year'], row['npv'], row['payback'],
+                  row['discounted_payback'])
+                 for row in api.rows(evaluation)])
+        db.execute('INSERT OR REPLACE INTO jobs VALUES '
+                   '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   (key, job['case'], job['rates'],
+                    json.dumps(install_years), json.dumps(options), status,
+                    error, seconds, time.time()))
+
+
+def run_job(job, options):
+    """
+    Evaluate one manifest job.  Returns (status, seconds, evaluation or
+    None, error message or None); errors are reported, not raised, so one
+    bad case does not stop the batch.
+    """
+    start_time = time.perf_counter()
+    try:
+        case = api.load_case(job['case'])
+        rates = api.load_rates(job['rates'])
+        start = job['start'] if job['start'] is not None else int(rates[0][0])
+        years = job['years'] if job['years'] is not None else \
+            api.YEARS_TO_PLOT
+        evaluation = api.evaluate(case, rates, range(start, start + years),
+                                  workers=1, **options)
+        return 'done', time.perf_counter() - start_time, evaluation, None
+    except Exception:
+        return ('failed', time.perf_counter() - start_time, None,
+                traceback.format_exc())
+
+
+def _run_keyed(keyed_job):
+    key, job, options = keyed_job
+    return key, run_job(job, options)
+
+
+def run(manifest, store, workers=None, log=None, **options):
+    """
+    Run every job of manifest (a path, or read_manifest() jobs) not
+    already done in the SQLite store at store.  options go to
+    api.evaluate (cash_flow, exact_generation, analytic_bills).  log, if
+    given, is called with (job, key, status, error) as jobs finish.
+
+    Returns (jobs run, jobs skipped, jobs failed).  A job whose files
+    cannot be read counts as failed without being run or stored.
+    """
+    jobs = read_manifest(manifest) if isinstance(manifest, str) else manifest
+    db = connect(store)
+    try:
+        done = finished_keys(db)
+        pending = {}
+        skipped = failed = 0
+        for job in jobs:
+            try:
+                key = job_key(job, options)
+            except OSError as e:
+                failed += 1  # Nothing to record it under.
+                if log:
+                    log(job, '-', 'failed', str(e))
+                continue
+            if key in done or key in pending:
+                skipped += 1
+            else:
+                pending[key] = job
+        keyed_jobs = [(key, job, options) for key, job in pending.items()]
+        if workers == 1 or len(keyed_jobs) <= 1:
+            outcomes = map(_run_keyed, keyed_jobs)
+            pool = None
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            outcomes = (future.result() for future in
+                        concurrent.futures.as_completed(
+                            [pool.submit(_run_keyed, keyed_job)
+                             for keyed_job in keyed_jobs]))
+        try:
+            for key, outcome in outcomes:
+                _record(db, key, pending[key], outcome, options)
+                if outcome[0] != 'done':
+                    failed += 1
+                if log:
+                    log(pending[key], key, outcome[0], outcome[3])
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return len(keyed_jobs), skipped, failed
+    finally:
+        db.close()
+
+
+def export(store, f):
+    """Write every stored result as CSV, one row per install year."""
+    db = connect(store)
+    try:
+        writer = csv.writer(f)
+        writer.writerow(['case', 'rates', 'install_year', 'npv', 'payback',
+                         'discounted_payback'])
+        writer.writerows(db.execute(
+            'SELECT jobs."case", jobs.rates, install_year, npv, payback, '
+            'discounted_payback FROM results JOIN jobs USING (key) '
+            'ORDER BY jobs."case", jobs.rates, install_year'))
+    finally:
+        db.close()
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac.batch',
+        description='Evaluate every (case, rates, install years) job of a '
+                    'manifest into a SQLite results store, skipping jobs '
+                    'already there.')
+    p.add_argument('manifest', nargs='?',
+                   help='CSV or JSON manifest (case, rates, start, years)')
+    p.add_argument('store', help='SQLite results file (created if missing)')
+    p.add_argument('--workers', type=int,
+                   help='worker processes (default: one per CPU)')
+    p.add_argument('--cash-flow', choices=['numpy', 'pysam', 'lifetime'],
+                   default='numpy')
+    p.add_argument('--exact-generation', action='store_true')
+    p.add_argument('--utilityrate', action='store_true',
+                   help='run Utilityrate5 instead of the analytic bills')
+    p.add_argument('--export', metavar='CSV',
+                   help='write the stored results to CSV ("-" for stdout)')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if not args.manifest and not args.export:
+        parser().error('give a manifest to run, or --export')
+    if args.manifest:
+        def log(job, key, status, error):
+            print('%s %s %s %s' % (key[:10], status,
+                                   os.path.basename(job['case']),
+                                   os.path.basename(job['rates'])))
+            if error:
+                print(error, file=sys.stderr)
+        count, skipped, failed = run(
+            args.manifest, args.store, workers=args.workers, log=log,
+            cash_flow=args.cash_flow, exact_generation=args.exact_generation,
+            analytic_bills=not args.utilityrate)
+        print('%d run, %d skipped, %d failed' % (count, skipped, failed))
+    if args.export:
+        if args.export == '-':
+            export(args.store, sys.stdout)
+        else:
+            with open(args.export, 'w', newline='') as f:
+                export(args.store, f)
+    return 1 if args.manifest and failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
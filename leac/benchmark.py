@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the segmented NPV pipeline.
+
+    python -m leac.benchmark --save baseline.json
+    ... change something ...
+    python -m leac.benchmark --baseline baseline.json
+
+Everything runs on the bundled 100kW_PVWatts_05degr.json, Rates.xlsx and
+Rates_Flat.xlsx.  The weather file the JSON names is not shipped, so by
+default PVWatts gets a synthetic one: a clear sky year at the Guam site
+with a fixed pattern of cloudy days, written as a SAM CSV file.  It is a
+pure function of the year, so the outputs are the same on every machine.
+--weather uses a real file instead, and if it is the one the JSON names
+the single stage run is also checked against SAM.
+
+Timed stages, each repeated and reported as the fastest and median time:
+
+    json_load           json.load of the case
+    case_cache_cold     leac.casecache.load into an empty cache
+    case_cache_warm     leac.casecache.load again
+    ssc_tables          models.model_inputs (dict_to_ssc_table, export)
+    build_models        models.build_models from those inputs
+    pv_execute, ur_execute, cl_execute
+                        one single stage execute() of each module
+    segment_loop_pysam  segments.evaluate_segments, Cashloan per segment
+    segment_loop_ur     segments.segment_energy_values with Utilityrate5
+    segment_loop_bills  segments.segment_energy_values with leac.bills
+    sweep_*             sweep.sweep over install years and rate rows
+    lifetime_*          leac.lifetime, the same install years in one pass
+    scenarios_*         leac.scenarios over that many hourly load profiles
+    battery_sizes       leac.storage over a grid of Battwatts battery sizes
+    optimize_5y         leac.optimize over capacity and tilt (OPTIMIZE)
+    service_warm        a leac.server request for a case and rate file it
+                        already holds
+
+The bundled case does not degrade, so the bundled rate tables are swept
+again (the *_degraded stages) with the case at DEGRADATION % a year,
+which is where the segments' shrinking capacity shows up in the joins.
+
+The sweeps run the bundled rate tables and synthetic ones of 5, 25 and 50
+yearly rows (the bundled table's rates, rippled) for 5, 25 and 100 install
+years.  A rate row must fall inside the analysis period of every install
+year that sees it, so the install years of the longer tables start late
+enough for that.
+
+Every sweep's NPVs and paybacks, and the search's designs and Pvwattsv7
+runs, are kept with the timings.  Comparing with a baseline (--baseline)
+flags stages more than --tolerance slower and any output that moved, so a
+speedup cannot quietly change the answers.  The run also cross-checks the
+NumPy cash flow kernel against Cashloan, the analytic bills against
+Utilityrate5, process pool sweeps against serial ones, the one pass
+lifetime NPVs against the segmented ones, the Rates_Flat.xlsx NPVs (whose
+rates are the case's own) against a single stage run, all of these with
+and without degradation, a process pool search against a serial one, and
+the scenarios' copy of the case's load and the battery sizes without a
+battery against the one pass NPVs.  The exit status is 1 if anything is
+flagged.
+
+The caches go to a temporary directory (LEAC_CACHE_DIR is set for the
+run), so cold and warm mean the same thing every time.
+
+License: MIT
+"""
+
+import argparse
+import collections
+import functools
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASE = os.path.join(HERE, '100kW_PVWatts_05degr.json')
+RATES = os.path.join(HERE, 'Rates.xlsx')
+RATES_FLAT = os.path.join(HERE, 'Rates_Flat.xlsx')
+
+# Adventist World Radio, Agat, Guam.
+SITE = {'lat': 13.39, 'lon': 144.66, 'tz': 10.0, 'elev': 10.0}
+
+INSTALL_YEARS = (5, 25, 100)
+RATE_ROWS = (5, 25, 50)
+# Hourly load profiles in the scenarios stage.
+SCENARIOS = 256
+# The battery_sizes stage's grid (kWh, kW); the first kWh is no battery.
+BATTERY_KWH = (0, 100, 200, 400)
+BATTERY_KW = (50, 100)
+# The optimize_5y stage's search (grid points and refinement levels).
+OPTIMIZE = {'points': 3, 'levels': 2}
+# Degradation (% a year) of the *_degraded stages.
+DEGRADATION = 0.5
+
+Timing = collections.namedtuple('Timing', ['best', 'median', 'repeat'])
+
+
+def synthetic_weather(path, year=2001, site=SITE):
+    """
+    Write a year of hourly SAM CSV weather for site to path: clear sky
+    irradiance (a simple Meinel/Liu-Jordan model) thinned on cloudy days,
+    and a daily temperature cycle.  Hours are hour ending, as in TMY3.
+    """
+    from leac import weather
+    hours = np.arange(8760)
+    day = hours//24 + 1
+    # Sun position in the middle of each hour, local standard time.
+    solar_time = (hours % 24 + 0.5 + (site['lon'] - 15*site['tz'])/15)
+    b = 2*math.pi*(day - 81)/364
+    solar_time = solar_time + (9.87*np.sin(2*b) - 7.53*np.cos(b) -
+                               1.5*np.sin(b))/60
+    declination = np.radians(23.45)*np.sin(2*math.pi*(284 + day)/365)
+    latitude = math.radians(site['lat'])
+    hour_angle = np.radians(15*(solar_time - 12))
+    cos_zenith = (np.sin(latitude)*np.sin(declination) +
+                  np.cos(latitude)*np.cos(declination)*np.cos(hour_angle))
+    up = cos_zenith > 0.01
+    air_mass = np.where(up, 1/np.maximum(cos_zenith, 0.01), 0.0)
+    dni = np.where(up, 1353*0.7**(air_mass**0.678), 0.0)
+    dhi = np.where(up, 0.1*dni*cos_zenith + 20*cos_zenith, 0.0)
+    # Two cloudy days a week, and a wet season from July to November.
+    clearness = np.where(day % 7 < 2, 0.35, 1.0)*np.where(
+        (day > 181) & (day < 335), 0.85, 1.0)
+    diffuse_gain = 1 + 1.5*(1 - clearness)
+    dni = dni*clearness
+    dhi = dhi*diffuse_gain
+    ghi = dni*cos_zenith*up + dhi
+    data = dict(site)
+    data.update({
+        'year': np.full(8760, float(year)),
+        'month': np.array([time.strptime('%d %d' % (year, d), '%Y %j')
+                           .tm_mon for d in day], dtype=float),
+        'day': np.array([time.strptime('%d %d' % (year, d), '%Y %j')
+                         .tm_mday for d in day], dtype=float),
+        'hour': (hours % 24).astype(float),
+        'gh': np.round(ghi), 'dn': np.round(dni), 'df': np.round(dhi),
+        'tdry': np.round(27 + 3*np.sin(2*math.pi*(hours % 24 - 9)/24), 1),
+        'wspd': np.full(8760, 3.0),
+    })
+    with open(path, 'w', newline='') as f:
+        weather.write_sam_csv(data, f)
+    return path
+
+
+def synthetic_rates(rates, rows, analysis_period):
+    """
+    A rate table of rows yearly rows starting in the first year of rates,
+    following rates with a ripple so every row differs, and the first
+    install year whose analysis period covers all of it.
+    """
+    from leac import montecarlo
+    first = int(rates[0][0])
+    years = np.arange(first, first + rows)
+    ripple = 1 + 0.05*np.sin(np.arange(rows))
+    prices = montecarlo.sheet_path(rates, years)*ripple[:, None]
+    table = [[float(year), float(first_block), float(rest)]
+             for year, (first_block, rest) in zip(years, prices)]
+    return table, max(first, first + rows - int(analysis_period))
+
+
+def timed(function, repeat):
+    """(Timing, result of the last call) of repeat calls of function."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return Timing(min(times), statistics.median(times), repeat), result
+
+
+def _outputs(results):
+    return {'npv': [float(r.npv) for r in results],
+            'payback': [float(r.payback) for r in results],
+            'discounted_payback': [float(r.discounted_payback)
+                                   for r in results]}
+
+
+def _optimum_outputs(optimum):
+    return {'system_capacity': optimum.system_capacity.tolist(),
+            'tilt': optimum.tilt.tolist(), 'npv': optimum.npv.tolist(),
+            'pv_runs': [optimum.pv_runs],
+            'candidates': [optimum.candidates]}
+
+
+def load_case(weather_path=None, degradation=None):
+    """
+    The bundled case, with its weather file replaced by weather_path and,
+    if given, its degradation (% a year) by degradation.
+    """
+    from leac import api
+    case = api.load_case(CASE)
+    if weather_path:
+        case.dic['solar_resource_file'] = weather_path
+        case.inputs['pvwattsv7']['SolarResource']['solar_resource_file'] = \
+            weather_path
+    if degradation is not None:
+        # The SSC tables are made again from the changed copy.
+        case = api.Case(case.path, dict(case.dic, degradation=[degradation]))
+    return case
+
+
+def _single_stage_npv(case):
+    from leac import models
+    pv, ur, cl = models.build_models(case.dic, case.inputs)
+    for model in (pv, ur, cl):
+        model.execute()
+    return cl.Outputs.npv
+
+
+def run(weather_path=None, repeat=3, workers=1, install_years=INSTALL_YEARS,
+        rate_rows=RATE_ROWS, log=None):
+    """
+    Run every benchmark.  Returns a document holding the environment,
+    'timings' ({stage: {'best', 'median', 'repeat'}}), 'outputs' ({sweep:
+    {'npv', 'payback', 'discounted_payback'}}) and 'checks' (messages from
+    the cross-checks; empty when they all pass).  log, if given, is called
+    with each stage's name and Timing as it finishes.
+    """
+    from leac import (api, bills, casecache, cashflow, lifetime, models,
+                      montecarlo, scenarios, server, storage)
+    from leac.generation import GenerationCache
+    from leac.segments import (rate_window, evaluate_segments,
+                               segment_energy_values, window_segments)
+    from leac.sweep import sweep
+
+    timings = collections.OrderedDict()
+    outputs = collections.OrderedDict()
+    checks = []
+
+    def stage(name, function, times=repeat):
+        timing, result = timed(function, times)
+        timings[name] = timing._asdict()
+        if log:
+            log(name, timing)
+        return result
+
+    scratch = tempfile.mkdtemp(prefix='leac-benchmark-')
+    previous_cache_dir = os.environ.get('LEAC_CACHE_DIR')
+    os.environ['LEAC_CACHE_DIR'] = os.path.join(scratch, 'cache')
+    try:
+        real_weather = weather_path
+        if not weather_path:
+            weather_path = synthetic_weather(os.path.join(scratch,
+                                                          'weather.csv'))
+
+        def load_json():
+            with open(CASE) as f:
+                return json.load(f)
+        dic = stage('json_load', load_json)
+        stage('case_cache_cold', lambda: casecache.load(CASE), times=1)
+        stage('case_cache_warm', lambda: casecache.load(CASE))
+        case = load_case(weather_path)
+        stage('ssc_tables', lambda: models.model_inputs(dic))
+        stage('build_models', lambda: models.build_models(case.dic,
+                                                          case.inputs))
+
+        pv, ur, cl = models.build_models(case.dic, case.inputs)
+        stage('pv_execute', pv.execute)
+        stage('ur_execute', ur.execute)
+        stage('cl_execute', cl.execute)
+        outputs['single_stage'] = {'ac_annual': [float(pv.Outputs.ac_annual)],
+                                   'npv': [float(cl.Outputs.npv)]}
+        checks.extend(cashflow.cross_check(ur, cl,
+                                           pv.SystemDesign.system_capacity))
+        checks.extend(bills.cross_check(ur))
+        if real_weather and os.path.basename(real_weather) == \
+                os.path.basename(dic['solar_resource_file'].replace('\\',
+                                                                    '/')):
+            checks.extend(api.check_against_sam(pv, cl))
+
+        rates = api.load_rates(RATES)
+        pv, ur, cl = models.build_models(case.dic, case.inputs)
+        base = models.base_values(pv, cl)
+        gen_cache = GenerationCache()
+        gen_cache.seed(pv)
+        window = rate_window(rates, int(rates[0][0]))
+        stage('segment_loop_pysam', lambda: evaluate_segments(
+            pv, ur, cl, window, base, gen_cache))
+        segments = window_segments(window, base.analysis_period)
+        stage('segment_loop_ur', lambda: segment_energy_values(
+            pv, ur, cl, segments, base, gen_cache))
+        flat_bills = bills.FlatBills(bills.flat_tariff(ur))
+        stage('segment_loop_bills', lambda: segment_energy_values(
+            pv, ur, cl, segments, base, gen_cache, flat_bills))
+        worst = bills.validate(pv, ur, cl, rates, range(int(rates[0][0]),
+                                                        int(rates[0][0]) + 5),
+                               base, gen_cache)
+        if worst >= bills.CENT:
+            checks.append('Analytic bills are off from Utilityrate5 by $%.4f '
+                          'in a Rates.xlsx segment.' % worst)
+
+        def sweep_stage(name, table, years, case=case, **options):
+            options.setdefault('workers', workers)
+            options.setdefault('cash_flow', 'numpy')
+            results = stage(name, lambda: sweep(
+                case.dic, table, years, inputs=case.inputs, **options))
+            outputs[name] = _outputs(results)
+            return results
+
+        def lifetime_stage(name, table, years, case=case):
+            results = stage(name, lambda: lifetime.evaluate(
+                case.dic, table, years, inputs=case.inputs))
+            outputs[name] = _outputs(results)
+            segmented = outputs[name.replace('lifetime', 'sweep', 1)]
+            if not np.allclose(outputs[name]['npv'], segmented['npv'],
+                               rtol=1e-9, atol=1e-6):
+                checks.append('%s: the one pass NPVs are not the segmented '
+                              'ones.' % name)
+
+        degraded = load_case(weather_path, DEGRADATION)
+        single_npv = {'': outputs['single_stage']['npv'][0],
+                      '_degraded': _single_stage_npv(degraded)}
+        outputs['single_stage_degraded'] = {
+            'npv': [float(single_npv['_degraded'])]}
+        for suffix, source in (('', case), ('_degraded', degraded)):
+            for label, path in (('rates', RATES),
+                                ('rates_flat', RATES_FLAT)):
+                table = api.load_rates(path)
+                years = api.default_install_years(table, 5)
+                name = 'sweep_%s_5y%s' % (label, suffix)
+                numpy_results = sweep_stage(name, table, years, source)
+                pysam_results = sweep_stage(name + '_pysam', table, years,
+                                            source, cash_flow='pysam')
+                for year, a, b in zip(years, numpy_results, pysam_results):
+                    if abs(a.npv - b.npv) > 1e-6*max(abs(b.npv), 1.0):
+                        checks.append('%s%s %d: NumPy cash flow NPV %r, '
+                                      'Cashloan %r.' % (label, suffix, year,
+                                                        a.npv, b.npv))
+                lifetime_stage('lifetime_%s_5y%s' % (label, suffix), table,
+                               years, source)
+            # Rates_Flat.xlsx has the case's own rates in every row, so
+            # however the segments are joined every install year has to
+            # come out at the single stage NPV.
+            for name in ('sweep_rates_flat_5y%s' % suffix,
+                         'sweep_rates_flat_5y%s_pysam' % suffix,
+                         'lifetime_rates_flat_5y%s' % suffix):
+                if not np.allclose(outputs[name]['npv'], single_npv[suffix],
+                                   rtol=1e-9):
+                    checks.append('%s: the NPVs are not the single stage '
+                                  'NPV %r.' % (name, single_npv[suffix]))
+        # The case's load, then evenly scaled copies of it.
+        loads = scenarios.scaled(
+            os.path.join(scratch, 'loads.npy'), case.dic['load'],
+            np.r_[1.0, np.linspace(0.8, 1.2, SCENARIOS - 1)])
+        name = 'scenarios_%d' % SCENARIOS
+        # Bound now: loads is deleted below, before the scratch files go.
+        spread = stage(name, functools.partial(
+            scenarios.evaluate, case.dic, rates,
+            api.default_install_years(rates, 5), loads=loads,
+            inputs=case.inputs))
+        outputs[name] = {key: value.ravel().tolist() for key, value in
+                         montecarlo.percentiles(spread).items()}
+        if not np.allclose(spread.npv[0], outputs['lifetime_rates_5y']['npv'],
+                           rtol=1e-6):
+            checks.append("%s: the case's load does not give the one pass "
+                          'NPVs.' % name)
+        del loads, spread  # Unmapped before the scratch files go.
+        sizes = stage('battery_sizes', lambda: storage.size_sweep(
+            case.dic, rates, api.default_install_years(rates, 5),
+            kwh=BATTERY_KWH, kw=BATTERY_KW, workers=workers,
+            inputs=case.inputs))
+        outputs['battery_sizes'] = {
+            'npv': sizes.npv.ravel().tolist(),
+            'payback': sizes.payback.ravel().tolist(),
+            'discounted_payback': sizes.discounted_payback.ravel().tolist()}
+        if not np.allclose(sizes.npv[sizes.kwh == 0],
+                           outputs['lifetime_rates_5y']['npv'],
+                           rtol=1e-9, atol=1e-6):
+            checks.append('battery_sizes: no battery does not give the one '
+                          'pass NPVs.')
+        optimum = stage('optimize_5y', lambda: api.optimize(
+            case, rates, api.default_install_years(rates, 5),
+            workers=workers, **OPTIMIZE), times=1)
+        # The Pvwattsv7 runs are outputs too, so a baseline flags a search
+        # that starts simulating more.
+        outputs['optimize_5y'] = _optimum_outputs(optimum)
+        # The case with the benchmark's weather, for the service to read.
+        served_case = os.path.join(scratch, 'case.json')
+        with open(served_case, 'w') as f:
+            json.dump(dict(dic, solar_resource_file=weather_path), f)
+        pool = server.CasePool({'case': served_case})
+        request = {'case': 'case', 'rates': RATES}
+        pool.evaluate(request)
+        stage('service_warm', lambda: pool.evaluate(request))
+        for rows in rate_rows:
+            table, first = synthetic_rates(rates, rows, base.analysis_period)
+            for count in install_years:
+                sweep_stage('sweep_%dr_%dy' % (rows, count), table,
+                            range(first, first + count))
+            count = max(install_years)
+            lifetime_stage('lifetime_%dr_%dy' % (rows, count), table,
+                           range(first, first + count))
+        years = api.default_install_years(rates, 5)
+        # Degraded, the workers read rows of the parent's lifetime
+        # generation other than the nameplate one.
+        for suffix, source in (('', case), ('_degraded', degraded)):
+            for cash_flow in ('numpy', 'pysam'):
+                name = 'sweep_rates_5y%s%s' % (
+                    suffix, '_pysam' if cash_flow == 'pysam' else '')
+                parallel = _outputs(sweep(source.dic, rates, years,
+                                          workers=2, inputs=source.inputs,
+                                          cash_flow=cash_flow))
+                if parallel != outputs[name]:
+                    checks.append('A two process sweep does not give the '
+                                  '%s results.' % name)
+        # Each plant's generation goes from job to job, so the workers
+        # cannot change the designs, the NPVs or the runs.
+        if _optimum_outputs(api.optimize(
+                case, rates, years, workers=2,
+                **OPTIMIZE)) != outputs['optimize_5y']:
+            checks.append('A two process search does not give the '
+                          'optimize_5y results.')
+    finally:
+        if previous_cache_dir is None:
+            os.environ.pop('LEAC_CACHE_DIR', None)
+        else:
+            os.environ['LEAC_CACHE_DIR'] = previous_cache_dir
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return collections.OrderedDict([
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('pysam', casecache.pysam_version()),
+        ('machine', platform.platform()),
+        ('weather', os.path.basename(real_weather) if real_weather
+         else 'synthetic'),
+        ('workers', workers),
+        ('timings', timings),
+        ('outputs', outputs),
+        ('checks', checks),
+    ])
+
+
+def compare(document, baseline, tolerance=0.25, floor=0.005, rtol=1e-9,
+            atol=1e-6):
+    """
+    Messages for every stage of document more than tolerance (a fraction)
+    and floor seconds slower than in baseline, and every output that is
+    not within rtol/atol of the baseline's.  Outputs are only compared
+    when both ran on the same weather.
+    """
+    messages = []
+    for name, timing in document['timings'].items():
+        before = baseline.get('timings', {}).get(name)
+        if before is None:
+            continue
+        if (timing['best'] > before['best']*(1 + tolerance) and
+                timing['best'] - before['best'] > floor):
+            messages.append('%s: %.4f s, was %.4f s (%+.0f%%)'
+                            % (name, timing['best'], before['best'],
+                               100*(timing['best']/before['best'] - 1)))
+    if document['weather'] != baseline.get('weather'):
+        messages.append('Outputs not compared: weather %s, baseline %s.'
+                        % (document['weather'], baseline.get('weather')))
+        return messages
+    for name, values in document['outputs'].items():
+        before = baseline.get('outputs', {}).get(name)
+        if before is None:
+            continue
+        for key, now in values.items():
+            was = before.get(key)
+            if was is None or len(was) != len(now) or not np.allclose(
+                    now, was, rtol=rtol, atol=atol):
+                messages.append('%s %s changed: %s, was %s'
+                                % (name, key, now, was))
+    return messages
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac.benchmark',
+        description='Time the stages of the segmented NPV pipeline on the '
+                    'bundled case and rate tables.')
+    p.add_argument('--baseline', metavar='FILE',
+                   help='compare with the results saved in FILE')
+    p.add_argument('--save', metavar='FILE',
+                   help='save the results (timings and outputs) to FILE')
+    p.add_argument('--tolerance', type=float, default=0.25,
+                   help='flag stages this fraction slower than the baseline '
+                        '(default: %(default)s)')
+    p.add_argument('--repeat', type=int, default=3,
+                   help='runs of each stage (default: %(default)s)')
+    p.add_argument('--workers', type=int, default=1,
+                   help='worker processes for the sweeps (default: '
+                        '%(default)s)')
+    p.add_argument('--weather', metavar='FILE',
+                   help='real weather file instead of the synthetic one')
+    p.add_argument('--quick', action='store_true',
+                   help='only the smallest synthetic sweep size')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    sizes = {}
+    if args.quick:
+        sizes = {'install_years': INSTALL_YEARS[:1],
+                 'rate_rows': RATE_ROWS[:1]}
+
+    def log(name, timing):
+        print('%-34s %10.4f s %10.4f s' % (name, timing.best, timing.median))
+    print('%-34s %12s %12s' % ('stage', 'best', 'median'))
+    document = run(weather_path=args.weather, repeat=args.repeat,
+                   workers=args.workers, log=log, **sizes)
+    flagged = ['Check failed: ' + message for message in document['checks']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            flagged.extend(compare(document, json.load(f), args.tolerance))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+    for message in flagged:
+        print(message)
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Analytic bills for flat tiered tariffs, standing in for Utilityrate5.
+
+The scripts only ever change the energy prices in ur_ec_tou_mat: the first
+block (the first 55,000 kWh a month) and the remaining kWh of a flat tariff
+with a monthly fixed charge, a flat monthly demand charge and net billing.
+For that class of tariff a year's bill is simple arithmetic on the hourly
+grid purchases and sales:
+
+    energy      kWh bought each month, split into the tiers and priced,
+                less kWh sold times the sell rate
+    demand      the month's peak purchase (kW) times its flat demand price
+    fixed       the monthly fixed charge
+
+all escalated by (1 + inflation + rate escalation)**(year - 1), with the
+PV generation degraded by (1 - degradation)**(year - 1), as Utilityrate5
+does.  Everything that does not depend on the prices (the tier kWh, sales
+and peaks) is worked out once per generation profile and analysis period,
+so changing only the rates is a small matrix product for any number of
+rate rows at once.
+
+flat_tariff() reads the tariff from a Utilityrate5 model and raises
+UnsupportedTariff for anything this does not model (time of use periods,
+minimum charges, billing demand, net energy metering with rollover
+credits, time series rates, ...); callers then keep using
+UtilityRate.execute().  Metering options 2 (net billing) and 4 (buy all,
+sell all) are modelled.  quantities() also raises UnsupportedTariff if
+more than the first tier is sold in any month, which Utilityrate5 prices
+in a way this does not follow.
+
+cross_check() compares against an executed Utilityrate5 model, and
+validate() against Utilityrate5 runs of every segment of every install
+year, which is what
+
+    python -m leac 100kW_PVWatts_05degr.json Rates.xlsx --check-bills
+
+does (exit status 1 if any energy value is off by half a cent or more).
+
+License: MIT
+"""
+
+import collections
+
+import numpy as np
+
+HOURS_PER_MONTH = 24*np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+MONTH_STARTS = np.r_[0, np.cumsum(HOURS_PER_MONTH)[:-1]]
+
+NET_BILLING = 2
+BUY_ALL_SELL_ALL = 4
+
+# Half a cent: what "matches to the cent" allows.
+CENT = 0.005
+
+Tariff = collections.namedtuple('Tariff', [
+    'load', 'tier_max', 'buy_rate', 'sell_rate', 'metering_option',
+    'fixed_charge', 'demand_charge', 'inflation_rate', 'rate_escalation',
+    'load_escalation', 'degradation'])
+
+# Price independent parts of the bills, with and without the system, for
+# years 1 to period: tier kWh (period, 12, tiers), sold kWh (period, 12),
+# demand charges and fixed charges (period,) in year 1 dollars, and the
+# escalation of each year (period,).
+Quantities = collections.namedtuple('Quantities', [
+    'tier_kwh_w_sys', 'sold_kwh_w_sys', 'demand_w_sys', 'tier_kwh_wo_sys',
+    'sold_kwh_wo_sys', 'demand_wo_sys', 'fixed', 'escalation'])
+
+
+class UnsupportedTariff(ValueError):
+    """The tariff needs Utilityrate5."""
+
+
+def _single(value, name, problems):
+    values = np.atleast_1d(value)
+    if len(values) != 1:
+        problems.append(name + ' schedule')
+    return float(values[0])
+
+
+def flat_tariff(ur):
+    """
+    The Tariff described by the inputs of ur (Utilityrate5).  Raises
+    UnsupportedTariff, listing the reasons, if the analytic bills cannot
+    reproduce it.
+    """
+    er = ur.ElectricityRates.export()
+    problems = []
+    metering_option = int(er.get('ur_metering_option', 0))
+    if metering_option not in (NET_BILLING, BUY_ALL_SELL_ALL):
+        problems.append('ur_metering_option %d' % metering_option)
+    for name in ('ur_en_ts_buy_rate', 'ur_en_ts_sell_rate',
+                 'ur_monthly_min_charge', 'ur_annual_min_charge',
+                 'ur_enable_billing_demand'):
+        if er.get(name, 0):
+            problems.append(name)
+    for name in ('ur_ec_sched_weekday', 'ur_ec_sched_weekend'):
+        if np.any(np.asarray(er[name]) != 1):
+            problems.append(name + ' with more than one period')
+    ec = np.atleast_2d(np.asarray(er['ur_ec_tou_mat'], dtype=float))
+    if (np.any(ec[:, 0] != 1) or np.any(ec[:, 3] != 0) or
+            np.any(ec[:, 1] != np.arange(1, len(ec) + 1))):
+        problems.append('ur_ec_tou_mat other than one period of kWh tiers')
+    if np.any(ec[:, 5] != ec[0, 5]):
+        problems.append('different sell rates for different tiers')
+    demand_charge = np.zeros(12)
+    if er.get('ur_dc_enable', 0):
+        dc_tou = np.atleast_2d(np.asarray(er.get('ur_dc_tou_mat', ()),
+                                          dtype=float))
+        if dc_tou.size and np.any(dc_tou[:, 3] != 0):
+            problems.append('time of use demand charges')
+        flat = np.atleast_2d(np.asarray(er.get('ur_dc_flat_mat', ()),
+                                        dtype=float))
+        if (flat.shape[0] != 12 or
+                np.any(np.sort(flat[:, 0]) != np.arange(12)) or
+                np.any(flat[:, 1] != 1)):
+            problems.append('tiered or incomplete ur_dc_flat_mat')
+        else:
+            demand_charge[flat[:, 0].astype(int)] = flat[:, 3]
+    lifetime = ur.Lifetime.export()
+    if lifetime.get('system_use_lifetime_output', 0):
+        problems.append('system_use_lifetime_output')
+    load = np.asarray(ur.Load.export().get('load', ()), dtype=float)
+    if len(load) != HOURS_PER_MONTH.sum():
+        problems.append('load that is not hourly for one year')
+    rate_escalation = _single(er.get('rate_escalation', 0),
+                              'rate_escalation', problems)
+    load_escalation = _single(ur.Load.export().get('load_escalation', 0),
+                              'load_escalation', problems)
+    degradation = _single(ur.SystemOutput.export().get('degradation', 0),
+                          'degradation', problems)
+    if problems:
+        raise UnsupportedTariff('The analytic bills do not handle: ' +
+                                ', '.join(problems))
+    return Tariff(load=load, tier_max=ec[:, 2], buy_rate=ec[:, 4],
+                  sell_rate=float(ec[0, 5]), metering_option=metering_option,
+                  fixed_charge=float(er.get('ur_monthly_fixed_charge', 0)),
+                  demand_charge=demand_charge,
+                  inflation_rate=float(lifetime['inflation_rate']),
+                  rate_escalation=rate_escalation,
+                  load_escalation=load_escalation, degradation=degradation)
+
+
+def _monthly(hourly):
+    """Sum of the last axis (hours of a year) by month."""
+    return np.add.reduceat(hourly, MONTH_STARTS, axis=-1)
+
+
+def _monthly_peak(hourly):
+    return np.maximum.reduceat(hourly, MONTH_STARTS, axis=-1)
+
+
+def _tiers(bought, tier_max):
+    """Split monthly kWh bought (..., 12) into the tiers (..., 12, tiers)."""
+    upper = np.asarray(tier_max)
+    lower = np.r_[0.0, upper[:-1]]
+    return np.clip(bought[..., None] - lower, 0.0, upper - lower)
+
+
+def quantities(tariff, gen, period, load=None, export_limit=None):
+    """
+    The Quantities for hourly gen (kW, year 1) over period years.
+
+    load replaces the tariff's year 1 hourly load; it may have leading
+    axes (scenarios, 8760), and the Quantities then have them too.
+    export_limit caps the kW sold to the grid each hour, like the grid
+    interconnection or curtailment limits of SAM's grid model, and
+    broadcasts against load.
+    """
+    gen = np.asarray(gen, dtype=float)
+    load = tariff.load if load is None else np.asarray(load, dtype=float)
+    if gen.shape != tariff.load.shape or load.shape[-1:] != gen.shape:
+        raise UnsupportedTariff('gen is not hourly for one year')
+    years = np.arange(int(period))
+    load_escalation = ((1 + 0.01*tariff.load_escalation)**years)[:, None]
+    # Without the system, the monthly kWh and peaks just escalate.
+    load_kwh = _monthly(load)[..., None, :]*load_escalation
+    load_peak = _monthly_peak(load)[..., None, :]*load_escalation
+    load = load[..., None, :]*load_escalation
+    gen = gen*((1 - 0.01*tariff.degradation)**years)[:, None]
+    if tariff.metering_option == BUY_ALL_SELL_ALL:
+        bought, sold = load, np.broadcast_to(gen, load.shape)
+    else:
+        net = np.subtract(load, gen, out=load)
+        bought = np.maximum(net, 0.0)
+        sold = np.subtract(bought, net, out=net)  # max(-net, 0), exactly.
+    if export_limit is not None:
+        sold = np.minimum(sold, np.asarray(export_limit,
+                                           dtype=float)[..., None, :])
+    sold = _monthly(sold)
+    if len(tariff.tier_max) > 1 and np.any(sold > tariff.tier_max[0]):
+        # Utilityrate5 runs sales through the tiers as well, and gives an
+        # odd credit in the hour they cross into the next tier.
+        raise UnsupportedTariff('more than the first tier sold in a month')
+    escalation = (1 + 0.01*(tariff.inflation_rate +
+                            tariff.rate_escalation))**years
+    return Quantities(
+        tier_kwh_w_sys=_tiers(_monthly(bought), tariff.tier_max),
+        sold_kwh_w_sys=sold,
+        demand_w_sys=_monthly_peak(bought) @ tariff.demand_charge,
+        tier_kwh_wo_sys=_tiers(load_kwh, tariff.tier_max),
+        sold_kwh_wo_sys=np.zeros(load_kwh.shape),
+        demand_wo_sys=load_peak @ tariff.demand_charge,
+        fixed=np.full(len(years), 12*tariff.fixed_charge),
+        escalation=escalation)
+
+
+def annual_bills(tariff, q, rates):
+    """Yearly bills (rate rows, years) with and without the system."""
+    rates = np.atleast_2d(np.asarray(rates, dtype=float))
+    bills = []
+    for tier_kwh, sold_kwh, demand in (
+            (q.tier_kwh_w_sys, q.sold_kwh_w_sys, q.demand_w_sys),
+            (q.tier_kwh_wo_sys, q.sold_kwh_wo_sys, q.demand_wo_sys)):
+        energy = (rates @ tier_kwh.sum(axis=1).T -
+                  tariff.sell_rate*sold_kwh.sum(axis=1))
+        bills.append((energy + demand + q.fixed)*q.escalation)
+    return tuple(bills)
+
+
+def annual_energy_value(tariff, q, rates):
+    """
+    Utilityrate5's annual_energy_value for each rate row: (rate rows,
+    years + 1) with year 0 first, or (years + 1,) for a single row.
+    """
+    with_system, without_system = annual_bills(tariff, q, rates)
+    value = np.zeros((len(with_system), with_system.shape[1] + 1))
+    value[:, 1:] = without_system - with_system
+    return value if np.ndim(rates) > 1 else value[0]
+
+
+def full_rates(tariff, rates):
+    """rates (..., leading tiers) with the tariff's buy rates after them."""
+    rates = np.asarray(rates, dtype=float)
+    full = np.broadcast_to(tariff.buy_rate,
+                           rates.shape[:-1] + tariff.buy_rate.shape)
+    return np.concatenate([rates, full[..., rates.shape[-1]:]], axis=-1)
+
+
+def energy_value_by_year(tariff, q, rates):
+    """
+    annual_energy_value with every year at its own rates: rates (...,
+    years, leading tiers), as for FlatBills.energy_value, gives (...,
+    years + 1) with year 0 first.  The leading axes of rates and of q (see
+    quantities()) broadcast against each other.
+    """
+    rates = full_rates(tariff, rates)
+    values = []
+    for tier_kwh, sold_kwh, demand in (
+            (q.tier_kwh_w_sys, q.sold_kwh_w_sys, q.demand_w_sys),
+            (q.tier_kwh_wo_sys, q.sold_kwh_wo_sys, q.demand_wo_sys)):
+        energy = (np.einsum('...yk,...yk->...y', tier_kwh.sum(axis=-2),
+                            rates) -
+                  tariff.sell_rate*sold_kwh.sum(axis=-1))
+        values.append((energy + demand + q.fixed)*q.escalation)
+    with_system, without_system = values
+    value = np.zeros(with_system.shape[:-1] + (with_system.shape[-1] + 1,))
+    value[..., 1:] = without_system - with_system
+    return value
+
+
+class FlatBills(object):
+    """
+    annual_energy_value() with the Quantities of the most recently used
+    generation profiles and periods kept, so that rate-only changes skip
+    straight to the matrix product.
+    """
+
+    def __init__(self, tariff, max_entries=64):
+        self.tariff = tariff
+        self.max_entries = max_entries
+        self._quantities = collections.OrderedDict()
+
+    def quantities(self, gen, period, key=None):
+        """
+        The Quantities of gen over period years.  key (for example the
+        system capacity and period) identifies gen and period for reuse.
+        """
+        q = self._quantities.get(key) if key is not None else None
+        if q is None:
+            q = quantities(self.tariff, gen, period)
+            if key is not None:
+                self._quantities[key] = q
+                while len(self._quantities) > self.max_entries:
+                    self._quantities.popitem(last=False)
+        else:
+            self._quantities.move_to_end(key)
+        return q
+
+    def energy_value(self, gen, period, rates, key=None):
+        """
+        annual_energy_value of gen over period years, with key as for
+        quantities().  rates replace the leading tiers' buy rates.
+        """
+        return annual_energy_value(self.tariff,
+                                   self.quantities(gen, period, key),
+                                   full_rates(self.tariff, rates))
+
+
+def cross_check(ur, tolerance=CENT):
+    """
+    Compare the analytic bills with the Utilityrate5 run already executed
+    on ur.  Returns a list of messages; empty when everything matches (or
+    the tariff is not one the analytic bills handle).
+    """
+    value = np.asarray(ur.Outputs.annual_energy_value)
+    try:
+        tariff = flat_tariff(ur)
+        q = quantities(tariff, ur.SystemOutput.gen, len(value) - 1)
+    except UnsupportedTariff:
+        return []
+    analytic = annual_energy_value(tariff, q, tariff.buy_rate)
+    worst = np.max(np.abs(analytic - value))
+    if worst >= tolerance:
+        return ['Analytic bills are off from Utilityrate5 by up to $%.4f '
+                'a year.' % worst]
+    return []
+
+
+def validate(pv, ur, cl, rates, install_years, base, gen_cache):
+    """
+    Largest difference ($) between the analytic and the Utilityrate5
+    annual_energy_value over every segment of every install year.
+    """
+    from leac.ratetable import as_table
+    from leac.segments import segment_energy_value
+    bills = FlatBills(flat_tariff(ur))
+    table = as_table(rates)
+    worst = 0.0
+    for starting_year in install_years:
+        for segment in table.segments(starting_year, base.analysis_period):
+            args = (pv, ur, cl, base, gen_cache) + segment
+            value = np.asarray(segment_energy_value(*args))
+            analytic = segment_energy_value(*args, bills=bills)
+            worst = max(worst, float(np.max(np.abs(analytic - value))))
+    return worst
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of parsed SAM JSON exports.
+
+A SAM export is several megabytes of JSON, mostly 8760 element lists
+(load, crit_load, batt_custom_dispatch, ur_ts_sell_rate, grid_curtailment).
+Parsing it and building the pvwattsv7, utilityrate5 and cashloan SSC tables
+from it is paid again on every run.  The cache keeps both the parsed
+dictionary and the per-module input groups (models.model_inputs) in a
+directory per case:
+
+    <cache dir>/cases/<key>/case.pickle    everything but the long series
+    <cache dir>/cases/<key>/NNN.npy        one file per long series
+
+The long series come back as read-only memory-mapped NumPy arrays, so a
+repeat run neither parses JSON nor builds tables, and only touches the
+series it uses.  The key is a hash of the JSON file's bytes and the PySAM
+version, so editing the export or upgrading PySAM gets a fresh entry.
+
+The cache lives in $LEAC_CACHE_DIR, or ~/.cache/leac if that is not set.
+
+License: MIT
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from leac import instrument
+from leac import models
+
+# Lists at least this long are stored as .npy files rather than pickled.
+SERIES_LENGTH = 8760
+
+
+def cache_dir():
+    return os.environ.get('LEAC_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'leac'))
+
+
+def cases_dir():
+    return os.path.join(cache_dir(), 'cases')
+
+
+def pysam_version():
+    try:
+        from importlib import metadata
+        return metadata.version('NREL-PySAM')
+    except Exception:
+        import PySAM
+        return getattr(PySAM, '__version__', 'unknown')
+
+
+def case_key(json_bytes):
+    digest = hashlib.sha1(json_bytes)
+    digest.update(pysam_version().encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Series(object):
+    """Placeholder for a long series stored in its own .npy file."""
+
+    def __init__(self, number):
+        self.number = number
+
+
+def _is_series(value):
+    return (isinstance(value, (list, tuple)) and len(value) >= SERIES_LENGTH
+            and all(isinstance(v, (int, float)) for v in value))
+
+
+def _split(value, series):
+    """Replace the long series in value by _Series placeholders."""
+    if isinstance(value, dict):
+        return {k: _split(v, series) for k, v in value.items()}
+    if _is_series(value):
+        series.append(np.asarray(value, dtype=float))
+        return _Series(len(series) - 1)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_split(v, series) for v in value)
+    return value
+
+
+def _join(value, directory):
+    """Undo _split with memory-mapped arrays."""
+    if isinstance(value, dict):
+        return {k: _join(v, directory) for k, v in value.items()}
+    if isinstance(value, _Series):
+        return np.load(os.path.join(directory, '%03d.npy' % value.number),
+                       mmap_mode='r')
+    if isinstance(value, (list, tuple)):
+        return type(value)(_join(v, directory) for v in value)
+    return value
+
+
+def _write(directory, parsed):
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    # Write into a temporary directory and rename it into place, so a
+    # crashed run or a concurrent writer never leaves half an entry.
+    temp = tempfile.mkdtemp(dir=parent)
+    try:
+        series = []
+        skeleton = _split(parsed, series)
+        for number, array in enumerate(series):
+            np.save(os.path.join(temp, '%03d.npy' % number), array)
+        with open(os.path.join(temp, 'case.pickle'), 'wb') as f:
+            pickle.dump(skeleton, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, directory)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def load(json_path, directory=None):
+    """
+    The SAM JSON dictionary and models.model_inputs() for json_path, from
+    the cache if possible.  Returns (dic, inputs).
+    """
+    with open(json_path, 'rb') as f:
+        json_bytes = f.read()
+    entry = os.path.join(directory or cases_dir(), case_key(json_bytes))
+    if os.path.isfile(os.path.join(entry, 'case.pickle')):
+        with instrument.span('casecache.read'), \
+                open(os.path.join(entry, 'case.pickle'), 'rb') as f:
+            parsed = _join(pickle.load(f), entry)
+        return parsed['dic'], parsed['inputs']
+    with instrument.span('json.parse'):
+        dic = json.loads(json_bytes.decode('utf-8'))
+    with instrument.span('ssc_tables'):
+        inputs = models.model_inputs(dic)
+    _write(entry, {'dic': dic, 'inputs': inputs})
+    return dic, inputs
+
+
+def clear(directory=None):
+    """Remove every cached case."""
+    shutil.rmtree(directory or cases_dir(), ignore_errors=True)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy cash flow kernel standing in for Cashloan in the nonprofit case.
+
+With no taxes, no incentives and no debt, all Cashloan does for these
+scripts is subtract operating expenses (insurance and O&M) from the energy
+value Utilityrate5 computed and discount the result.  This module does the
+same arithmetic on arrays, for every install year and every rate segment at
+once:
+
+    energy_value    (install years, segments, analysis_period + 1), the
+                    Utilityrate5 annual_energy_value of each segment with
+                    year 0 first, zero past the end of the segment.
+    periods         (install years, segments), years in each segment.
+    years_old       (install years, segments), age of the system at the
+                    start of each segment.
+
+Segments are in chronological order.  Install years with fewer segments
+are padded with zero length segments, which contribute nothing.  The
+segments are joined exactly like segments.evaluate_segments joins the
+Cashloan runs, so the two agree to rounding.
+
+cross_check() compares the kernel with a single stage Cashloan run, which
+is how the scripts' testing mode uses it.
+
+License: MIT
+"""
+
+import collections
+
+import numpy as np
+
+Financials = collections.namedtuple('Financials', [
+    'analysis_period', 'inflation_rate', 'real_discount_rate',
+    'insurance_rate', 'total_installed_cost', 'om_fixed', 'om_fixed_escal',
+    'om_capacity', 'om_capacity_escal'])
+
+CashFlows = collections.namedtuple('CashFlows', [
+    'npv', 'segment_npv', 'yearly_savings', 'payback',
+    'discounted_payback'])
+
+
+def _first(value):
+    return float(np.atleast_1d(value)[0])
+
+
+def _nonzero(value):
+    return bool(np.any(np.atleast_1d(value) != 0))
+
+
+def financials(cl):
+    """The Cashloan inputs the kernel uses, read from cl."""
+    fp = cl.FinancialParameters
+    sc = cl.SystemCosts
+    return Financials(analysis_period=int(fp.analysis_period),
+                      inflation_rate=fp.inflation_rate,
+                      real_discount_rate=fp.real_discount_rate,
+                      insurance_rate=fp.insurance_rate,
+                      total_installed_cost=sc.total_installed_cost,
+                      om_fixed=_first(sc.om_fixed),
+                      om_fixed_escal=sc.om_fixed_escal,
+                      om_capacity=_first(sc.om_capacity),
+                      om_capacity_escal=sc.om_capacity_escal)
+
+
+def check_nonprofit(cl):
+    """
+    Raise ValueError if cl uses anything the kernel does not model: taxes,
+    debt, incentives, salvage value, production or fuel O&M, or O&M given
+    as a yearly schedule.
+    """
+    fp = cl.FinancialParameters
+    sc = cl.SystemCosts
+    problems = []
+    for name in ('federal_tax_rate', 'state_tax_rate', 'property_tax_rate',
+                 'debt_fraction', 'salvage_percentage'):
+        if _nonzero(getattr(fp, name)):
+            problems.append(name)
+    for name in ('om_production', 'om_fuel_cost'):
+        if _nonzero(getattr(sc, name)):
+            problems.append(name)
+    for name in ('om_fixed', 'om_capacity'):
+        if len(np.atleast_1d(getattr(sc, name))) > 1:
+            problems.append(name + ' schedule')
+    for group in (cl.TaxCreditIncentives, cl.PaymentIncentives):
+        for name, value in group.export().items():
+            if name.endswith(('_amount', '_percent')) and _nonzero(value):
+                problems.append(name)
+    if problems:
+        raise ValueError('The NumPy cash flow kernel only handles the '
+                         'nonprofit case.  Not supported: ' +
+                         ', '.join(problems))
+
+
+def nominal_discount_rate(fin):
+    """Cashloan's nominal discount rate (a fraction, not a percent)."""
+    return (1 + 0.01*fin.real_discount_rate)*(1 + 0.01*fin.inflation_rate) - 1
+
+
+def operating_expenses(fin, periods, insurance_rate, capacity):
+    """
+    Yearly operating expenses, shape periods.shape + (analysis_period + 1,),
+    zero in year 0 and past the end of each segment.  insurance_rate and
+    capacity broadcast against periods.
+    """
+    t = np.arange(fin.analysis_period + 1)
+    escalation = np.maximum(t - 1, 0)
+    inflation = 0.01*fin.inflation_rate
+    insurance = (0.01*fin.total_installed_cost *
+                 np.asarray(insurance_rate, dtype=float)[..., None] *
+                 (1 + inflation)**escalation)
+    om = (fin.om_fixed *
+          (1 + inflation + 0.01*fin.om_fixed_escal)**escalation +
+          fin.om_capacity*np.asarray(capacity, dtype=float)[..., None] *
+          (1 + inflation + 0.01*fin.om_capacity_escal)**escalation)
+    active = (t >= 1) & (t <= np.asarray(periods)[..., None])
+    return np.where(active, insurance + om, 0.0)
+
+
+def payback(savings, cost):
+    """
+    Years until the cumulative savings (project year 1 first, last axis)
+    reach cost, interpolated within the year it happens.  Install years
+    that never pay back get the number of years in savings, as in the
+    scripts' original payback loop.
+    """
+    savings = np.asarray(savings, dtype=float)
+    cumulative = np.cumsum(savings, axis=-1)
+    reached = cumulative >= cost
+    years = np.argmax(reached, axis=-1)
+    paid = np.any(reached, axis=-1)
+    taken = np.take_along_axis(savings, years[..., None], axis=-1)[..., 0]
+    before = np.take_along_axis(cumulative, years[..., None],
+                                axis=-1)[..., 0] - taken
+    with np.errstate(divide='ignore', invalid='ignore'):
+        part_year = (cost - before)/taken
+    return np.where(paid, years + part_year, float(savings.shape[-1]))
+
+
+def discount(savings, fin):
+    """savings (project year 1 first, last axis) in install year dollars."""
+    years = np.arange(1, np.shape(savings)[-1] + 1)
+    return np.asarray(savings)/(1 + nominal_discount_rate(fin))**years
+
+
+def paybacks(savings, fin, cost=None):
+    """
+    (payback, discounted payback) of savings (..., project years; year 1
+    first), against cost (default: the installed cost), with the savings
+    and their discounted values stacked into one payback() pass.
+    """
+    savings = np.asarray(savings, dtype=float)
+    if cost is None:
+        cost = fin.total_installed_cost
+    simple, discounted = payback(np.stack([savings, discount(savings, fin)]),
+                                 cost)
+    return simple, discounted
+
+
+def evaluate(energy_value, periods, years_old, fin, system_capacity=0.0,
+             out=None):
+    """
+    NPV, yearly savings and both paybacks for every install year.
+
+    energy_value, periods and years_old are described in the module
+    docstring.  system_capacity (kW) is only needed when there is capacity
+    based O&M.  Degradation only shrinks the generation the segments see:
+    insurance and capacity based O&M are for the installed system, as in
+    a single stage Cashloan run.
+
+    With out, a results.CashFlowTable of the install years, the joined
+    yearly energy value, operating expenses, savings and discounted
+    savings, the NPVs and the paybacks are written into it, and the
+    yearly_savings returned is out.savings.
+    """
+    energy_value = np.asarray(energy_value, dtype=float)
+    periods = np.asarray(periods)
+    years_old = np.asarray(years_old, dtype=float)
+    n = fin.analysis_period
+    opex = operating_expenses(fin, periods, fin.insurance_rate,
+                              system_capacity)
+    segment_cf = energy_value - opex
+    discount_factor = (1 + nominal_discount_rate(fin))**np.arange(n + 1)
+    segment_npv = (-fin.total_installed_cost +
+                   np.sum(segment_cf[..., 1:]/discount_factor[1:], axis=-1))
+    # Later segments are brought back to the install year as in the
+    # Cashloan based loop: add the installed cost back and discount at the
+    # real rate.
+    later = ((segment_npv[..., 1:] + fin.total_installed_cost) /
+             (1 + 0.01*fin.real_discount_rate)**years_old[..., 1:])
+    npv = segment_npv[..., 0] + np.sum(later, axis=-1)
+
+    # Join the segments into one row of yearly savings per install year.
+    inflation = ((1 + 0.01*fin.inflation_rate)**years_old)[..., None]
+    project_years = np.arange(1, n + 1)
+    t = project_years - years_old[..., None]  # install years, segments, n
+    inside = (t >= 1) & (t <= periods[..., None])
+    t = np.clip(t, 0, n).astype(int)
+
+    def joined(segment_values, into=None):
+        return np.sum(np.where(inside, np.take_along_axis(
+            segment_values*inflation, t, axis=-1), 0.0), axis=-2, out=into)
+    if out is None:
+        yearly_savings = joined(segment_cf)
+    else:
+        yearly_savings = joined(segment_cf, out.savings)
+        joined(energy_value, out.energy_value)
+        joined(opex, out.operating_expenses)
+        np.divide(yearly_savings, discount_factor[1:],
+                  out=out.discounted_savings)
+    simple, discounted = paybacks(yearly_savings, fin)
+    if out is not None:
+        out.npv[:] = npv
+        out.payback[:] = simple
+        out.discounted_payback[:] = discounted
+    return CashFlows(npv=npv, segment_npv=segment_npv,
+                     yearly_savings=yearly_savings, payback=simple,
+                     discounted_payback=discounted)
+
+
+def cross_check(ur, cl, system_capacity=0.0, rtol=1e-6):
+    """
+    Compare the kernel against the single stage Utilityrate5/Cashloan run
+    already executed on ur and cl.  Returns a list of messages describing
+    any disagreement; it is empty when everything matches.
+    """
+    fin = financials(cl)
+    cash_flows = evaluate(np.array(ur.Outputs.annual_energy_value)[None, None],
+                          np.array([[fin.analysis_period]]),
+                          np.zeros((1, 1)), fin, system_capacity)
+    messages = []
+    for name, kernel in (('npv', cash_flows.npv[0]),
+                         ('payback', cash_flows.payback[0]),
+                         ('discounted_payback',
+                          cash_flows.discounted_payback[0])):
+        pysam = getattr(cl.Outputs, name)
+        if abs(kernel - pysam) > rtol*max(abs(pysam), 1.0):
+            messages.append('NumPy cash flow %s %r does not agree with '
+                            'Cashloan %r.' % (name, kernel, pysam))
+    return messages + check_paybacks(cl, rtol)
+
+
+def check_paybacks(cl, rtol=1e-6):
+    """
+    Compare paybacks() of the executed Cashloan model's own yearly savings
+    (energy value less operating expenses) with its payback outputs.
+    Returns a list of messages; empty when they agree.
+    """
+    savings = np.subtract(cl.Outputs.cf_energy_value,
+                          cl.Outputs.cf_operating_expenses)[1:]
+    messages = []
+    for name, value in zip(('payback', 'discounted_payback'),
+                           paybacks(savings, financials(cl))):
+        pysam = getattr(cl.Outputs, name)
+        if abs(value - pysam) > rtol*max(abs(pysam), 1.0):
+            messages.append('The %s of the Cashloan savings, %r, does not '
+                            'agree with Cashloan\'s %r.'
+                            % (name, value, pysam))
+    return messages
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface:
+
+    python -m leac 100kW_PVWatts_05degr.json Rates.xlsx --years 10
+    python -m leac case.json rates.csv --format csv -o results.csv
+    python -m leac case.json Rates.xlsx --years 50 -o results.xlsx
+    python -m leac case.json Rates.xlsx --plot results   # results_npv.png, ...
+    python -m leac case.json Rates.xlsx --cash-flows cash_flows.parquet
+    python -m leac --gui                                 # file dialogs
+    python -m leac case.json Rates.xlsx --trajectories 10000 --seed 1
+    python -m leac case.json Rates.xlsx --trajectories 1000 --plot mc
+    python -m leac case.json Rates.xlsx --check-bills
+    python -m leac case.json Rates.xlsx --optimize --capacity 50 300 \\
+        --tilt 0 30
+    python -m leac case.json Rates.xlsx --loads loads.npy
+    python -m leac case.json Rates.xlsx --battery-kwh 0 100 200 \\
+        --battery-kw 50 100
+    python -m leac case.json Rates.xlsx --sensitivity \\
+        --range degradation 0.25 1 --plot tornado
+    python -m leac case.json Rates.xlsx --profile p.json --trace t.json
+
+Results go to standard output (or -o) as JSON or CSV, or with -o to an
+.xlsx or .parquet file, with the yearly savings (see leac/export.py).
+With --trajectories they are percentiles over sampled rate paths (see
+leac/montecarlo.py), and with --loads or --export-limits percentiles over
+hourly scenarios (see leac/scenarios.py).  With --optimize they are the
+best system size, dc_ac_ratio and tilt for each install year and its NPV
+(see leac/optimize.py), and with --battery-kwh and --battery-kw the NPV
+of each battery size (see leac/storage.py).  With --sensitivity they are
+the NPV with each input set low and high in turn, widest swing first
+(see leac/sensitivity.py).  --cash-flows writes the
+yearly generation, energy value, operating expenses and savings of each
+install year (see leac/results.py).  With --gui the sweep runs in a
+window that draws the charts as install years finish and can cancel it
+(see leac/sweepwindow.py).  --plot draws the charts without a display
+(see leac/render.py; python -m leac.render renders a whole manifest of
+cases in parallel).  tkinter is only imported with --gui and
+matplotlib only with --plot or --gui.  --profile and --trace write what
+leac.instrument recorded.
+
+License: MIT
+"""
+
+import argparse
+import os
+import sys
+
+from leac import api, export, instrument, sensitivity
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac',
+        description='NPV and payback of a SAM PVWatts Commercial case '
+                    'against a tariff that changes over time, for each '
+                    'install year.')
+    p.add_argument('case', nargs='?', help='JSON exported from SAM')
+    p.add_argument('rates', nargs='?',
+                   help='rate table (.xlsx, .xls with a Rates sheet, or .csv)')
+    p.add_argument('--start', type=int,
+                   help='first install year (default: first rate year)')
+    p.add_argument('--years', type=int, default=api.YEARS_TO_PLOT,
+                   help='number of install years (default: %(default)s)')
+    p.add_argument('--workers', type=int,
+                   help='worker processes (default: one per CPU)')
+    p.add_argument('--cash-flow', choices=['numpy', 'pysam', 'lifetime'],
+                   default='numpy',
+                   help="'pysam' runs Cashloan for every segment instead of "
+                        "the NumPy kernel (needed for taxes or debt); "
+                        "'lifetime' prices each year at its own rates in one "
+                        "pass over the analysis period")
+    p.add_argument('--exact-generation', action='store_true',
+                   help='re-run PVWatts for each capacity if it clips')
+    p.add_argument('--utilityrate', action='store_true',
+                   help='run Utilityrate5 for every segment instead of '
+                        'working out flat tariff bills directly')
+    p.add_argument('--check-bills', action='store_true',
+                   help='compare the direct bills with Utilityrate5 for '
+                        'every segment and exit')
+    p.add_argument('--no-cache', action='store_true',
+                   help='parse the JSON instead of using the parsed case '
+                        'cache ($LEAC_CACHE_DIR or ~/.cache/leac)')
+    p.add_argument('--trajectories', type=int,
+                   help='sample this many rate paths around the rate table '
+                        'and report percentiles')
+    p.add_argument('--rate-model', choices=['random-walk', 'per-year'],
+                   default='random-walk',
+                   help='how --trajectories paths are sampled')
+    p.add_argument('--spread', type=float, default=0.1,
+                   help='yearly standard deviation of the sampled rates '
+                        '(default: %(default)s)')
+    p.add_argument('--seed', type=int, help='random seed for --trajectories')
+    p.add_argument('--optimize', action='store_true',
+                   help='search for the system_capacity, dc_ac_ratio and '
+                        'tilt with the largest NPV for each install year')
+    p.add_argument('--capacity', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                   help='--optimize system_capacity bounds, kW DC (default: '
+                        'a quarter to four times the case\'s)')
+    p.add_argument('--dc-ac-ratio', type=float, nargs=2,
+                   metavar=('LOW', 'HIGH'),
+                   help="--optimize dc_ac_ratio bounds (default: the case's)")
+    p.add_argument('--tilt', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                   help='--optimize tilt bounds, degrees (default: 0 45)')
+    p.add_argument('--cost-per-kw', type=float,
+                   help='--optimize installed cost per kW DC (default: the '
+                        "case's total_installed_cost/system_capacity)")
+    p.add_argument('--inverter-cost-per-kw', type=float, default=0.0,
+                   help='--optimize installed cost per kW AC, on top of '
+                        '--cost-per-kw (default: %(default)s)')
+    p.add_argument('--loads', metavar='FILE',
+                   help='scenario file (.npy) of hourly loads to evaluate '
+                        'the case under, reporting percentiles (see '
+                        'python -m leac.scenarios)')
+    p.add_argument('--export-limits', metavar='FILE',
+                   help='scenario file (.npy) of hourly caps on the kW '
+                        'sold to the grid, as for --loads')
+    p.add_argument('--battery-kwh', type=float, nargs='+', metavar='KWH',
+                   help='battery capacities to evaluate with each '
+                        '--battery-kw, kWh (0 is no battery)')
+    p.add_argument('--battery-kw', type=float, nargs='+', metavar='KW',
+                   help='battery powers to evaluate with each '
+                        '--battery-kwh, kW')
+    p.add_argument('--battery-cost-per-kwh', type=float,
+                   help="battery cost per kWh (default: the case's "
+                        'battery_per_kWh)')
+    p.add_argument('--battery-cost-per-kw', type=float, default=0.0,
+                   help='battery cost per kW, on top of '
+                        '--battery-cost-per-kwh (default: %(default)s)')
+    p.add_argument('--sensitivity', nargs='*', metavar='INPUT',
+                   help='NPV with each input set low and high in turn '
+                        '(default: those of %s not 0 in the case; "rates" '
+                        'scales the rate table)'
+                        % ' '.join(sensitivity.DEFAULT_INPUTS))
+    p.add_argument('--sensitivity-step', type=float,
+                   default=sensitivity.STEP,
+                   help='relative low and high of --sensitivity inputs '
+                        '(default: %(default)s)')
+    p.add_argument('--range', nargs=3, action='append', default=[],
+                   metavar=('INPUT', 'LOW', 'HIGH'),
+                   help='low and high of an input for --sensitivity '
+                        '(repeatable; implies --sensitivity)')
+    p.add_argument('--format', choices=['json', 'csv', 'xlsx', 'parquet'],
+                   help='output format (default: from the -o extension, '
+                        'else json)')
+    p.add_argument('-o', '--output', help='output file (default: stdout)')
+    p.add_argument('--cash-flows', metavar='FILE',
+                   help='also write the yearly cash flows of each install '
+                        'year, in long format, as Parquet if FILE ends in '
+                        '.parquet and else as CSV')
+    p.add_argument('--sheet', default='Results',
+                   help='sheet for xlsx output; if -o is an existing .xlsx '
+                        'workbook the sheet is replaced or added and the '
+                        'rest is kept (default: %(default)s)')
+    p.add_argument('--plot', metavar='PREFIX',
+                   help='save bar charts as PREFIX_npv.png and '
+                        'PREFIX_payback.png, or with --trajectories or '
+                        '--loads fan charts and an NPV heatmap, or with '
+                        '--sensitivity a tornado chart (see '
+                        'leac/render.py)')
+    p.add_argument('--profile', metavar='FILE',
+                   help='write time and call counts per stage (PySAM '
+                        'execute calls, I/O, install years) as JSON')
+    p.add_argument('--trace', metavar='FILE',
+                   help='write every timed call as a Chrome trace, or as '
+                        'folded stacks for flamegraph.pl if FILE ends in '
+                        '.folded')
+    p.add_argument('--gui', action='store_true',
+                   help='ask for missing files with dialogs and show the '
+                        'charts')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.gui:
+        from leac import dialogs
+        if not args.case:
+            args.case = dialogs.ask_case_path()
+        if not args.rates:
+            args.rates = dialogs.ask_rates_path()
+    if not args.case or not args.rates:
+        parser().error('the case JSON and the rates file are required '
+                       '(or use --gui)')
+    if args.format is None:
+        extension = os.path.splitext(args.output or '')[1].lower()
+        args.format = {'.csv': 'csv', '.xlsx': 'xlsx',
+                       '.parquet': 'parquet'}.get(extension, 'json')
+    if args.format in ('xlsx', 'parquet') and not args.output:
+        parser().error('--format %s needs -o' % args.format)
+    scenarios = bool(args.loads or args.export_limits)
+    battery = bool(args.battery_kwh or args.battery_kw)
+    if battery and not (args.battery_kwh and args.battery_kw):
+        parser().error('--battery-kwh and --battery-kw go together')
+    inputs = args.sensitivity is not None or bool(args.range)
+    searches = (args.trajectories, args.optimize, scenarios, battery, inputs)
+    if (args.optimize or battery) and args.plot:
+        parser().error('--plot draws install year results; it does not go '
+                       'with --optimize or --battery-kwh')
+    if sum(map(bool, searches)) > 1:
+        parser().error('only one of --trajectories, --optimize, --loads or '
+                       '--export-limits, --battery-kwh and --sensitivity at '
+                       'a time')
+    if inputs and args.format in ('xlsx', 'parquet'):
+        parser().error('--sensitivity results go to JSON or CSV')
+    if args.cash_flows and (any(searches) or args.cash_flow == 'pysam'):
+        parser().error('--cash-flows needs the NumPy cash flow kernel: '
+                       '--cash-flow numpy or lifetime, and no search')
+
+    if args.profile or args.trace:
+        instrument.enable(trace=bool(args.trace))
+    case = api.load_case(args.case, cache=not args.no_cache)
+    rates = api.load_rates(args.rates)
+    start = args.start if args.start is not None else int(rates[0][0])
+    install_years = range(start, start + args.years)
+    if args.check_bills:
+        from leac import bills
+        try:
+            worst = api.check_bills(case, rates, install_years)
+        except bills.UnsupportedTariff as e:
+            print('%s: %s' % (args.case, e))
+            return 1
+        ok = worst < bills.CENT
+        print('%s: largest difference $%.6f %s'
+              % (args.case, worst, 'OK' if ok else 'FAILED'))
+        return 0 if ok else 1
+    if args.trajectories:
+        evaluation = api.monte_carlo(
+            case, rates, install_years, trajectories=args.trajectories,
+            rate_model=args.rate_model.replace('-', '_'), spread=args.spread,
+            seed=args.seed, workers=args.workers,
+            exact_generation=args.exact_generation,
+            analytic_bills=not args.utilityrate)
+    elif scenarios:
+        from leac import bills
+        try:
+            evaluation = api.evaluate_scenarios(
+                case, rates, install_years, loads=args.loads,
+                export_limits=args.export_limits)
+        except bills.UnsupportedTariff as e:
+            print('%s: %s' % (args.case, e))
+            return 1
+    elif battery:
+        from leac import storage
+        costs = storage.default_costs(case.dic)
+        if args.battery_cost_per_kwh is not None:
+            costs = costs._replace(per_kwh=args.battery_cost_per_kwh)
+        costs = costs._replace(per_kw=args.battery_cost_per_kw)
+        evaluation = api.battery_sizes(case, rates, install_years,
+                                       kwh=args.battery_kwh,
+                                       kw=args.battery_kw, costs=costs,
+                                       workers=args.workers,
+                                       analytic_bills=not args.utilityrate)
+    elif inputs:
+        try:
+            ranges = {name: (float(low), float(high))
+                      for name, low, high in args.range}
+        except ValueError:
+            parser().error('--range takes INPUT LOW HIGH, with numbers')
+        # A bare --sensitivity means the default inputs (names=None).
+        names = args.sensitivity or (
+            None if args.sensitivity is not None else ())
+        try:
+            evaluation = api.sensitivity(
+                case, rates, install_years, names=names,
+                step=args.sensitivity_step, ranges=ranges,
+                workers=args.workers, exact_generation=args.exact_generation,
+                analytic_bills=not args.utilityrate)
+        except ValueError as e:
+            parser().error(str(e))
+    elif args.optimize:
+        from leac import optimize
+        bounds = {name: tuple(value) for name, value in
+                  (('system_capacity', args.capacity),
+                   ('dc_ac_ratio', args.dc_ac_ratio), ('tilt', args.tilt))
+                  if value is not None}
+        costs = optimize.default_costs(case.dic)
+        if args.cost_per_kw is not None:
+            costs = costs._replace(per_kw_dc=args.cost_per_kw)
+        costs = costs._replace(per_kw_ac=args.inverter_cost_per_kw)
+        evaluation = api.optimize(case, rates, install_years, bounds=bounds,
+                                  costs=costs, workers=args.workers,
+                                  exact_generation=args.exact_generation,
+                                  analytic_bills=not args.utilityrate)
+    elif args.gui and not args.cash_flows:
+        from leac import sweepwindow
+        evaluation = sweepwindow.run_sweep(
+            case, rates, install_years, workers=args.workers,
+            cash_flow=args.cash_flow, exact_generation=args.exact_generation,
+            analytic_bills=not args.utilityrate)
+    else:
+        evaluation = api.evaluate(case, rates, install_years,
+                                  workers=args.workers,
+                                  cash_flow=args.cash_flow,
+                                  exact_generation=args.exact_generation,
+                                  analytic_bills=not args.utilityrate)
+
+    if args.format == 'xlsx' and os.path.exists(args.output):
+        export.upsert_sheet(evaluation, args.output, args.sheet)
+    elif args.format == 'xlsx':
+        export.write_xlsx(evaluation, args.output, args.sheet)
+    elif args.format == 'parquet':
+        export.write_parquet(evaluation, args.output)
+    else:
+        out = (open(args.output, 'w', newline='') if args.output
+               else sys.stdout)
+        try:
+            if args.format == 'csv':
+                api.write_csv(evaluation, out)
+            else:
+                api.write_json(evaluation, out, case=args.case,
+                               rates=args.rates)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    if args.cash_flows:
+        if args.cash_flows.lower().endswith('.parquet'):
+            evaluation.cash_flows.write_parquet(args.cash_flows)
+        else:
+            evaluation.cash_flows.write_csv(args.cash_flows)
+    instrument.save(args.profile, args.trace)
+
+    # Without --cash-flows, the sweep window has shown the charts already.
+    if args.gui and args.cash_flows and not any(searches):
+        from leac import plots
+        plots.bar_charts(evaluation, show=True, prefix=args.plot)
+    elif args.plot:
+        from leac import render
+        render.render(evaluation, args.plot)
+    return 0
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+The Tk file dialogs and questions the interactive scripts use.
+
+tkinter is imported, and the hidden root window made, the first time one
+of these is called, so headless runs never touch it.
+
+License: MIT
+"""
+
+_root = []
+
+
+def root():
+    """The hidden Tk root window, made the first time it is needed."""
+    import tkinter as tk
+    if not _root:
+        window = tk.Tk()  # For filedialogs
+        window.withdraw()  # No root window
+        _root.append(window)
+    return _root[0]
+
+
+def ask_case_path():
+    root()
+    from tkinter import filedialog
+    return filedialog.askopenfilename(
+        defaultextension='.json',
+        title='Select the json file generated by SAM.',
+        filetypes=[('Json file', '*.json'), ('All files', '*.*'), ])
+
+
+def ask_rates_path():
+    root()
+    from tkinter import filedialog
+    return filedialog.askopenfilename(
+        defaultextension='xlxs',
+        title='Select the excel file with tariff rate data.',
+        filetypes=[('excel 2007+', '*.xlsx'), ('excel 2003-', '*.xls'),
+                   ('All files', '*.*')])
+
+
+def ask_yes_no(title, question):
+    root()
+    from tkinter import messagebox
+    return messagebox.askquestion(title, question) == 'yes'
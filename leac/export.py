@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Writing results to files: CSV, .xlsx and Parquet, or a sheet of an
+existing .xlsx workbook.
+
+Every format gets the same table, one row per install year (or per
+install year and percentile for a Monte Carlo run):
+
+    install_year, npv, payback, discounted_payback, savings_1 ...
+
+where savings_t is the yearly savings in project year t, when the
+evaluation has them.
+
+    export.write(evaluation, 'results.xlsx')
+    export.upsert_sheet(evaluation, 'Rates_Flat.xlsx')  # Results sheet
+
+The .xlsx files are written directly as Office Open XML, a few thousand
+rows of 25 year cash flows in a fraction of a second, with fixed zip
+timestamps so the same results give the same bytes.  upsert_sheet()
+replaces the sheet if it is there and adds it if not; every other part of
+the workbook is copied across as it is.  It needs a real .xlsx file;
+legacy .xls workbooks (even ones named .xlsx) raise ValueError.  Parquet
+needs pyarrow.
+
+License: MIT
+"""
+
+import math
+import os
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from leac import instrument
+
+COLUMNS = ['install_year', 'npv', 'payback', 'discounted_payback']
+
+# The .xlsx parts a new workbook needs, besides the sheet.
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+                 'relationships')
+WORKSHEET = RELATIONSHIPS + '/worksheet'
+WORKSHEET_TYPE = ('application/vnd.openxmlformats-officedocument.'
+                  'spreadsheetml.worksheet+xml')
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+NEW_WORKBOOK = {
+    '[Content_Types].xml': XML_HEADER +
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types"><Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/><Default Extension='
+    '"xml" ContentType="application/xml"/><Override PartName='
+    '"/xl/workbook.xml" ContentType="application/vnd.openxmlformats-'
+    'officedocument.spreadsheetml.sheet.main+xml"/><Override PartName='
+    '"/xl/worksheets/sheet1.xml" ContentType="' + WORKSHEET_TYPE +
+    '"/></Types>',
+    '_rels/.rels': XML_HEADER +
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships"><Relationship Id="rId1" Type="' + RELATIONSHIPS +
+    '/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+    'xl/_rels/workbook.xml.rels': XML_HEADER +
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships"><Relationship Id="rId1" Type="' + WORKSHEET +
+    '" Target="worksheets/sheet1.xml"/></Relationships>',
+}
+# Zip entries are stamped with this rather than the time of writing.
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def table(evaluation):
+    """
+    (column names, rows) of evaluation, an api.Evaluation or a
+    montecarlo.MonteCarlo.  rows is a float array, NaN where an install
+    year has fewer years of savings than another.
+    """
+    from leac import api
+    base = api.rows(evaluation)
+    names = list(base[0]) if base else list(COLUMNS)
+    columns = [np.array([row[name] for row in base], dtype=float)
+               for name in names]
+    results = getattr(evaluation, 'results', None)
+    cash_flows = getattr(evaluation, 'cash_flows', None)
+    if cash_flows is not None and results:
+        names += ['savings_%d' % (t + 1)
+                  for t in range(cash_flows.analysis_period)]
+        columns += list(cash_flows.savings.T)
+    elif results:
+        savings = [np.asarray(result.yearly_savings, dtype=float)
+                   for result in results]
+        years = max(len(s) for s in savings)
+        padded = np.full((len(savings), years), np.nan)
+        for k, s in enumerate(savings):
+            padded[k, :len(s)] = s
+        names += ['savings_%d' % (t + 1) for t in range(years)]
+        columns += list(padded.T)
+    return names, np.column_stack(columns) if columns else np.zeros((0, 0))
+
+
+def _text(value, integer):
+    if not math.isfinite(value):
+        return ''
+    if integer:
+        return str(int(value))
+    return repr(value)
+
+
+def _integer_columns(names):
+    return [name in ('install_year', 'percentile') for name in names]
+
+
+def write_csv(evaluation, path):
+    names, rows = table(evaluation)
+    integer = _integer_columns(names)
+    with instrument.span('results.write'):
+        lines = [','.join(names)]
+        lines.extend(','.join(_text(value, is_int)
+                              for value, is_int in zip(row, integer))
+                     for row in rows.tolist())
+        with open(path, 'w', newline='') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def _column_letters(count):
+    letters = []
+    for i in range(count):
+        name = ''
+        i += 1
+        while i:
+            i, remainder = divmod(i - 1, 26)
+            name = chr(65 + remainder) + name
+        letters.append(name)
+    return letters
+
+
+def sheet_xml(names, rows):
+    """A worksheet part holding a title row and rows of numbers."""
+    letters = _column_letters(len(names))
+    integer = _integer_columns(names)
+    parts = [XML_HEADER, '<worksheet xmlns="%s"><sheetData><row r="1">'
+             % MAIN]
+    parts.extend('<c r="%s1" t="inlineStr"><is><t>%s</t></is></c>'
+                 % (letter, escape(name))
+                 for letter, name in zip(letters, names))
+    parts.append('</row>')
+    for number, row in enumerate(rows.tolist(), 2):
+        parts.append('<row r="%d">' % number)
+        parts.extend('<c r="%s%d"><v>%s</v></c>'
+                     % (letter, number, _text(value, is_int))
+                     for letter, value, is_int in zip(letters, row, integer)
+                     if math.isfinite(value))
+        parts.append('</row>')
+    parts.append('</sheetData></worksheet>')
+    return ''.join(parts).encode('utf-8')
+
+
+def _write_zip(path, parts):
+    """Write {name: bytes} as a zip file at path, atomically."""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        # Fast compression: the sheets are large and compress well anyway.
+        with os.fdopen(handle, 'wb') as f, \
+                zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as z:
+            for name, data in parts.items():
+                info = zipfile.ZipInfo(name, ZIP_DATE)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                z.writestr(info, data, compresslevel=1)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def write_xlsx(evaluation, path, sheet='Results'):
+    """Write the results to a new .xlsx workbook with one sheet."""
+    with instrument.span('results.write'):
+        parts = {name: text.encode('utf-8')
+                 for name, text in NEW_WORKBOOK.items()}
+        parts['xl/workbook.xml'] = (
+            XML_HEADER + '<workbook xmlns="%s" xmlns:r="%s"><sheets>'
+            '<sheet name=%s sheetId="1" r:id="rId1"/></sheets></workbook>'
+            % (MAIN, RELATIONSHIPS, quoteattr(sheet))).encode('utf-8')
+        parts['xl/worksheets/sheet1.xml'] = sheet_xml(*table(evaluation))
+        _write_zip(path, parts)
+
+
+def _attribute(element, name):
+    match = re.search(r'\s%s="([^"]*)"' % re.escape(name), element)
+    return match.group(1) if match else None
+
+
+def _resolve(base, target):
+    """A relationship target as a zip entry name."""
+    if target.startswith('/'):
+        return target[1:]
+    return os.path.normpath(os.path.join(base, target)).replace('\\', '/')
+
+
+def upsert_sheet(evaluation, path, sheet='Results'):
+    """
+    Put the results in the sheet called sheet of the .xlsx workbook at
+    path, replacing what is there or adding the sheet at the end.
+    """
+    with instrument.span('results.write'):
+        try:
+            with zipfile.ZipFile(path) as z:
+                parts = {info.filename: z.read(info)
+                         for info in z.infolist()}
+        except zipfile.BadZipFile:
+            raise ValueError('%s is not an .xlsx workbook; write the '
+                             'results to a separate file instead.' % path)
+        package_rels = parts['_rels/.rels'].decode('utf-8')
+        workbook = next(
+            _resolve('', _attribute(element, 'Target'))
+            for element in re.findall(r'<Relationship\b[^>]*>', package_rels)
+            if _attribute(element, 'Type').endswith('/officeDocument'))
+        folder = os.path.dirname(workbook)
+        rels = '%s/_rels/%s.rels' % (folder, os.path.basename(workbook))
+        workbook_xml = parts[workbook].decode('utf-8')
+        rels_xml = parts[rels].decode('utf-8')
+        prefix = re.search(r'xmlns:(\w+)="%s"' % re.escape(RELATIONSHIPS),
+                           workbook_xml).group(1)
+        sheets = re.findall(r'<(?:\w+:)?sheet\b[^>]*>', workbook_xml)
+        relationships = {_attribute(element, 'Id'): element for element in
+                         re.findall(r'<Relationship\b[^>]*>', rels_xml)}
+        content = sheet_xml(*table(evaluation))
+        for element in sheets:
+            if _attribute(element, 'name') == escape(sheet, {'"': '&quot;'}):
+                target = _attribute(
+                    relationships[_attribute(element, prefix + ':id')],
+                    'Target')
+                parts[_resolve(folder, target)] = content
+                _write_zip(path, parts)
+                return
+        sheet_id = 1 + max([int(_attribute(element, 'sheetId'))
+                            for element in sheets] or [0])
+        number = sheet_id
+        while '%s/worksheets/sheet%d.xml' % (folder, number) in parts:
+            number += 1
+        part = '%s/worksheets/sheet%d.xml' % (folder, number)
+        rid = next('rId%d' % i for i in range(1, len(relationships) + 2)
+                   if 'rId%d' % i not in relationships)
+        close = re.search(r'</(\w+:)?sheets>', workbook_xml)
+        element_prefix = close.group(1) or ''
+        workbook_xml = (
+            workbook_xml[:close.start()] +
+            '<%ssheet name=%s sheetId="%d" %s:id="%s"/>'
+            % (element_prefix, quoteattr(sheet), sheet_id, prefix, rid) +
+            workbook_xml[close.start():])
+        rels_xml = rels_xml.replace(
+            '</Relationships>',
+            '<Relationship Id="%s" Type="%s" Target="worksheets/sheet%d.xml"'
+            '/></Relationships>' % (rid, WORKSHEET, number))
+        types = parts['[Content_Types].xml'].decode('utf-8').replace(
+            '</Types>', '<Override PartName="/%s" ContentType="%s"/></Types>'
+            % (part, WORKSHEET_TYPE))
+        parts[workbook] = workbook_xml.encode('utf-8')
+        parts[rels] = rels_xml.encode('utf-8')
+        parts['[Content_Types].xml'] = types.encode('utf-8')
+        parts[part] = content
+        _write_zip(path, parts)
+
+
+def write_parquet(evaluation, path):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Writing Parquet files needs pyarrow.')
+    names, rows = table(evaluation)
+    integer = _integer_columns(names)
+    with instrument.span('results.write'):
+        columns = [rows[:, i].astype(np.int64) if is_int else rows[:, i]
+                   for i, is_int in enumerate(integer)]
+        pyarrow.parquet.write_table(pyarrow.table(columns, names=names),
+                                    path)
+
+
+def write(evaluation, path, sheet='Results'):
+    """Write the results to path as CSV, .xlsx or Parquet, by extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        write_csv(evaluation, path)
+    elif extension == '.xlsx':
+        write_xlsx(evaluation, path, sheet)
+    elif extension == '.parquet':
+        write_parquet(evaluation, path)
+    else:
+        raise ValueError('Results can be written to .csv, .xlsx or .parquet '
+                         'files, not %s.' % path)
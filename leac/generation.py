@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Generation cache for the segmented LEAC analysis.
+
+Both scripts emulate degradation by shrinking
+pv.SystemDesign.system_capacity by (1 - 0.01*degradation)**years_old for
+each rate segment and re-running Pvwattsv7.  That is a full 8760 hour
+weather driven simulation per segment, and per install year in
+LEAC_plot_iter.py, even though nothing but the nameplate changed.
+
+In PVWatts the inverter is sized from system_capacity/dc_ac_ratio, so
+shrinking the nameplate shrinks the whole plant and the hourly output
+scales with it.  The cache runs the simulation once per plant configuration
+and hands out scaled copies of the hourly gen profile.  The scaling is
+checked against one real run per configuration the first time a degraded
+variant is requested; if they disagree the configuration is simulated
+exactly from then on.  The check never changes the values handed out, so
+after seed() with the nameplate capacity every profile is a fixed function
+of capacity no matter what order the segments come in.  With exact=True
+any configuration that clips at the inverter is always simulated exactly
+(once per distinct capacity).
+
+A LifetimeGeneration is the profile of every age of a plant, the
+nameplate run degraded year by year, worked out once and kept as one
+(capacities, 8760) array, in memory or in a memory-mapped .npy file.
+Filed in a cache with add(), it answers for the degraded capacities the
+segments ask for by handing out its rows, without simulating or
+scaling.  sweep.sweep builds one in the parent process and the workers
+map its file, so Pvwattsv7 runs for the plant once per sweep rather than
+in every worker.  export() and restore() carry a plant's reference run
+and scaling check from one cache to another the same way.
+
+Typical use, replacing pv.execute() in the segment loop:
+
+    gen_cache = GenerationCache()
+    gen_cache.seed(pv)  # At the nameplate system_capacity.
+    ...
+    gen_cache.apply(pv, ur, starting_system_capacity*
+                    (1 - 0.01*degradation)**years_old)
+    ur.execute()
+    cl.execute()
+
+or, with the lifetime profile worked out up front,
+
+    gen_cache = GenerationCache()
+    gen_cache.add(LifetimeGeneration.build(gen_cache, pv, capacity,
+                                           degradation, analysis_period))
+
+License: MIT
+"""
+
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+
+from leac import instrument
+
+# Pvwattsv7 variable groups that hold inputs.  Exporting only these avoids
+# copying the 8760 hour output arrays just to build a cache key.
+PV_INPUT_GROUPS = ('SolarResource', 'Lifetime', 'SystemDesign',
+                   'AdjustmentFactors')
+
+
+def plant_key(pv):
+    """
+    Hash of everything in a Pvwattsv7 model that affects generation,
+    except system_capacity (the cache handles that by scaling).
+    """
+    inputs = {}
+    for group in PV_INPUT_GROUPS:
+        if hasattr(pv, group):
+            inputs[group] = getattr(pv, group).export()
+    inputs['SystemDesign'].pop('system_capacity', None)
+    # The segment loop changes analysis_period through the data cl shares
+    # with pv.  It only matters to PVWatts in lifetime mode.
+    lifetime = inputs.get('Lifetime', {})
+    if not lifetime.get('system_use_lifetime_output'):
+        inputs.pop('Lifetime', None)
+    blob = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+class _Plant(object):
+    """Cached simulation results for one plant configuration."""
+
+    def __init__(self, capacity, gen, clipped):
+        self.capacity = capacity
+        self.gen = gen
+        self.clipped = clipped
+        self.validated = False  # Scaling checked against a real run?
+        self.linear = True  # False once scaling failed the check.
+        self.exact = {capacity: gen}  # Real runs by system_capacity.
+        self.lifetime = None  # LifetimeGeneration, if one was added.
+
+
+class GenerationCache(object):
+    """
+    Hourly gen profiles keyed on the plant configuration.
+
+    exact:  If True, configurations that clip at the inverter are always
+            re-simulated for each distinct capacity instead of scaled.
+    rtol:   Relative tolerance (of the peak hourly output) used when
+            checking the scaled profile against a real run.
+
+    The runs, hits and scaled attributes count what the cache did, which
+    is handy when checking how many Pvwattsv7 runs a sweep really costs.
+    """
+
+    def __init__(self, exact=False, rtol=1e-4):
+        self.exact = exact
+        self.rtol = rtol
+        self.runs = 0
+        self.hits = 0
+        self.scaled = 0
+        self._plants = {}
+
+    def clear(self):
+        self._plants.clear()
+
+    def _simulate(self, pv, capacity):
+        pv.SystemDesign.system_capacity = capacity
+        with instrument.span('pv.execute'):
+            pv.execute()
+        self.runs += 1
+        return np.array(pv.Outputs.gen, dtype=float)
+
+    def gen(self, pv, capacity):
+        """
+        Hourly gen (kW) of the plant described by pv at system_capacity
+        capacity (kW).  pv.SystemDesign.system_capacity is left set to
+        capacity, as it would be after running the simulation.
+        """
+        key = plant_key(pv)
+        plant = self._plants.get(key)
+        if plant is None:
+            gen = self._simulate(pv, capacity)
+            # PVWatts clips at the AC nameplate, system_capacity/dc_ac_ratio.
+            ac_rating = capacity/pv.SystemDesign.dc_ac_ratio
+            clipped = bool(np.any(gen >= 0.999*ac_rating))
+            plant = _Plant(capacity, gen, clipped)
+            # Pvwattsv7 fills in defaults for optional inputs it was not
+            # given, so the key changes after the first run.  File the plant
+            # under both.
+            self._plants[key] = self._plants[plant_key(pv)] = plant
+            return gen
+        pv.SystemDesign.system_capacity = capacity
+        if plant.lifetime is not None and capacity in plant.lifetime.index:
+            self.hits += 1
+            return plant.lifetime.gen(plant.lifetime.index[capacity])
+        if capacity in plant.exact:
+            self.hits += 1
+            return plant.exact[capacity]
+        if not plant.linear or (self.exact and plant.clipped):
+            gen = self._simulate(pv, capacity)
+            plant.exact[capacity] = gen
+            return gen
+        gen = plant.gen*(capacity/plant.capacity)
+        if not plant.validated:
+            # The real run is only a check.  The scaled profile is what gets
+            # used, so results do not depend on which capacity came first.
+            plant.validated = True
+            real = self._simulate(pv, capacity)
+            tolerance = self.rtol*max(np.max(np.abs(real)), 1e-12)
+            if np.max(np.abs(real - gen)) > tolerance:
+                plant.linear = False
+                plant.exact[capacity] = real
+                warnings.warn('Scaled PVWatts generation does not match a '
+                              'real run at %g kW; simulating this plant '
+                              'exactly from now on.' % capacity)
+                return real
+        self.scaled += 1
+        return gen
+
+    def seed(self, pv, capacity=None):
+        """
+        Simulate pv at capacity (default: its current system_capacity) so
+        that scaled profiles are always derived from that run.  Seed with
+        the nameplate capacity to make results independent of the order in
+        which segments ask for generation.
+        """
+        if capacity is None:
+            capacity = pv.SystemDesign.system_capacity
+        return self.gen(pv, capacity)
+
+    def apply(self, pv, ur, capacity):
+        """
+        Stand-in for pv.execute(): put the gen profile for capacity into
+        the data shared by ur (and anything else made with from_existing).
+        """
+        ur.SystemOutput.gen = tuple(self.gen(pv, capacity))
+
+    def scalable(self, pv):
+        """
+        Whether the plant pv describes (simulated already) is handed out
+        scaled, as opposed to simulated for each capacity.
+        """
+        plant = self._plants[plant_key(pv)]
+        return plant.linear and not (self.exact and plant.clipped)
+
+    def export(self, pv):
+        """
+        The plant pv describes (simulated already) for restore() in another
+        cache, say in another process: its reference run and what the
+        scaling check found.  Its other real runs stay behind.
+        """
+        plant = self._plants[plant_key(pv)]
+        copy = _Plant(plant.capacity, plant.gen, plant.clipped)
+        copy.validated = plant.validated
+        copy.linear = plant.linear
+        keys = {key for key, value in self._plants.items()
+                if value is plant}
+        return keys, copy
+
+    def restore(self, pv, plant):
+        """
+        File a plant from export() as the plant pv describes, replacing
+        what this cache knew of it, so that it is scaled (or not) exactly
+        as in the cache it came from, without simulating it again.
+        """
+        keys, plant = plant
+        for key in keys | {plant_key(pv)}:
+            self._plants[key] = plant
+
+    def add(self, lifetime):
+        """
+        File a LifetimeGeneration as its plant's generation, in place of
+        simulating the plant.
+        """
+        plant = _Plant(lifetime.capacity, lifetime.gen(0), lifetime.clipped)
+        plant.validated = True
+        plant.lifetime = lifetime
+        for key in lifetime.keys:
+            self._plants[key] = plant
+
+
+class LifetimeGeneration(object):
+    """
+    Hourly gen (kW) of one plant over its life: the capacity the system
+    has at each age, and the profile at each distinct one as a row.
+    Build one with build().  Pickled, one kept in a file is just its
+    path, which is what makes it cheap to hand to worker processes.
+
+    capacity:   nameplate system_capacity (kW).
+    index:      {system_capacity: row}, for years_old 0 to years - 1.
+    keys:       plant_key()s of the plant, before and after its first run.
+    clipped:    whether the nameplate run clips at the inverter.
+    """
+
+    def __init__(self, capacity, index, keys, clipped, rows=None,
+                 path=None):
+        self.capacity = capacity
+        self.index = index
+        self.keys = tuple(keys)
+        self.clipped = clipped
+        self.path = path
+        self._rows = rows
+
+    @classmethod
+    def build(cls, gen_cache, pv, capacity, degradation, years, path=None):
+        """
+        The lifetime profile of the plant pv describes, at capacity
+        degraded by degradation (% a year) for years years, the way the
+        segments degrade it.  The profiles come from gen_cache (one run at
+        capacity, and the check of its scaling).  With path they are
+        written to that .npy file and read back memory-mapped.
+
+        Returns None if the plant cannot be scaled (see
+        GenerationCache.scalable): its profiles are not a function of the
+        nameplate run.
+        """
+        keys = [plant_key(pv)]
+        index = {}
+        for years_old in range(int(years)):
+            index.setdefault(capacity*(1 - 0.01*degradation)**years_old,
+                             len(index))
+        gens = [gen_cache.gen(pv, value) for value in index]
+        pv.SystemDesign.system_capacity = capacity
+        keys.append(plant_key(pv))
+        if not gen_cache.scalable(pv):
+            return None
+        shape = (len(gens), len(gens[0]))
+        if path is None:
+            rows = np.empty(shape)
+        else:
+            rows = np.lib.format.open_memmap(path, mode='w+', dtype=float,
+                                             shape=shape)
+        with instrument.span('generation.write'):
+            for row, gen in zip(rows, gens):
+                row[:] = gen
+            if path is not None:
+                rows.flush()
+                rows = None  # Mapped again when read.
+        plant = gen_cache._plants[keys[-1]]
+        return cls(capacity, index, set(keys), plant.clipped, rows,
+                   path and os.path.abspath(path))
+
+    @property
+    def rows(self):
+        """The (capacities, hours) array, memory-mapped if in a file."""
+        if self._rows is None:
+            self._rows = np.load(self.path, mmap_mode='r')
+        return self._rows
+
+    def gen(self, row):
+        """A copy of row row's profile."""
+        return np.array(self.rows[row], dtype=float)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.path is not None:
+            state['_rows'] = None
+        return state
+
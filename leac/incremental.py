@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental re-evaluation when only some rate rows change.
+
+Editing one year of the Rates sheet and rerunning redoes every segment of
+every install year.  Most of that work does not depend on the edited row.
+An Evaluator keeps its models warm and memoizes each stage of the
+segmented calculation on the inputs it actually depends on:
+
+    generation      GenerationCache, by degraded system_capacity
+    energy value    (years_old, period, first block rate, remaining kWh
+                    rate) of a segment: one Utilityrate5 run, or analytic
+                    bills (leac.bills)
+    install year    the install year's segments, in order: the NumPy cash
+                    flow kernel's NPV, yearly savings and paybacks
+
+A rate row is in the segments of the install years from its own year up
+to the next row's year, and in a later segment of every earlier install
+year whose analysis period reaches it.  Only those segments and install
+years miss the memo after the row is edited; the rest are looked up.
+The install year stage does not depend on the calendar year, so two
+install years with the same segments share a result too.
+
+    evaluator = Evaluator(dic)
+    results = evaluator.evaluate(rates, range(2020, 2030))
+    rates[3][1] = 0.25      # What if?
+    results = evaluator.evaluate(rates, range(2020, 2030))
+
+The computed attribute counts the entries computed so far for each stage,
+which shows how much an edit cost.  Like the NumPy cash flow kernel, this
+handles the nonprofit case only.
+
+License: MIT
+"""
+
+import collections
+
+import numpy as np
+
+from leac import cashflow, ratetable
+from leac.bills import FlatBills, UnsupportedTariff, flat_tariff
+from leac.generation import GenerationCache
+from leac.models import build_models, base_values
+from leac.segments import segment_energy_value
+from leac.sweep import _numpy_results
+
+
+class Evaluator(object):
+    """
+    Memoized NPV and paybacks of one case under changing rate tables.
+
+    dic:                SAM JSON dictionary.
+    inputs:             models.model_inputs(dic), if already at hand.
+    exact_generation, analytic_bills:
+                        as for sweep.sweep.
+    max_entries:        memo entries kept per stage, least recently used
+                        first out.
+
+    Raises ValueError if the case is not one the NumPy cash flow kernel
+    handles (see cashflow.check_nonprofit).
+    """
+
+    def __init__(self, dic, inputs=None, exact_generation=False,
+                 analytic_bills=True, max_entries=4096):
+        self.pv, self.ur, self.cl = build_models(dic, inputs)
+        cashflow.check_nonprofit(self.cl)
+        self.base = base_values(self.pv, self.cl)
+        self.financials = cashflow.financials(self.cl)
+        self.gen_cache = GenerationCache(exact=exact_generation)
+        self.gen_cache.seed(self.pv)
+        self.bills = None
+        if analytic_bills:
+            try:
+                self.bills = FlatBills(flat_tariff(self.ur))
+            except UnsupportedTariff:
+                pass  # Utilityrate5 it is.
+        self.max_entries = max_entries
+        self.computed = collections.Counter()
+        self._energy_values = collections.OrderedDict()
+        self._install_years = collections.OrderedDict()
+
+    def _lookup(self, memo, key):
+        memo.move_to_end(key)
+        return memo[key]
+
+    def _remember(self, memo, key, value):
+        memo[key] = value
+        while len(memo) > self.max_entries:
+            memo.popitem(last=False)
+
+    def segments(self, rates, starting_year):
+        """The install year's segments (see ratetable.RateTable.segments)."""
+        return tuple(ratetable.as_table(rates).segments(
+            starting_year, self.base.analysis_period))
+
+    def energy_value(self, segment):
+        """annual_energy_value (year 0 first) of one segment."""
+        if segment in self._energy_values:
+            return self._lookup(self._energy_values, segment)
+        value = np.array(segment_energy_value(
+            self.pv, self.ur, self.cl, self.base, self.gen_cache, *segment,
+            bills=self.bills))
+        value.setflags(write=False)
+        self.computed['energy_value'] += 1
+        self._remember(self._energy_values, segment, value)
+        return value
+
+    def _stacked(self, segments):
+        """What cashflow.evaluate() needs for one install year."""
+        n = int(self.base.analysis_period)
+        energy_value = np.zeros((len(segments), n + 1))
+        for i, segment in enumerate(segments):
+            value = self.energy_value(segment)
+            energy_value[i, :len(value)] = value
+        periods = np.array([period for _, period, _, _ in segments])
+        years_old = np.array([old for old, _, _, _ in segments], dtype=float)
+        return (energy_value, periods, years_old), self.financials, self.base
+
+    def evaluate(self, rates, install_years):
+        """
+        segments.SegmentResult for each of install_years, as sweep.sweep
+        with cash_flow='numpy' would return, recomputing only the stages
+        whose inputs changed since earlier calls.
+        """
+        rates = ratetable.as_table(rates)
+        keys = [self.segments(rates, int(year)) for year in install_years]
+        stale = list(collections.OrderedDict.fromkeys(
+            key for key in keys if key not in self._install_years))
+        fresh = {}
+        if stale:
+            results = _numpy_results([self._stacked(key) for key in stale])
+            fresh = dict(zip(stale, results))
+            for key, result in fresh.items():
+                self._remember(self._install_years, key, result)
+            self.computed['install_year'] += len(stale)
+        return [fresh[key] if key in fresh
+                else self._lookup(self._install_years, key) for key in keys]
+
+    def clear(self):
+        """Forget every memoized stage (the generation cache is kept)."""
+        self._energy_values.clear()
+        self._install_years.clear()
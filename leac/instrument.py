@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Timers and call counts for the stages of an evaluation.
+
+Off by default, when span() hands out one shared do-nothing context
+manager.  Switched on, every span records its wall time and call count,
+and with trace=True every call as an event too:
+
+    pv.execute, ur.execute, cl.execute
+                        the PySAM module runs
+    bills.energy_value  an analytic bill standing in for ur.execute
+    install_year        one install year of a sweep (year in the trace)
+    cash_flow           the NumPy cash flow kernel over a whole sweep
+    json.parse, casecache.read, ssc_tables
+                        loading a SAM JSON export
+    weather.parse       parsing a weather file
+    excel.read, excel.write, csv.read, results.write
+                        rate tables and results
+
+Spans nest; the summary gives each name's total and self time (without
+the spans inside it).  Worker processes of a sweep or Monte Carlo run
+record their own spans and send them back with their results, so the
+summary covers the whole run and the trace has a row per process.
+
+Switching it on without editing a script:
+
+    LEAC_PROFILE=profile.json python LEAC_plot_iter.py
+    LEAC_TRACE=trace.json python -m leac case.json Rates.xlsx
+    python -m leac case.json Rates.xlsx --profile profile.json \\
+        --trace trace.json
+
+LEAC_PROFILE writes the summary and LEAC_TRACE the trace when the program
+exits.  A trace file ending in .folded gets folded stacks for
+flamegraph.pl; anything else gets the Chrome trace event format, which
+chrome://tracing, Perfetto and speedscope open (speedscope draws it as a
+flame graph).  From Python:
+
+    instrument.enable(trace=True)
+    evaluation = api.evaluate(case, rates)
+    print(instrument.summary()['ur.execute'])
+
+License: MIT
+"""
+
+import atexit
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+_NULL = contextlib.nullcontext()
+
+_enabled = False
+_trace = False
+# name: [calls, total ns, self ns]
+_totals = collections.defaultdict(lambda: [0, 0, 0])
+_events = []
+_folded = collections.Counter()  # 'outer;inner': self ns
+_stack = []
+
+
+class _Span(object):
+
+    __slots__ = ('name', 'args', 'start', 'children')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.children = 0
+        _stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter_ns() - self.start
+        _stack.pop()
+        if _stack:
+            _stack[-1].children += elapsed
+        own = elapsed - self.children
+        total = _totals[self.name]
+        total[0] += 1
+        total[1] += elapsed
+        total[2] += own
+        if _trace:
+            _folded[';'.join([span.name for span in _stack] +
+                             [self.name])] += own
+            _events.append((self.name, self.start, elapsed, os.getpid(),
+                            threading.get_native_id(), self.args))
+        return False
+
+
+def span(name, **args):
+    """
+    Context manager timing the code it wraps under name.  args (plain
+    values) go into the trace event.
+    """
+    if not _enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(trace=False):
+    """Start recording; with trace, keep every call as an event too."""
+    global _enabled, _trace
+    _enabled = True
+    _trace = trace
+
+
+def disable():
+    """Stop recording.  What was recorded is kept."""
+    global _enabled, _trace
+    _enabled = _trace = False
+
+
+def reset():
+    """Forget everything recorded."""
+    _totals.clear()
+    del _events[:]
+    _folded.clear()
+
+
+def settings():
+    """What configure() needs to record the same way in a worker process."""
+    return {'trace': _trace} if _enabled else None
+
+
+def configure(worker_settings):
+    """
+    Set up a worker process from settings() in the parent.  A forked
+    worker starts with a copy of the parent's records, which are dropped.
+    None leaves the process as it is.
+    """
+    if worker_settings is not None:
+        reset()
+        enable(**worker_settings)
+
+
+def drain():
+    """Everything recorded so far, for merge(); the records are cleared."""
+    records = {'totals': {name: list(total)
+                          for name, total in _totals.items()},
+               'events': list(_events), 'folded': dict(_folded)}
+    reset()
+    return records
+
+
+def merge(records):
+    """Add records from drain() in another process to this one's."""
+    for name, (calls, total, own) in records['totals'].items():
+        mine = _totals[name]
+        mine[0] += calls
+        mine[1] += total
+        mine[2] += own
+    _events.extend(records['events'])
+    _folded.update(records['folded'])
+
+
+def collected(function, job):
+    """
+    function(job) in a worker process, with what it recorded:
+    (result, drain()).  Pass results to gather() in the parent.
+    """
+    return function(job), drain()
+
+
+def gather(results):
+    """The results of collected() calls, with their records merged."""
+    values = []
+    for value, records in results:
+        merge(records)
+        values.append(value)
+    return values
+
+
+def summary():
+    """
+    {name: {'calls', 'seconds', 'self_seconds', 'mean_seconds'}}, the
+    slowest first.
+    """
+    rows = sorted(_totals.items(), key=lambda item: -item[1][1])
+    return collections.OrderedDict(
+        (name, {'calls': calls, 'seconds': total*1e-9,
+                'self_seconds': own*1e-9,
+                'mean_seconds': total*1e-9/calls if calls else 0.0})
+        for name, (calls, total, own) in rows)
+
+
+def write_summary(f):
+    json.dump(summary(), f, indent=2)
+    f.write('\n')
+
+
+def write_trace(f):
+    """Write the events in the Chrome trace event format (JSON)."""
+    events = [{'name': name, 'ph': 'X', 'ts': start/1000.0,
+               'dur': elapsed/1000.0, 'pid': pid, 'tid': tid,
+               'args': args}
+              for name, start, elapsed, pid, tid, args in _events]
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    f.write('\n')
+
+
+def write_folded(f):
+    """Write folded stacks (self microseconds) for flamegraph.pl."""
+    for stack, own in sorted(_folded.items()):
+        f.write('%s %d\n' % (stack, own//1000))
+
+
+def save(profile=None, trace=None):
+    """Write the summary to profile and the trace to trace (file paths)."""
+    if profile:
+        with open(profile, 'w') as f:
+            write_summary(f)
+    if trace:
+        with open(trace, 'w') as f:
+            if trace.endswith('.folded'):
+                write_folded(f)
+            else:
+                write_trace(f)
+
+
+def _from_environment():
+    profile = os.environ.get('LEAC_PROFILE')
+    trace = os.environ.get('LEAC_TRACE')
+    # Worker processes are set up by configure() and report to the parent.
+    if (profile or trace) and multiprocessing.parent_process() is None:
+        enable(trace=bool(trace))
+        atexit.register(save, profile, trace)
+
+
+_from_environment()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass evaluation over the whole analysis period.
+
+The segmented calculation (leac.segments, and the NumPy kernel that
+reproduces it) follows the scripts: one Utilityrate5 and Cashloan run per
+rate segment with a shortened analysis_period and a shrunk
+system_capacity, the segment NPVs brought back to the install year with
+the installed cost added back and the real discount rate.  The
+joins are exact (a table whose rows all have the same rates gives the
+single stage NPV to rounding), but the work is a Utilityrate5 run, and a
+Cashloan run unless the kernel stands in, for every segment of every
+install year.
+
+Here the system lives one analysis period, the way SAM models it.
+Pvwattsv7 runs once, at the nameplate capacity, and degradation and
+escalation are applied year by year as in Utilityrate5.  Each project
+year's energy value is priced at the rate row in force in its calendar
+year (RateTable.yearly_index).  The cash flows then go through the NumPy
+kernel as a single segment per install year.  NPV, payback and discounted
+payback come out of that one pass, with nothing stitched.
+
+    results = evaluate(dic, rate_table, range(2020, 2050))
+
+For flat tiered tariffs (leac.bills) the bill quantities are worked out
+once for the whole life.  Every install year is then a product of those
+quantities with its own row of yearly rates.  Other tariffs run
+Utilityrate5 over the whole life once for each distinct rate row the
+install years use, and each year takes its energy value from its row's
+run.  That is exact as long as a year's bill depends only on that year's
+rates (no credits carried from one year to the next).
+
+With a rate table of one row this is the single stage Cashloan run.  Like
+the NumPy kernel, it handles the nonprofit case only.
+
+License: MIT
+"""
+
+import numpy as np
+
+from leac import bills, cashflow, instrument, ratetable, results
+from leac.generation import GenerationCache
+from leac.models import build_models, base_values
+from leac.segments import SegmentResult, set_rates
+
+
+def energy_values(pv, ur, cl, table, install_years, base, gen_cache,
+                  flat_bills=None):
+    """
+    Energy value of each install year with every project year at the rates
+    in force in its calendar year: (install years, analysis_period + 1),
+    year 0 first.  With flat_bills (a bills.FlatBills for ur's tariff) the
+    bills are worked out analytically when the tariff allows it.
+    """
+    return gen_energy_values(gen_cache.gen(pv, base.system_capacity), ur, cl,
+                             table, install_years, base.analysis_period,
+                             flat_bills, key=base.system_capacity)
+
+
+def gen_energy_values(gen, ur, cl, table, install_years, analysis_period,
+                      flat_bills=None, key=None):
+    """
+    energy_values() of the hourly gen profile (kW, year 1).  key identifies
+    gen for flat_bills to reuse its quantities, as in
+    FlatBills.quantities().
+    """
+    n = int(analysis_period)
+    index = table.yearly_index(install_years, n)
+    if flat_bills is not None:
+        try:
+            with instrument.span('bills.energy_value'):
+                q = flat_bills.quantities(
+                    gen, n, key=None if key is None else (key, n))
+                rates = np.stack([table.first_block[index],
+                                  table.rest[index]], axis=-1)
+                return bills.energy_value_by_year(flat_bills.tariff, q,
+                                                  rates)
+        except bills.UnsupportedTariff:
+            pass
+    # Utilityrate5 shares analysis_period with cl.
+    cl.FinancialParameters.analysis_period = float(n)
+    ur.SystemOutput.gen = tuple(gen)
+    value = np.zeros((len(index), n + 1))
+    for row in np.unique(index):
+        set_rates(ur, float(table.first_block[row]), float(table.rest[row]))
+        with instrument.span('ur.execute'):
+            ur.execute()
+        run = np.broadcast_to(np.asarray(ur.Outputs.annual_energy_value)[1:],
+                              index.shape)
+        value[:, 1:][index == row] = run[index == row]
+    return value
+
+
+def cash_flows(energy_value, fin, base, out=None):
+    """
+    cashflow.evaluate() of whole life energy values, one row each, into
+    the results.CashFlowTable out if given.
+    """
+    energy_value = np.asarray(energy_value, dtype=float)
+    count = len(energy_value)
+    return cashflow.evaluate(energy_value[:, None],
+                             np.full((count, 1), fin.analysis_period),
+                             np.zeros((count, 1)), fin, base.system_capacity,
+                             out=out)
+
+
+def evaluate(dic, rates, install_years, inputs=None, analytic_bills=True,
+             out=None):
+    """
+    NPV and paybacks of every install year in one pass.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows without the title row.
+    inputs:     models.model_inputs(dic), if already at hand.
+    analytic_bills:
+                work out the bills with leac.bills when the tariff allows
+                it, instead of running Utilityrate5.
+    out:        results.CashFlowTable of install_years to fill with the
+                yearly cash flows, or None.
+
+    Returns a list of segments.SegmentResult in install_years order.
+    """
+    table = ratetable.as_table(rates)
+    install_years = [int(year) for year in install_years]
+    pv, ur, cl = build_models(dic, inputs)
+    cashflow.check_nonprofit(cl)
+    base = base_values(pv, cl)
+    fin = cashflow.financials(cl)
+    flat_bills = None
+    if analytic_bills:
+        try:
+            flat_bills = bills.FlatBills(bills.flat_tariff(ur))
+        except bills.UnsupportedTariff:
+            pass  # Utilityrate5 it is.
+    gen_cache = GenerationCache()
+    value = energy_values(pv, ur, cl, table, install_years, base, gen_cache,
+                          flat_bills)
+    with instrument.span('cash_flow'):
+        flows = cash_flows(value, fin, base, out)
+    if out is not None:
+        out.set_generation(gen_cache.gen(pv, base.system_capacity).sum(),
+                           base.degradation)
+    savings = results.read_only(flows.yearly_savings)
+    return [SegmentResult(flows.npv[k], flows.payback[k], savings[k],
+                          fin.total_installed_cost,
+                          flows.discounted_payback[k])
+            for k in range(len(install_years))]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Building the PVWatts Commercial -> Utilityrate5 -> Cashloan chain from the
+dictionary SAM writes with Generate code -> JSON for Inputs.
+
+License: MIT
+"""
+
+import collections
+
+import numpy as np
+import PySAM.Pvwattsv7 as PVWattsCommercial
+import PySAM.Utilityrate5 as UtilityRate
+import PySAM.Cashloan as Cashloan
+import PySAM.PySSC as pssc
+
+from leac import weather
+
+# The values the segment loop changes and has to start from every time.
+Base = collections.namedtuple('Base', ['system_capacity', 'insurance_rate',
+                                       'analysis_period', 'degradation'])
+
+
+MODULES = (('pvwattsv7', PVWattsCommercial), ('utilityrate5', UtilityRate),
+           ('cashloan', Cashloan))
+
+
+def model_inputs(dic):
+    """
+    The input groups of each compute module in a SAM JSON dictionary, as
+    export() gives them.  build_models(inputs=...) can rebuild the models
+    from these without going through dict_to_ssc_table again.
+    """
+    inputs = {}
+    for name, module in MODULES:
+        groups = module.wrap(pssc.dict_to_ssc_table(dic, name)).export()
+        groups.pop('Outputs', None)
+        inputs[name] = groups
+    return inputs
+
+
+def build_models(dic, inputs=None, weather_cache=True):
+    """
+    Make fresh pv, ur and cl objects from a SAM JSON dictionary, or from
+    model_inputs() if inputs is given.  ur and cl are made with
+    from_existing, so they share pv's data.
+
+    With weather_cache, pv reads the slim copy of solar_resource_file that
+    leac.weather keeps instead of the original weather file.
+    """
+    if inputs is None:
+        pv_dat = pssc.dict_to_ssc_table(dic, "pvwattsv7")
+        ur_dat = pssc.dict_to_ssc_table(dic, "utilityrate5")
+        cl_dat = pssc.dict_to_ssc_table(dic, "cashloan")
+        pv = PVWattsCommercial.wrap(pv_dat)
+        ur = UtilityRate.from_existing(pv, 'PVWattsCommercial')
+        cl = Cashloan.from_existing(pv, 'PVWattsCommercial')
+        ur.assign(UtilityRate.wrap(ur_dat).export())
+        cl.assign(Cashloan.wrap(cl_dat).export())
+    else:
+        pv = PVWattsCommercial.new()
+        pv.assign(_sequences(inputs['pvwattsv7']))
+        ur = UtilityRate.from_existing(pv, 'PVWattsCommercial')
+        cl = Cashloan.from_existing(pv, 'PVWattsCommercial')
+        ur.assign(_sequences(inputs['utilityrate5']))
+        cl.assign(_sequences(inputs['cashloan']))
+    if weather_cache:
+        path = pv.SolarResource.export().get('solar_resource_file')
+        if path:
+            pv.SolarResource.solar_resource_file = weather.slim_file(path)
+    return pv, ur, cl
+
+
+def _sequences(groups):
+    """PySAM wants tuples, not the NumPy arrays leac.casecache hands out."""
+    return {group: {name: (tuple(value.tolist())
+                           if isinstance(value, np.ndarray) else value)
+                    for name, value in variables.items()}
+            for group, variables in groups.items()}
+
+
+def base_values(pv, cl):
+    """The starting values of everything the segment loop modifies."""
+    return Base(system_capacity=pv.SystemDesign.system_capacity,
+                insurance_rate=cl.FinancialParameters.insurance_rate,
+                analysis_period=cl.FinancialParameters.analysis_period,
+                degradation=cl.SystemOutput.degradation[0])
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo evaluation of LEAC rate trajectories.
+
+The Rates sheet is one guess at how the LEAC fuel surcharge will move.
+This module samples many rate trajectories around it and reports the
+spread of NPV and paybacks for each install year.
+
+A trajectory gives [first block rate, remaining kWh rate] for every year
+on a common year grid (the rate table's years, or every year).  The grid
+splits each install year's analysis period into the same segments as
+segments.rate_window would, so every trajectory shares the segment
+layout and only the rates differ.
+
+Running Utilityrate5 per trajectory and segment would take hours for
+thousands of trajectories.  It is not needed: with the generation of a
+segment fixed, its annual_energy_value is affine in the two block rates
+(bills are rate times kWh in each tier, and the kWh do not depend on the
+rates).  So each distinct segment is run three times, at rates (0, 0),
+(1, 0) and (0, 1).  The cash flow kernel is affine in the energy value
+too.  NPV and yearly savings of every trajectory are therefore an
+intercept plus rate weighted coefficients, one matrix product per batch
+of trajectories.  One extra Utilityrate5 run at real rates checks the
+linearity; tariffs with minimum charges, for example, fail it.
+
+    years = annual_years(rates, range(2020, 2030), 25)
+    trajectories = random_walk(rates, years, 10000, spread=0.1, seed=1)
+    mc = simulate(dic, years, trajectories, range(2020, 2030))
+    print(percentiles(mc)['npv'])
+
+Like the NumPy cash flow kernel, this handles the nonprofit case only.
+
+License: MIT
+"""
+
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from leac import cashflow, instrument, ratetable
+from leac.segments import segment_energy_value
+from leac.sweep import _init_worker, _worker, map_jobs
+
+# npv, payback and discounted_payback are (trajectories, install years).
+MonteCarlo = collections.namedtuple('MonteCarlo', [
+    'install_years', 'years', 'trajectories', 'npv', 'payback',
+    'discounted_payback'])
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+RATE_MODELS = ('random_walk', 'per_year')
+
+# The (first block, remaining kWh) rates the segments are run at to get
+# the intercept and the two rate coefficients of their energy value.
+_BASIS = ((0.0, 0.0), (1.0, 0.0), (0.0, 1.0))
+
+
+def annual_years(rates, install_years, analysis_period):
+    """Every year from the first install year to the end of the last one."""
+    first = min(int(year) for year in install_years)
+    last = max(int(year) for year in install_years) + int(analysis_period)
+    return np.arange(first, last)
+
+
+def sheet_path(rates, years):
+    """
+    The rate table's [first block rate, remaining kWh rate] in force in
+    each of years, shape (len(years), 2).
+    """
+    table = ratetable.as_table(rates)
+    years = np.asarray(years)
+    rows = np.searchsorted(table.year, years, side='right') - 1
+    if np.any(rows < 0):
+        raise ValueError('The rate table starts in %d, after %d.'
+                         % (table.year[0], years.min()))
+    return np.column_stack([table.first_block[rows], table.rest[rows]])
+
+
+def _rng(seed):
+    return np.random.default_rng(seed)
+
+
+def random_walk(rates, years, count, spread=0.1, drift=0.0, seed=None):
+    """
+    count trajectories that follow the rate table times a geometric random
+    walk, shape (count, len(years), 2).  Both blocks move together, as the
+    fuel surcharge does.
+
+    spread:     standard deviation of the yearly log change.
+    drift:      mean yearly log change on top of the rate table.
+    """
+    years = np.asarray(years, dtype=float)
+    steps = np.diff(years, prepend=years[0])
+    shocks = _rng(seed).standard_normal((count, len(years)))
+    log_change = ((drift - 0.5*spread**2)*steps +
+                  spread*np.sqrt(steps)*shocks)
+    factor = np.exp(np.cumsum(log_change, axis=1))
+    return sheet_path(rates, years)[None]*factor[..., None]
+
+
+def per_year(rates, years, count, spread=0.1, distribution='lognormal',
+             seed=None):
+    """
+    count trajectories drawn independently for each year around the rate
+    table, shape (count, len(years), 2).  Both blocks get the same draw.
+
+    spread:         relative standard deviation, a number or one per year.
+    distribution:   'lognormal' (mean preserving), 'normal' (negative
+                    rates clipped to zero) or 'uniform'.
+    """
+    years = np.asarray(years)
+    spread = np.broadcast_to(np.asarray(spread, dtype=float), years.shape)
+    rng = _rng(seed)
+    if distribution == 'lognormal':
+        factor = np.exp(spread*rng.standard_normal((count, len(years))) -
+                        0.5*spread**2)
+    elif distribution == 'normal':
+        factor = np.maximum(
+            1 + spread*rng.standard_normal((count, len(years))), 0.0)
+    elif distribution == 'uniform':
+        factor = 1 + spread*rng.uniform(-np.sqrt(3), np.sqrt(3),
+                                        (count, len(years)))
+    else:
+        raise ValueError("distribution must be 'lognormal', 'normal' or "
+                         "'uniform', not %r" % (distribution,))
+    return sheet_path(rates, years)[None]*factor[..., None]
+
+
+def segment_layout(years, install_year, analysis_period):
+    """
+    (grid index, years_old, period) of each segment of install_year, in
+    chronological order.  As in segments.rate_window, the last grid year at
+    or before install_year starts the first segment.
+    """
+    years = np.asarray(years)
+    end = install_year + analysis_period
+    first = np.searchsorted(years, install_year, side='right') - 1
+    if first < 0:
+        raise ValueError('The year grid starts in %d, after the install '
+                         'year %d.' % (years[0], install_year))
+    starts = [install_year] + [int(year) for year in years[first + 1:]
+                               if year < end]
+    ends = starts[1:] + [end]
+    return [(first + i, start - install_year, stop - start)
+            for i, (start, stop) in enumerate(zip(starts, ends))]
+
+
+def _run_segment(job):
+    years_old, period, first_block_rate, rest_rate = job
+    pv, ur, cl = _worker['models']
+    if 'financials' not in _worker:
+        cashflow.check_nonprofit(cl)
+        _worker['financials'] = cashflow.financials(cl)
+    value = segment_energy_value(pv, ur, cl, _worker['base'],
+                                 _worker['gen_cache'], years_old, period,
+                                 first_block_rate, rest_rate,
+                                 _worker['bills'])
+    return np.array(value), _worker['financials'], _worker['base']
+
+
+def _run_jobs(dic, jobs, workers, exact_generation, inputs, analytic_bills):
+    if workers == 1 or len(jobs) <= 1:
+        _init_worker(dic, exact_generation, inputs, analytic_bills)
+        return [_run_segment(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(dic, exact_generation, inputs, analytic_bills,
+                      instrument.settings())) as pool:
+        return map_jobs(pool, _run_segment, jobs, chunksize=4)
+
+
+def _coefficients(layout, basis, fin, base):
+    """
+    Intercept and rate coefficients of the NPV and yearly savings of one
+    install year: (npv0, npv_coef (segments, 2), savings0 (n,),
+    savings_coef (segments, 2, n)).
+    """
+    n = fin.analysis_period
+    segments = len(layout)
+    # Case 0 has every segment at the intercept; case 1 + 2*i + j adds the
+    # coefficient of rate j in segment i.
+    energy_value = np.zeros((1 + 2*segments, segments, n + 1))
+    for i, (_, years_old, period) in enumerate(layout):
+        intercept, coefficients = basis[(years_old, period)]
+        energy_value[:, i] = intercept
+        energy_value[1 + 2*i:3 + 2*i, i] += coefficients
+    periods = np.array([[period for _, _, period in layout]] *
+                       (1 + 2*segments))
+    years_old = np.array([[old for _, old, _ in layout]] * (1 + 2*segments),
+                         dtype=float)
+    cash_flows = cashflow.evaluate(energy_value, periods, years_old, fin,
+                                   base.system_capacity)
+    npv, savings = cash_flows.npv, cash_flows.yearly_savings
+    return (npv[0], (npv[1:] - npv[0]).reshape(segments, 2),
+            savings[0], (savings[1:] - savings[0]).reshape(segments, 2, n))
+
+
+def simulate(dic, years, trajectories, install_years, workers=None,
+             exact_generation=False, inputs=None, chunk_size=4096,
+             rtol=1e-6, analytic_bills=True):
+    """
+    NPV and paybacks of every trajectory for each install year.
+
+    dic:            SAM JSON dictionary.
+    years:          the year grid, increasing.
+    trajectories:   (count, len(years), 2) rates, from random_walk() or
+                    per_year() for example.
+    workers, exact_generation, inputs and analytic_bills are as for
+    sweep.sweep; the workers only work out the energy value basis.
+    chunk_size trajectories are evaluated at a time.  Raises ValueError if
+    the tariff's energy value is not linear in the block rates to rtol.
+
+    Returns a MonteCarlo.
+    """
+    years = np.asarray(years)
+    trajectories = np.asarray(trajectories, dtype=float)
+    if trajectories.ndim != 3 or trajectories.shape[1:] != (len(years), 2):
+        raise ValueError('trajectories must have shape (count, %d, 2), not '
+                         '%r' % (len(years), trajectories.shape))
+    install_years = [int(year) for year in install_years]
+    n = int(dic['analysis_period'])
+    layouts = [segment_layout(years, year, n) for year in install_years]
+    segments = sorted({(old, period) for layout in layouts
+                       for _, old, period in layout})
+    jobs = [(old, period) + rates for old, period in segments
+            for rates in _BASIS]
+    # One run at real rates to check the basis.
+    index, old, period = layouts[0][0]
+    check = (old, period) + tuple(trajectories[0, index])
+    results = _run_jobs(dic, jobs + [check], workers, exact_generation,
+                        inputs, analytic_bills)
+    fin, base = results[0][1:]
+    basis = {}
+    for k, segment in enumerate(segments):
+        values = np.zeros((3, n + 1))
+        for j in range(3):
+            value = results[3*k + j][0]
+            values[j, :len(value)] = value
+        basis[segment] = (values[0], values[1:] - values[0])
+    intercept, coefficients = basis[(old, period)]
+    predicted = intercept + trajectories[0, index] @ coefficients
+    actual = np.zeros(n + 1)
+    actual[:len(results[-1][0])] = results[-1][0]
+    if np.max(np.abs(predicted - actual)) > rtol*max(np.max(np.abs(actual)),
+                                                       1.0):
+        raise ValueError('The energy value is not linear in the block rates '
+                         'for this tariff (minimum charges?), so it cannot '
+                         'be simulated this way.  Use sweep() on each '
+                         'trajectory instead.')
+
+    shape = (len(trajectories), len(install_years))
+    npv = np.zeros(shape)
+    payback = np.zeros(shape)
+    discounted_payback = np.zeros(shape)
+    for k, layout in enumerate(layouts):
+        npv0, npv_coef, savings0, savings_coef = _coefficients(
+            layout, basis, fin, base)
+        index = [i for i, _, _ in layout]
+        for start in range(0, len(trajectories), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            rates = trajectories[chunk, index]
+            npv[chunk, k] = npv0 + np.einsum('csj,sj->c', rates, npv_coef)
+            savings = savings0 + np.einsum('csj,sjn->cn', rates,
+                                           savings_coef)
+            payback[chunk, k], discounted_payback[chunk, k] = \
+                cashflow.paybacks(savings, fin)
+    return MonteCarlo(install_years=np.array(install_years), years=years,
+                      trajectories=trajectories, npv=npv, payback=payback,
+                      discounted_payback=discounted_payback)
+
+
+def percentiles(mc, q=PERCENTILES):
+    """
+    {'npv': ..., 'payback': ..., 'discounted_payback': ...}, each of shape
+    (len(q), install years).
+    """
+    return {name: np.percentile(getattr(mc, name), q, axis=0)
+            for name in ('npv', 'payback', 'discounted_payback')}
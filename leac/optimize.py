@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Design optimization: the system_capacity, dc_ac_ratio and tilt with the
+largest NPV for each install year under the changing rates.
+
+    result = optimize(dic, rates, range(2020, 2030),
+                      bounds={'system_capacity': (25, 400),
+                              'tilt': (0, 40)})
+    print(result.system_capacity, result.tilt, result.npv)
+
+The search is a bounded coarse-then-fine grid.  The first level evaluates
+a grid of points along each varied dimension; each later level halves the
+step and evaluates the 3**d neighbourhood of every install year's best
+design so far.  Every candidate is evaluated for all install years at
+once, so the install years share the candidates instead of running a
+search each, and candidates already evaluated are remembered and not run
+again.  Dimensions whose bounds are a single value stay fixed; by default
+dc_ac_ratio does, since without an inverter cost a lower ratio only ever
+clips less.
+
+A candidate is worth no more than the sweep.sweep(cash_flow='numpy')
+worker work of its install years: the energy values (analytic bills for
+flat tariffs) and the cash flow kernel.  The candidates of one
+(dc_ac_ratio, tilt) plant go to a worker as one job, where the
+GenerationCache scales one real run of the plant, at one of the
+capacities the search evaluates, to the others (see leac/generation.py).
+The first job to scale a plant checks the scaling against a second real
+run.  The run and the check's outcome come back with the results and go
+out with the plant's next job, whichever worker gets it, so a plant that
+scales costs two Pvwattsv7 runs for the whole search.  One that fails
+the check, as steeper tilts can far from the reference capacity, is
+simulated at every capacity it is asked for, degraded ones included.
+Optimum.pv_runs counts the runs.  Jobs run in a process pool that stays
+up for the whole search.
+
+Resizing the system changes its cost.  Costs gives total_installed_cost as
+
+    fixed + per_kw_dc*system_capacity + per_kw_ac*system_capacity/dc_ac_ratio
+
+and defaults to the case's installed cost per kW DC, so cost scales with
+size.  Insurance and O&M per kW follow from the cost and capacity, as in
+Cashloan.  Like the cash flow kernel, this handles the nonprofit case only.
+
+License: MIT
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import warnings
+
+import numpy as np
+
+from leac import cashflow, instrument, ratetable
+from leac.bills import FlatBills
+from leac.segments import segment_energy_values
+from leac.sweep import _init_worker, _worker, _numpy_results, map_jobs
+
+DIMENSIONS = ('system_capacity', 'dc_ac_ratio', 'tilt')
+
+Design = collections.namedtuple('Design', DIMENSIONS)
+
+Costs = collections.namedtuple('Costs', ['per_kw_dc', 'per_kw_ac', 'fixed'],
+                               defaults=[0.0, 0.0])
+
+# The best design for each install year, how many candidates and plants
+# (distinct dc_ac_ratio and tilt) the search evaluated, and how many
+# Pvwattsv7 runs that took.
+Optimum = collections.namedtuple('Optimum', [
+    'install_years', 'system_capacity', 'dc_ac_ratio', 'tilt', 'npv',
+    'payback', 'discounted_payback', 'candidates', 'plants', 'pv_runs'])
+
+# Candidates closer than this (relative to the bounds) are the same.
+_DIGITS = 9
+
+
+def installed_cost(costs, design):
+    return (costs.fixed + costs.per_kw_dc*design.system_capacity +
+            costs.per_kw_ac*design.system_capacity/design.dc_ac_ratio)
+
+
+def default_costs(dic):
+    """The case's total_installed_cost per kW DC."""
+    return Costs(per_kw_dc=float(dic['total_installed_cost']) /
+                 float(dic['system_capacity']))
+
+
+def default_bounds(dic):
+    """
+    A quarter to four times the case's capacity, tilts from flat to 45
+    degrees, and the case's dc_ac_ratio.
+    """
+    capacity = float(dic['system_capacity'])
+    ratio = float(dic['dc_ac_ratio'])
+    return {'system_capacity': (0.25*capacity, 4*capacity),
+            'dc_ac_ratio': (ratio, ratio), 'tilt': (0.0, 45.0)}
+
+
+def _bounds(dic, bounds):
+    full = default_bounds(dic)
+    for name, value in (bounds or {}).items():
+        if name not in full:
+            raise ValueError('Can only optimize %s, not %r.'
+                             % (', '.join(DIMENSIONS), name))
+        low, high = (value, value) if np.isscalar(value) else value
+        full[name] = (float(low), float(high))
+    for name, (low, high) in full.items():
+        if not low <= high:
+            raise ValueError('The %s bounds (%g, %g) are the wrong way '
+                             'round.' % (name, low, high))
+    if full['system_capacity'][0] <= 0 or full['dc_ac_ratio'][0] <= 0:
+        raise ValueError('system_capacity and dc_ac_ratio must be positive.')
+    return [full[name] for name in DIMENSIONS]
+
+
+def _design(values):
+    return Design(*(round(float(value), _DIGITS) for value in values))
+
+
+def _coarse(bounds, points):
+    return [_design(values) for values in itertools.product(
+        *[np.linspace(low, high, points) if high > low else [low]
+          for low, high in bounds])]
+
+
+def _neighbours(design, bounds, steps):
+    axes = []
+    for value, (low, high), step in zip(design, bounds, steps):
+        if high > low:
+            axes.append(sorted({min(max(value + k*step, low), high)
+                                for k in (-1, 0, 1)}))
+        else:
+            axes.append([low])
+    return [_design(values) for values in itertools.product(*axes)]
+
+
+def _run_plant(job):
+    """
+    (plant, runs, results): the plant as GenerationCache.export() gives it
+    for its next job, the Pvwattsv7 runs this job took, and the NPV and
+    paybacks of every capacity of the plant for each year.
+    """
+    ((dc_ac_ratio, tilt), capacities, plant, costs, rates,
+     install_years) = job
+    pv, ur, cl = _worker['models']
+    if 'financials' not in _worker:
+        cashflow.check_nonprofit(cl)
+        _worker['financials'] = cashflow.financials(cl)
+    pv.SystemDesign.dc_ac_ratio = dc_ac_ratio
+    pv.SystemDesign.tilt = tilt
+    gen_cache = _worker['gen_cache']
+    runs = gen_cache.runs
+    if plant is None:
+        # Its first job: seed at a capacity it evaluates anyway.
+        gen_cache.seed(pv, capacities[len(capacities)//2])
+    else:
+        gen_cache.restore(pv, plant)
+    bills = None
+    if _worker['bills'] is not None:
+        # Its quantities are keyed on capacity, so one per plant.
+        bills = FlatBills(_worker['bills'].tariff)
+    results = []
+    with warnings.catch_warnings():
+        # A plant that fails the scaling check is simulated exactly from
+        # then on, which is what a design search needs.
+        warnings.filterwarnings('ignore', 'Scaled PVWatts generation')
+        for capacity in capacities:
+            results.append(_run_design(
+                pv, ur, cl, Design(capacity, dc_ac_ratio, tilt), costs,
+                rates, install_years, gen_cache, bills))
+    return gen_cache.export(pv), gen_cache.runs - runs, results
+
+
+def _run_design(pv, ur, cl, design, costs, rates, install_years, gen_cache,
+                bills):
+    """(design, npv, payback, discounted_payback) over install_years."""
+    base = _worker['base']._replace(system_capacity=design.system_capacity)
+    fin = _worker['financials']._replace(
+        total_installed_cost=installed_cost(costs, design))
+    energy_values = []
+    for starting_year in install_years:
+        with instrument.span('install_year', year=starting_year):
+            energy_values.append((segment_energy_values(
+                pv, ur, cl, rates.segments(starting_year,
+                                           base.analysis_period),
+                base, gen_cache, bills), fin, base))
+    with instrument.span('cash_flow'):
+        cash_flows = _numpy_results(energy_values)
+    return (design, np.array([r.npv for r in cash_flows]),
+            np.array([r.payback for r in cash_flows]),
+            np.array([r.discounted_payback for r in cash_flows]))
+
+
+def _jobs(designs, exported, costs, rates, install_years):
+    """
+    One job per plant, holding all of its capacities and what its last job
+    exported (None for a new plant).
+    """
+    plants = collections.defaultdict(list)
+    for design in designs:
+        plants[(design.dc_ac_ratio, design.tilt)].append(
+            design.system_capacity)
+    return [(plant, sorted(capacities), exported.get(plant), costs, rates,
+             install_years)
+            for plant, capacities in sorted(plants.items())]
+
+
+def optimize(dic, rates, install_years, bounds=None, costs=None, points=5,
+             levels=4, workers=None, exact_generation=False, inputs=None,
+             analytic_bills=True):
+    """
+    The design with the largest NPV for each install year.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows without the title row.
+    bounds:     {name: (low, high) or value} for any of system_capacity
+                (kW DC), dc_ac_ratio and tilt (degrees); the rest come from
+                default_bounds().  A single value fixes the dimension.
+    costs:      Costs; default_costs(dic) if None.
+    points:     grid points along each varied dimension at the first level.
+    levels:     refinement levels after the first; the final resolution is
+                (high - low)/(points - 1)/2**levels.
+    workers, exact_generation, inputs and analytic_bills are as for
+    sweep.sweep.
+
+    Returns an Optimum.
+    """
+    if points < 2:
+        raise ValueError('points must be at least 2.')
+    install_years = [int(year) for year in install_years]
+    rates = ratetable.as_table(rates)
+    bounds = _bounds(dic, bounds)
+    costs = costs if costs is not None else default_costs(dic)
+    steps = [(high - low)/(points - 1) for low, high in bounds]
+    evaluated = {}  # Design: (npv, payback, discounted_payback) arrays.
+    exported = {}  # (dc_ac_ratio, tilt): GenerationCache.export().
+    pv_runs = 0
+    pool = None
+    if workers != 1:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(dic, exact_generation, inputs, analytic_bills,
+                      instrument.settings(), None, False))
+    else:
+        _init_worker(dic, exact_generation, inputs, analytic_bills,
+                     seed=False)
+    try:
+        candidates = _coarse(bounds, points)
+        for level in range(levels + 1):
+            if level:
+                steps = [step/2 for step in steps]
+                designs = list(evaluated)
+                npv = np.array([evaluated[design][0]
+                                for design in designs])
+                best = {designs[i] for i in np.argmax(npv, axis=0)}
+                candidates = [design for b in sorted(best)
+                              for design in _neighbours(b, bounds, steps)]
+            candidates = sorted(set(candidates) - set(evaluated))
+            jobs = _jobs(candidates, exported, costs, rates, install_years)
+            if pool is None:
+                plants = [_run_plant(job) for job in jobs]
+            else:
+                plants = map_jobs(pool, _run_plant, jobs)
+            for job, (plant, runs, results) in zip(jobs, plants):
+                exported[job[0]] = plant
+                pv_runs += runs
+                for design, *values in results:
+                    evaluated[design] = values
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    designs = list(evaluated)
+    npv = np.array([evaluated[design][0] for design in designs])
+    best = [designs[i] for i in np.argmax(npv, axis=0)]
+    columns = [np.array([evaluated[design][j][k]
+                         for k, design in enumerate(best)])
+               for j in range(3)]
+    return Optimum(
+        install_years=np.array(install_years),
+        system_capacity=np.array([d.system_capacity for d in best]),
+        dc_ac_ratio=np.array([d.dc_ac_ratio for d in best]),
+        tilt=np.array([d.tilt for d in best]),
+        npv=columns[0], payback=columns[1], discounted_payback=columns[2],
+        candidates=len(evaluated),
+        plants=len({(d.dc_ac_ratio, d.tilt) for d in evaluated}),
+        pv_runs=pv_runs)
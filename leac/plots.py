@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+The NPV and simple payback bar charts the scripts draw, and the charts
+leac.render draws headless: bar charts, percentile fan charts, heatmaps
+of install year against scenario and tornado charts.
+
+figure() makes a Figure drawn by the Agg backend without going through
+pyplot, so rendering never opens a window, needs no display and keeps no
+global figure list.  Charts of more install years than max_bars, or
+heatmaps of more scenarios than max_rows, are downsampled: runs of
+consecutive entries are drawn as their mean, bar charts with a line
+through each bar's range.
+
+matplotlib is imported when a chart is drawn, not when leac is imported.
+
+License: MIT
+"""
+
+import numpy as np
+
+# (name, Evaluation field, title, y axis label) of each chart.
+CHARTS = (('npv', 'npv', 'Net Present Value for Install Date',
+           'Net Present Value ($)'),
+          ('payback', 'payback', 'Simple Payback for Install Date',
+           'Simple Payback (years)'))
+
+# Install years drawn as separate bars, and heatmap rows drawn, at most.
+MAX_BARS = 200
+MAX_ROWS = 500
+
+
+def pyplot(show=True):
+    """matplotlib.pyplot, with a non-interactive backend unless show."""
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def bar_charts(evaluation, show=True, prefix=None):
+    """
+    Bar charts of NPV and simple payback against install year.  With
+    prefix the charts are saved as prefix + '_npv.png' and
+    prefix + '_payback.png'; with show they are displayed.
+    """
+    plt = pyplot(show)
+    figures = []
+    for number, (name, field, title, ylabel) in enumerate(CHARTS):
+        figure = plt.figure(number)
+        plt.bar(evaluation.install_years, getattr(evaluation, field))
+        plt.title(title)
+        plt.xlabel('Install Date (Year)')
+        plt.ylabel(ylabel)
+        if prefix:
+            figure.savefig('%s_%s.png' % (prefix, name))
+        figures.append(figure)
+    if show:
+        plt.show()
+    return figures
+
+
+def figure(size=(8, 5)):
+    """A matplotlib Figure drawn by the Agg backend, without pyplot."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def downsample(values, max_count):
+    """
+    (starts, low, mean, high) of values (entries along the first axis) in
+    at most max_count runs of consecutive entries, starting at starts.
+    The mean leaves out NaN and infinite values.
+    """
+    values = np.asarray(values, dtype=float)
+    count = len(values)
+    starts = np.linspace(0, count, min(count, max_count) + 1)[:-1].astype(int)
+    finite = np.isfinite(values)
+    total = np.add.reduceat(np.where(finite, values, 0.0), starts, axis=0)
+    with np.errstate(invalid='ignore'):
+        mean = total/np.add.reduceat(finite, starts, axis=0)
+    return (starts, np.fmin.reduceat(values, starts, axis=0), mean,
+            np.fmax.reduceat(values, starts, axis=0))
+
+
+def _labels(axes, title, ylabel, xlabel='Install Date (Year)'):
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+
+
+def bar_chart(fig, install_years, values, title, ylabel, max_bars=MAX_BARS):
+    """
+    values against install_years (consecutive, in order) as bars on a
+    new axes of fig.
+    """
+    axes = fig.add_subplot()
+    years = np.asarray(install_years)
+    if len(years) <= max_bars:
+        axes.bar(years, values)
+    else:
+        starts, low, mean, high = downsample(values, max_bars)
+        width = np.diff(np.append(starts, len(years)))
+        centers = years[starts] + 0.5*(width - 1)
+        axes.bar(centers, mean, width=0.9*width)
+        axes.vlines(centers, low, high, color='k', linewidth=0.5)
+    _labels(axes, title, ylabel)
+    return axes
+
+
+def fan_chart(fig, install_years, bands, q, title, ylabel):
+    """
+    Percentiles q (increasing) of each install year, bands of shape
+    (len(q), install years), as shaded bands between q[i] and q[-1 - i]
+    around a line at the middle percentile.
+    """
+    axes = fig.add_subplot()
+    pairs = len(q)//2
+    for i in range(pairs):
+        axes.fill_between(install_years, bands[i], bands[-1 - i],
+                          color='C0', alpha=0.2 + 0.3*i/pairs, linewidth=0,
+                          label='%g-%g%%' % (q[i], q[-1 - i]))
+    if len(q) % 2:
+        axes.plot(install_years, bands[pairs], color='C0',
+                  label='%g%%' % q[pairs])
+    axes.legend()
+    _labels(axes, title, ylabel)
+    return axes
+
+
+def heatmap(fig, install_years, values, title, label, row_label,
+            max_rows=MAX_ROWS):
+    """
+    values of shape (rows, install years) as an image of install year
+    against row, with a colour bar labelled label.
+    """
+    axes = fig.add_subplot()
+    years = np.asarray(install_years)
+    _, _, mean, _ = downsample(values, max_rows)
+    image = axes.imshow(mean, aspect='auto', interpolation='nearest',
+                        origin='lower', extent=(years[0] - 0.5,
+                                                years[-1] + 0.5, 0,
+                                                len(values)))
+    fig.colorbar(image, ax=axes, label=label)
+    _labels(axes, title, row_label)
+    return axes
+
+
+def tornado_chart(fig, rows, npv, title, label):
+    """
+    Tornado chart of rows, (name, low, high, npv_low, npv_high) widest
+    first as sensitivity.tornado() gives them: a bar from npv to each of
+    npv_low and npv_high per input, the widest at the top.
+    """
+    axes = fig.add_subplot()
+    y = np.arange(len(rows))[::-1]
+    for key, column, color in (('low', 3, 'C0'), ('high', 4, 'C1')):
+        values = np.array([row[column] for row in rows], dtype=float)
+        axes.barh(y, values - npv, left=npv, color=color, label=key)
+    axes.axvline(npv, color='k', linewidth=0.8)
+    axes.set_yticks(y)
+    axes.set_yticklabels(['%s (%.4g to %.4g)' % row[:3] for row in rows])
+    axes.legend()
+    axes.set_title(title)
+    axes.set_xlabel(label)
+    fig.tight_layout()
+    return axes
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+The rate table as typed columns.
+
+A rate table is Year, first block rate, remaining kWh rate, with a title
+row, on a sheet called Rates (or in a .csv file).  read() loads it
+straight into three NumPy columns:
+
+    .xlsx           openpyxl in read-only mode, which streams the rows
+                    instead of loading the workbook (xlrd 2 dropped
+                    .xlsx; it is still used if openpyxl is missing)
+    .xls            xlrd, a column at a time
+    .csv            numpy.loadtxt
+
+Workbooks are told apart by their contents, not their names:
+LEAC_plot_iter.py used to save its results as an .xls file under the
+.xlsx name, as it did with the bundled Rates.xlsx.
+
+RateTable keeps the years sorted and distinct.  The rows seen by a system
+installed in a given year start at the last row at or before it, which
+index() finds by binary search, and segments() reads the install year's
+segments off the columns from there, without copying or changing the
+table.  yearly_index() finds the row of every project year of every
+install year at once, for leac.lifetime.  A RateTable also behaves like
+the list of [year, first block rate, remaining kWh rate] rows that
+api.load_rates used to return.
+
+check_years() rejects, up front, rate rows at or past the end of an
+install year's analysis period, which Utilityrate5 would otherwise fail
+on with "fail(analysis_period, positive)" halfway through a sweep.
+
+License: MIT
+"""
+
+import numpy as np
+
+from leac import instrument
+
+# Every .xlsx file is a zip archive.
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+class RateTable(object):
+    """
+    year (int), first_block and rest (float) arrays of equal length, with
+    year strictly increasing.  Raises ValueError otherwise.
+    """
+
+    def __init__(self, year, first_block, rest):
+        self.year = np.asarray(year, dtype=np.int64)
+        self.first_block = np.asarray(first_block, dtype=float)
+        self.rest = np.asarray(rest, dtype=float)
+        if not (self.year.shape == self.first_block.shape ==
+                self.rest.shape) or self.year.ndim != 1:
+            raise ValueError('The rate table columns are not all the same '
+                             'length.')
+        if len(self.year) == 0:
+            raise ValueError('The rate table is empty.')
+        if np.any(np.diff(self.year) <= 0):
+            raise ValueError('The rate table years must increase from row '
+                             'to row, with no year twice.')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From [year, first block rate, remaining kWh rate] rows."""
+        columns = np.array([list(row)[:3] for row in rows], dtype=float)
+        if columns.size == 0:
+            raise ValueError('The rate table is empty.')
+        if np.any(columns[:, 0] != np.round(columns[:, 0])):
+            raise ValueError('The rate table years must be whole numbers.')
+        return cls(columns[:, 0], columns[:, 1], columns[:, 2])
+
+    def __len__(self):
+        return len(self.year)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return [float(self.year[i]), float(self.first_block[i]),
+                float(self.rest[i])]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'RateTable(%r)' % (list(self),)
+
+    def index(self, starting_year):
+        """
+        The first row seen by a system installed in starting_year: the last
+        row at or before it, or the first row if there is none.
+        """
+        return max(int(np.searchsorted(self.year, starting_year,
+                                       side='right')) - 1, 0)
+
+    def yearly_index(self, install_years, analysis_period):
+        """
+        The row in force in each project year of each install year,
+        (install years, analysis_period), like index() of every calendar
+        year at once.
+        """
+        calendar = (np.asarray(install_years, dtype=np.int64)[:, None] +
+                    np.arange(int(analysis_period)))
+        return np.maximum(np.searchsorted(self.year, calendar,
+                                          side='right') - 1, 0)
+
+    def segments(self, starting_year, analysis_period):
+        """
+        (years_old, period, first block rate, remaining kWh rate) of each
+        segment of a system installed in starting_year, in chronological
+        order, like segments.window_segments(rate_window(...)).
+        """
+        i = self.index(starting_year)
+        first_year = max(int(self.year[i]), int(starting_year))
+        starts = self.year[i:]
+        ends = np.append(starts[1:], first_year + int(analysis_period))
+        starts = np.maximum(starts, first_year)
+        return list(zip((starts - first_year).tolist(),
+                        (ends - starts).tolist(),
+                        self.first_block[i:].tolist(),
+                        self.rest[i:].tolist()))
+
+    def check_years(self, install_years, analysis_period):
+        """
+        Raise ValueError if a row falls at or after the end of the analysis
+        period of any of install_years, while being after the install year
+        (so that it would start a segment).
+        """
+        first = min(int(year) for year in install_years)
+        i = self.index(first)
+        if self.year[i] > first:
+            first = int(self.year[i])
+        late = self.year[(self.year > first) &
+                         (self.year >= first + int(analysis_period))]
+        if len(late):
+            raise ValueError(
+                'The rate table has rows for %s, at or after the end of the '
+                '%d year analysis period of a system installed in %d.  '
+                'Remove them or start the install years later.'
+                % (', '.join(str(year) for year in late),
+                   int(analysis_period), first))
+
+
+def as_table(rates):
+    """rates as a RateTable; rows are converted, a RateTable is not."""
+    if isinstance(rates, RateTable):
+        return rates
+    return RateTable.from_rows(rates)
+
+
+def _table(rows, path):
+    """Rows of cell values to a RateTable, skipping blank rows."""
+    rows = [row for row in rows
+            if not all(value in (None, '') for value in row)]
+    try:
+        return RateTable.from_rows(rows)
+    except (TypeError, ValueError) as e:
+        raise ValueError('%s: %s' % (path, e))
+
+
+def _read_xlsx(path, sheet):
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if sheet not in wb.sheetnames:
+            raise ValueError('%s does not have a "%s" sheet.' % (path, sheet))
+        return _table(wb[sheet].iter_rows(min_row=2, max_col=3,
+                                          values_only=True), path)
+    finally:
+        wb.close()
+
+
+def _read_xls(path, sheet):
+    import xlrd
+    wb = xlrd.open_workbook(path, on_demand=True)
+    try:
+        try:
+            rate_sheet = wb.sheet_by_name(sheet)
+        except xlrd.XLRDError:
+            raise ValueError('%s does not have a "%s" sheet.' % (path, sheet))
+        return _table(zip(*[rate_sheet.col_values(column, start_rowx=1)
+                            for column in range(3)]), path)
+    finally:
+        wb.release_resources()
+
+
+def _read_csv(path):
+    try:
+        columns = np.loadtxt(path, delimiter=',', skiprows=1,
+                             usecols=(0, 1, 2), ndmin=2)
+        return RateTable.from_rows(columns)
+    except ValueError as e:
+        raise ValueError('%s: %s' % (path, e))
+
+
+def read(path, sheet='Rates'):
+    """
+    The RateTable in the workbook or CSV file at path.  Excel workbooks
+    need a sheet called sheet; the first row is a title row.
+    """
+    if path.lower().endswith('.csv'):
+        with instrument.span('csv.read'):
+            return _read_csv(path)
+    with instrument.span('excel.read'):
+        with open(path, 'rb') as f:
+            magic = f.read(len(ZIP_MAGIC))
+        if magic == ZIP_MAGIC:
+            try:
+                return _read_xlsx(path, sheet)
+            except ImportError:
+                pass  # Old xlrd versions read .xlsx too.
+        return _read_xls(path, sheet)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Headless chart rendering, for one evaluation or a whole manifest of cases.
+
+    python -m leac.render manifest.csv charts --workers 8 --format png svg
+    python -m leac.render manifest.csv charts --trajectories 1000 --seed 1
+    python -m leac.render manifest.csv charts --loads loads.npy
+
+    render(evaluation, 'charts/gym')    # charts/gym_npv.png, ...
+
+The manifest is the one python -m leac.batch runs (see leac.batch): a
+case, a rate table and the install years per row.  Each job is evaluated
+and drawn in a worker process, one job per task, and its charts go to
+the output directory as <case>_<rates>_<chart>.<format>.  A job that
+fails is reported and the rest carry on.
+
+What is drawn depends on the evaluation:
+
+    api.Evaluation          NPV and simple payback bar charts
+    montecarlo.MonteCarlo   NPV and simple payback fan charts of the
+    scenarios.Scenarios     percentiles, and a heatmap of the NPV of each
+                            install year and trajectory or scenario
+    sensitivity.Sensitivity a tornado chart of the NPV of the first
+                            install year
+
+Charts are drawn on Agg figures (plots.figure), never through pyplot, so
+no display is needed.  Bar charts of many install years and heatmaps of
+many scenarios are downsampled (plots.MAX_BARS, plots.MAX_ROWS), which
+keeps the time and file size of a chart about the same whatever the size
+of the sweep.
+
+License: MIT
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+import traceback
+
+from leac import api, batch, montecarlo, plots, sensitivity
+
+FORMATS = ('png', 'svg', 'pdf')
+
+HEATMAP_TITLE = 'Net Present Value by Install Date and %s'
+
+TORNADO_TITLE = 'Net Present Value Sensitivity, Installed %d'
+
+
+def _save(fig, prefix, name, formats, dpi):
+    paths = []
+    for extension in formats:
+        path = '%s_%s.%s' % (prefix, name, extension)
+        fig.savefig(path, dpi=dpi)
+        paths.append(path)
+    return paths
+
+
+def render(evaluation, prefix, formats=('png',), dpi=100,
+           max_bars=plots.MAX_BARS, max_rows=plots.MAX_ROWS):
+    """
+    Draw the charts of evaluation (see the module docstring) to
+    prefix + '_<chart>.<format>' for each of formats.  Returns the paths
+    written.
+    """
+    from leac.scenarios import Scenarios
+    paths = []
+    years = evaluation.install_years
+    if isinstance(evaluation, api.Evaluation):
+        for name, field, title, ylabel in plots.CHARTS:
+            fig = plots.figure()
+            plots.bar_chart(fig, years, getattr(evaluation, field), title,
+                            ylabel, max_bars)
+            paths += _save(fig, prefix, name, formats, dpi)
+        return paths
+    if isinstance(evaluation, sensitivity.Sensitivity):
+        fig = plots.figure()
+        plots.tornado_chart(fig, sensitivity.tornado(evaluation),
+                            evaluation.npv[0], TORNADO_TITLE % years[0],
+                            plots.CHARTS[0][3])
+        return _save(fig, prefix, 'tornado', formats, dpi)
+    if not isinstance(evaluation, (montecarlo.MonteCarlo, Scenarios)):
+        raise ValueError('Only evaluations, Monte Carlo runs, scenarios and '
+                         'sensitivities can be rendered, not %s.'
+                         % type(evaluation).__name__)
+    spread = montecarlo.percentiles(evaluation)
+    for name, field, title, ylabel in plots.CHARTS:
+        fig = plots.figure()
+        plots.fan_chart(fig, years, spread[field], montecarlo.PERCENTILES,
+                        title, ylabel)
+        paths += _save(fig, prefix, name + '_fan', formats, dpi)
+    rows = ('Trajectory' if isinstance(evaluation, montecarlo.MonteCarlo)
+            else 'Scenario')
+    fig = plots.figure()
+    plots.heatmap(fig, years, evaluation.npv, HEATMAP_TITLE % rows,
+                  plots.CHARTS[0][3], rows, max_rows)
+    paths += _save(fig, prefix, 'npv_heatmap', formats, dpi)
+    return paths
+
+
+def job_names(jobs):
+    """<case>_<rates> file name stems of manifest jobs, made distinct."""
+    names = []
+    seen = set()
+    for job in jobs:
+        stem = '%s_%s' % tuple(os.path.splitext(os.path.basename(
+            job[name]))[0] for name in ('case', 'rates'))
+        name, number = stem, 1
+        while name in seen:
+            number += 1
+            name = '%s_%d' % (stem, number)
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def render_job(job, prefix, settings):
+    """
+    Evaluate and render one manifest job.  settings holds formats, dpi,
+    trajectories, seed, loads, export_limits and the api.evaluate options.
+    Returns (status, seconds, paths, error message or None); errors are
+    reported, not raised.
+    """
+    started = time.perf_counter()
+    try:
+        case = api.load_case(job['case'])
+        rates = api.load_rates(job['rates'])
+        start = job['start'] if job['start'] is not None else int(rates[0][0])
+        years = job['years'] if job['years'] is not None else \
+            api.YEARS_TO_PLOT
+        install_years = range(start, start + years)
+        options = settings['options']
+        if settings['trajectories']:
+            evaluation = api.monte_carlo(
+                case, rates, install_years,
+                trajectories=settings['trajectories'], seed=settings['seed'],
+                workers=1, **options)
+        elif settings['loads'] or settings['export_limits']:
+            evaluation = api.evaluate_scenarios(
+                case, rates, install_years, loads=settings['loads'],
+                export_limits=settings['export_limits'])
+        else:
+            evaluation = api.evaluate(case, rates, install_years, workers=1,
+                                      **options)
+        paths = render(evaluation, prefix, settings['formats'],
+                       settings['dpi'])
+        return 'done', time.perf_counter() - started, paths, None
+    except Exception:
+        return ('failed', time.perf_counter() - started, [],
+                traceback.format_exc())
+
+
+def _render_keyed(keyed_job):
+    return keyed_job[1], render_job(*keyed_job)
+
+
+def render_manifest(manifest, directory, workers=None, formats=('png',),
+                    dpi=100, trajectories=None, seed=None, loads=None,
+                    export_limits=None, log=None, **options):
+    """
+    Evaluate and render every job of manifest (a path, or
+    batch.read_manifest() jobs) into directory.  trajectories draws
+    Monte Carlo charts, loads or export_limits (scenario file paths)
+    scenario charts; options go to api.evaluate (cash_flow,
+    exact_generation, analytic_bills; only analytic_bills and
+    exact_generation with trajectories).  log, if given, is called with
+    (job, status, seconds, error) as jobs finish.
+
+    Returns (jobs rendered, jobs failed).
+    """
+    if trajectories and (loads or export_limits):
+        raise ValueError('trajectories does not go with loads or '
+                         'export_limits.')
+    jobs = (batch.read_manifest(manifest) if isinstance(manifest, str)
+            else manifest)
+    os.makedirs(directory, exist_ok=True)
+    if trajectories:
+        options.pop('cash_flow', None)
+    settings = {'formats': tuple(formats), 'dpi': dpi,
+                'trajectories': trajectories, 'seed': seed,
+                'loads': loads and os.path.abspath(loads),
+                'export_limits': export_limits and os.path.abspath(
+                    export_limits),
+                'options': options}
+    keyed_jobs = [(job, os.path.join(directory, name), settings)
+                  for job, name in zip(jobs, job_names(jobs))]
+    by_prefix = {prefix: job for job, prefix, _ in keyed_jobs}
+    if workers == 1 or len(keyed_jobs) <= 1:
+        outcomes = map(_render_keyed, keyed_jobs)
+        pool = None
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        outcomes = (future.result() for future in
+                    concurrent.futures.as_completed(
+                        [pool.submit(_render_keyed, keyed_job)
+                         for keyed_job in keyed_jobs]))
+    failed = 0
+    try:
+        for prefix, (status, seconds, _, error) in outcomes:
+            if status != 'done':
+                failed += 1
+            if log:
+                log(by_prefix[prefix], status, seconds, error)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return len(keyed_jobs) - failed, failed
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac.render',
+        description='Evaluate every (case, rates, install years) job of a '
+                    'manifest and render its charts to files, without a '
+                    'display.')
+    p.add_argument('manifest',
+                   help='CSV or JSON manifest (case, rates, start, years), '
+                        'as for python -m leac.batch')
+    p.add_argument('directory', help='directory for the charts')
+    p.add_argument('--workers', type=int,
+                   help='worker processes (default: one per CPU)')
+    p.add_argument('--format', nargs='+', choices=FORMATS, default=['png'],
+                   help='file formats (default: png)')
+    p.add_argument('--dpi', type=int, default=100,
+                   help='resolution of raster formats (default: '
+                        '%(default)s)')
+    p.add_argument('--trajectories', type=int,
+                   help='draw fan charts and heatmaps of this many sampled '
+                        'rate paths')
+    p.add_argument('--seed', type=int, help='random seed for --trajectories')
+    p.add_argument('--loads', metavar='FILE',
+                   help='draw fan charts and heatmaps over the hourly load '
+                        'scenarios in FILE (see python -m leac.scenarios)')
+    p.add_argument('--export-limits', metavar='FILE',
+                   help='as --loads, for hourly export limit scenarios')
+    p.add_argument('--cash-flow', choices=['numpy', 'pysam', 'lifetime'],
+                   default='numpy')
+    p.add_argument('--exact-generation', action='store_true')
+    p.add_argument('--utilityrate', action='store_true',
+                   help='run Utilityrate5 instead of the analytic bills')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.trajectories and (args.loads or args.export_limits):
+        parser().error('--trajectories does not go with --loads or '
+                       '--export-limits')
+
+    def log(job, status, seconds, error):
+        print('%s %6.2f s %s %s' % (status, seconds,
+                                    os.path.basename(job['case']),
+                                    os.path.basename(job['rates'])))
+        if error:
+            print(error, file=sys.stderr)
+    started = time.perf_counter()
+    rendered, failed = render_manifest(
+        args.manifest, args.directory, workers=args.workers,
+        formats=args.format, dpi=args.dpi, trajectories=args.trajectories,
+        seed=args.seed, loads=args.loads, export_limits=args.export_limits,
+        log=log, cash_flow=args.cash_flow,
+        exact_generation=args.exact_generation,
+        analytic_bills=not args.utilityrate)
+    print('%d rendered, %d failed in %.1f s'
+          % (rendered, failed, time.perf_counter() - started))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+The cash flow detail of a sweep in one preallocated buffer.
+
+A CashFlowTable holds, for every install year and project year,
+
+    generation          kWh: year 1 AC output at the nameplate capacity,
+                        degraded year by year (the degradation the
+                        segments' shrinking capacity stands for)
+    energy_value        $: the bill savings Utilityrate5 (or leac.bills)
+                        worked out
+    operating_expenses  $: insurance and O&M
+    savings             $: energy_value - operating_expenses, the yearly
+                        savings the paybacks are worked out from
+    discounted_savings  $: savings in install year dollars
+
+in one float64 buffer of shape (fields, install years, analysis_period),
+NaN until written, plus npv, payback and discounted_payback per install
+year.  Each field is a contiguous (install years, project years) view of
+the buffer.  The cash flow kernel (cashflow.evaluate with out=) sums the
+segments straight into those views, and each result's yearly_savings is
+a row of savings.  However many install years a sweep has, the detail
+takes one allocation of 40 bytes per install year and project year.
+
+    table = CashFlowTable(range(2020, 2050), 25)
+    results = sweep(dic, rates, range(2020, 2050), cash_flow='numpy',
+                    out=table)
+    table.savings[0]        # The yearly savings of 2020, no copy.
+    table.to_arrow()        # Long format, the fields without copies.
+    table.write_parquet('cash_flows.parquet')
+
+A field laid out as its own block, rather than as a NumPy structured
+array, is what lets to_arrow() hand the columns to pyarrow without a
+copy: a structured array's fields are strided.  Arrow and Parquet need
+pyarrow; write_csv() does not.
+
+License: MIT
+"""
+
+import numpy as np
+
+from leac import instrument
+
+FIELDS = ('generation', 'energy_value', 'operating_expenses', 'savings',
+          'discounted_savings')
+
+
+def read_only(array):
+    """A view of array that cannot be written through."""
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+def _field(i, name):
+    return property(lambda self: self.buffer[i],
+                    doc='(install years, project years) view of %s.' % name)
+
+
+class CashFlowTable(object):
+    """
+    Cash flow detail of install_years over analysis_period project years.
+    """
+
+    __slots__ = ('install_years', 'buffer', 'npv', 'payback',
+                 'discounted_payback')
+
+    def __init__(self, install_years, analysis_period):
+        self.install_years = np.array(install_years, dtype=np.int64)
+        count = len(self.install_years)
+        self.buffer = np.full((len(FIELDS), count, int(analysis_period)),
+                              np.nan)
+        self.npv = np.full(count, np.nan)
+        self.payback = np.full(count, np.nan)
+        self.discounted_payback = np.full(count, np.nan)
+
+    generation = _field(0, 'generation')
+    energy_value = _field(1, 'energy_value')
+    operating_expenses = _field(2, 'operating_expenses')
+    savings = _field(3, 'savings')
+    discounted_savings = _field(4, 'discounted_savings')
+
+    def __len__(self):
+        return len(self.install_years)
+
+    @property
+    def analysis_period(self):
+        return self.buffer.shape[2]
+
+    def set_generation(self, annual_energy, degradation):
+        """
+        Fill generation from year 1 kWh at the nameplate capacity
+        (a scalar, or one per install year) and degradation (% a year).
+        """
+        years = np.arange(self.analysis_period)
+        np.multiply(np.asarray(annual_energy, dtype=float)[..., None],
+                    (1 - 0.01*degradation)**years, out=self.generation)
+
+    def columns(self):
+        """
+        {name: 1-D array} in long format, one row per install year and
+        project year.  The fields are views of the buffer.
+        """
+        count, n = self.buffer.shape[1:]
+        columns = {'install_year': np.repeat(self.install_years, n),
+                   'project_year': np.tile(np.arange(1, n + 1), count)}
+        for i, name in enumerate(FIELDS):
+            columns[name] = self.buffer[i].reshape(-1)
+        return columns
+
+    def to_arrow(self):
+        """The columns() as a pyarrow.Table, sharing the buffer."""
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('CashFlowTable.to_arrow needs pyarrow.')
+        columns = self.columns()
+        return pyarrow.table([pyarrow.array(values)
+                              for values in columns.values()],
+                             names=list(columns))
+
+    def write_parquet(self, path):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Writing Parquet files needs pyarrow.')
+        with instrument.span('results.write'):
+            pyarrow.parquet.write_table(self.to_arrow(), path)
+
+    def write_csv(self, path):
+        columns = self.columns()
+        with instrument.span('results.write'):
+            np.savetxt(path, np.column_stack(list(columns.values())),
+                       delimiter=',', header=','.join(columns), comments='',
+                       fmt=['%d', '%d'] + ['%.17g']*len(FIELDS))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Hourly load and export limit scenarios, streamed from memory-mapped files.
+
+A scenario file is a NumPy .npy file holding a (scenarios, 8760) float32
+matrix, one year 1 hourly profile (kW) per row.  Rows rather than columns
+make a chunk of consecutive scenarios one contiguous read; 10,000
+scenarios take 350 MB on disk and never have to be in memory at once.
+
+    loads = scaled('loads.npy', case.dic['load'], np.linspace(0.8, 1.2,
+                   10000), noise=0.1, seed=1)
+    result = evaluate(case.dic, rates, range(2020, 2030), loads=loads)
+    print(np.percentile(result.npv, [5, 50, 95], axis=0))
+
+or, from the command line,
+
+    python -m leac.scenarios case.json loads.npy --count 10000 \\
+        --scale 0.8 1.2 --noise 0.1 --seed 1
+    python -m leac case.json Rates.xlsx --loads loads.npy
+
+evaluate() runs Pvwattsv7 once, at the nameplate capacity, and streams
+the scenarios through in chunks of chunk_size rows: the bill quantities
+of a chunk (leac.bills, with its load and export limits) are priced at
+every install year's rates at once, each project year at the rate row in
+force in its calendar year as in leac.lifetime, and go through the cash
+flow kernel together.  Only the chunk's quantities and the results are
+held; the memory map lets the operating system page the rest in and out.
+
+A load scenario replaces the case's load.  An export limit scenario caps
+the kW sold to the grid each hour (curtailment, or an interconnection
+limit); the case's own grid_curtailment is an input to SAM's grid model,
+which the Pvwattsv7, Utilityrate5 and Cashloan chain does not run.  Both
+need a flat tariff (leac.bills), and evaluate() raises
+bills.UnsupportedTariff otherwise.  Like the cash flow kernel, this
+handles the nonprofit case only.
+
+License: MIT
+"""
+
+import argparse
+import collections
+
+import numpy as np
+
+from leac import bills, cashflow, instrument, lifetime, ratetable
+from leac.generation import GenerationCache
+from leac.models import build_models, base_values
+
+HOURS = int(bills.HOURS_PER_MONTH.sum())
+
+# Scenarios streamed through the bills at once.  Each needs about 4 MB
+# of working arrays for a 25 year analysis period.
+CHUNK_SIZE = 16
+
+# npv, payback and discounted_payback are (scenarios, install years), like
+# montecarlo.MonteCarlo's, so montecarlo.percentiles() summarizes them.
+Scenarios = collections.namedtuple('Scenarios', [
+    'install_years', 'npv', 'payback', 'discounted_payback'])
+
+# The Quantities with a scenario axis; the others are per year only.
+_PER_SCENARIO = ('tier_kwh_w_sys', 'sold_kwh_w_sys', 'demand_w_sys',
+                 'tier_kwh_wo_sys', 'sold_kwh_wo_sys', 'demand_wo_sys')
+
+
+def create(path, count):
+    """A new (count, 8760) float32 scenario file at path, to be filled."""
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                     shape=(int(count), HOURS))
+
+
+def open_profiles(path):
+    """The scenario file at path, memory-mapped read-only."""
+    profiles = np.load(path, mmap_mode='r')
+    if profiles.ndim != 2 or profiles.shape[1] != HOURS:
+        raise ValueError('%s is not a (scenarios, %d) matrix of hourly '
+                         'profiles.' % (path, HOURS))
+    return profiles
+
+
+def scaled(path, profile, scales, noise=0.0, seed=None,
+           chunk_size=1024):
+    """
+    Write a scenario file of profile times each of scales, with each hour
+    also multiplied by 1 + noise*N(0, 1) (not below zero) if noise is set.
+    Returns the file, memory-mapped read-only.
+    """
+    profile = np.asarray(profile, dtype=float)
+    if profile.shape != (HOURS,):
+        raise ValueError('profile is not hourly for one year')
+    scales = np.asarray(scales, dtype=float)
+    rng = np.random.default_rng(seed)
+    profiles = create(path, len(scales))
+    for start in range(0, len(scales), chunk_size):
+        block = profile*scales[start:start + chunk_size, None]
+        if noise:
+            block *= np.maximum(
+                1 + noise*rng.standard_normal(block.shape), 0.0)
+        profiles[start:start + chunk_size] = block
+    profiles.flush()
+    del profiles
+    return open_profiles(path)
+
+
+def _count(loads, export_limits):
+    counts = {len(profiles) for profiles in (loads, export_limits)
+              if profiles is not None}
+    if len(counts) > 1:
+        raise ValueError('loads and export_limits have different numbers '
+                         'of scenarios.')
+    for profiles in (loads, export_limits):
+        if profiles is not None and np.shape(profiles)[1:] != (HOURS,):
+            raise ValueError('Scenarios must be (scenarios, %d) hourly '
+                             'profiles.' % HOURS)
+    return counts.pop() if counts else 1
+
+
+def evaluate(dic, rates, install_years, loads=None, export_limits=None,
+             chunk_size=CHUNK_SIZE, inputs=None):
+    """
+    NPV and paybacks of every scenario for each install year.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows without the title row.
+    loads:      (scenarios, 8760) year 1 hourly loads (kW), such as
+                open_profiles(path); the case's load if None.
+    export_limits:
+                (scenarios, 8760) hourly caps on the kW sold to the grid;
+                no limit if None.
+    inputs:     models.model_inputs(dic), if already at hand.
+
+    Returns Scenarios.
+    """
+    table = ratetable.as_table(rates)
+    install_years = [int(year) for year in install_years]
+    count = _count(loads, export_limits)
+    pv, ur, cl = build_models(dic, inputs)
+    cashflow.check_nonprofit(cl)
+    base = base_values(pv, cl)
+    fin = cashflow.financials(cl)
+    tariff = bills.flat_tariff(ur)
+    n = int(base.analysis_period)
+    index = table.yearly_index(install_years, n)
+    year_rates = np.stack([table.first_block[index], table.rest[index]],
+                          axis=-1)
+    gen = GenerationCache().gen(pv, base.system_capacity)
+    results = np.empty((3, count, len(install_years)))
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        load = (tariff.load if loads is None
+                else np.asarray(loads[start:stop], dtype=float))
+        load = np.broadcast_to(load, (stop - start, HOURS))
+        limit = (None if export_limits is None
+                 else np.asarray(export_limits[start:stop], dtype=float))
+        with instrument.span('bills.energy_value'):
+            q = bills.quantities(tariff, gen, n, load=load,
+                                 export_limit=limit)
+            q = q._replace(**{name: getattr(q, name)[:, None]
+                              for name in _PER_SCENARIO})
+            value = bills.energy_value_by_year(tariff, q, year_rates)
+        with instrument.span('cash_flow'):
+            flows = lifetime.cash_flows(value.reshape(-1, n + 1), fin, base)
+        for i, name in enumerate(('npv', 'payback', 'discounted_payback')):
+            results[i, start:stop] = np.reshape(getattr(flows, name),
+                                                (stop - start, -1))
+    return Scenarios(np.array(install_years), *results)
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac.scenarios',
+        description="Write a scenario file of the case's hourly load "
+                    'scaled by evenly spaced factors, with optional hourly '
+                    'noise.')
+    p.add_argument('case', help='JSON exported from SAM')
+    p.add_argument('output', help='scenario file to write (.npy)')
+    p.add_argument('--count', type=int, required=True,
+                   help='number of scenarios')
+    p.add_argument('--scale', type=float, nargs=2, default=(1.0, 1.0),
+                   metavar=('LOW', 'HIGH'),
+                   help='range of the load factors (default: 1 1)')
+    p.add_argument('--noise', type=float, default=0.0,
+                   help='relative standard deviation of each hour '
+                        '(default: %(default)s)')
+    p.add_argument('--seed', type=int, help='random seed for --noise')
+    return p
+
+
+def main(argv=None):
+    from leac import api
+    args = parser().parse_args(argv)
+    load = api.load_case(args.case).dic['load']
+    scaled(args.output, load, np.linspace(args.scale[0], args.scale[1],
+                                          args.count),
+           noise=args.noise, seed=args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+The segmented NPV and payback calculation for one install year.
+
+The rates change at the years listed in the rate table, so the analysis
+period is split into segments, one per rate row.  Starting from the last
+segment and moving toward the install year, each segment is run through
+Utilityrate5 and Cashloan with a shortened analysis_period and a degraded
+system_capacity.  The segment NPVs are discounted back to the install year
+and added up.
+
+segment_energy_values() runs only the Utilityrate5 half of that, for the
+NumPy cash flow kernel in cashflow.py.
+
+Rate rows are [year, first block rate, remaining kWh rate] without the
+title row, sorted by year, or a ratetable.RateTable.
+
+License: MIT
+"""
+
+import collections
+
+import numpy as np
+
+from leac import cashflow, instrument, ratetable, results
+from leac.bills import UnsupportedTariff
+
+SegmentResult = collections.namedtuple('SegmentResult',
+                                       ['npv', 'payback', 'yearly_savings',
+                                        'installed_cost',
+                                        'discounted_payback'])
+
+
+def rate_window(rates, starting_year):
+    """
+    The rate rows seen by a system installed in starting_year.  The last
+    row at or before starting_year is moved to starting_year and earlier
+    rows are dropped.  rates is not modified.
+    """
+    table = ratetable.as_table(rates)
+    window = table[table.index(starting_year):]
+    if window[0][0] <= starting_year:
+        window[0][0] = starting_year
+    return window
+
+
+def set_rates(ur, first_block_rate, rest_rate):
+    """Put a rate row's prices into the two tier ur_ec_tou_mat."""
+    temp_list = [list(x) for x in ur.ElectricityRates.ur_ec_tou_mat]
+    temp_list[0][4] = first_block_rate
+    temp_list[1][4] = rest_rate
+    ur.ElectricityRates.ur_ec_tou_mat = tuple(temp_list)
+
+
+def evaluate_segments(pv, ur, cl, window, base, gen_cache, verbose=False):
+    """
+    NPV and paybacks for the install year window[0][0].
+
+    window:     rate rows from rate_window().
+    base:       models.Base with the unmodified starting values.  Everything
+                the loop changes is set from base, so the result does not
+                depend on what was run on pv, ur and cl before.
+    gen_cache:  GenerationCache standing in for pv.execute().
+    """
+    degradation = base.degradation
+    npv = 0.0
+    yearly_savings = np.zeros(int(base.analysis_period))
+    first_year = window[0][0]
+    end_year = base.analysis_period + first_year
+    for i in range(len(window)-1, -1, -1):
+        year = window[i][0]
+        years_old = year - first_year
+        set_rates(ur, window[i][1], window[i][2])
+        period = end_year - year
+        capacity = base.system_capacity*(1 - 0.01*degradation)**years_old
+        cl.FinancialParameters.analysis_period = period
+        # Insurance is a percent of total_installed_cost, which does not
+        # shrink with the degraded capacity, so the rate stays as it is.
+        # (Scaling it up by the degradation made the split NPV come out
+        # low against a single stage run.)
+        cl.FinancialParameters.insurance_rate = base.insurance_rate
+        gen_cache.apply(pv, ur, capacity)
+        # Only the generation degrades: Cashloan's capacity based O&M is
+        # for the nameplate, as in a single stage run.
+        pv.SystemDesign.system_capacity = base.system_capacity
+        with instrument.span('ur.execute'):
+            ur.execute()
+        with instrument.span('cl.execute'):
+            cl.execute()
+        net_installed_cost = cl.SystemCosts.total_installed_cost
+        if i != 0:
+            npv = npv + (cl.Outputs.npv + net_installed_cost) /\
+                (1+0.01*cl.FinancialParameters.real_discount_rate)**years_old
+        else:
+            npv = npv + cl.Outputs.npv
+        end_year = year
+        if verbose:
+            print('Year: ', year, 'Years Old: ', years_old, 'Period: ',
+                  period, 'System_Capacity (kW): ', capacity,
+                  'cl.Outputs.npv: ', cl.Outputs.npv, 'NPV: ', npv)
+        installed_cost = cl.Outputs.adjusted_installed_cost
+        # Element 0 of the Cashloan cash flows is year 0, which is dropped
+        # as the segments are joined.
+        start, stop = int(years_old), int(years_old + period)
+        yearly_savings[start:stop] = (
+            np.subtract(cl.Outputs.cf_energy_value,
+                        cl.Outputs.cf_operating_expenses)[1:stop - start + 1] *
+            (1 + 0.01*cl.FinancialParameters.inflation_rate)**years_old)
+    simple, discounted = cashflow.paybacks(yearly_savings,
+                                           cashflow.financials(cl),
+                                           installed_cost)
+    return SegmentResult(npv, float(simple),
+                         results.read_only(yearly_savings), installed_cost,
+                         float(discounted))
+
+
+def segment_energy_values(pv, ur, cl, segments, base, gen_cache, bills=None):
+    """
+    Run only Utilityrate5 (or bills, see segment_energy_value) for each of
+    an install year's segments (from window_segments() or
+    ratetable.RateTable.segments()) and return what cashflow.evaluate()
+    needs for it, in chronological segment order:
+
+        energy_value    (segments, analysis_period + 1)
+        periods         (segments,)
+        years_old       (segments,)
+    """
+    n = int(base.analysis_period)
+    energy_value = np.zeros((len(segments), n + 1))
+    periods = np.zeros(len(segments), dtype=int)
+    years_old = np.zeros(len(segments))
+    for i, segment in enumerate(segments):
+        years_old[i], periods[i] = segment[:2]
+        value = segment_energy_value(pv, ur, cl, base, gen_cache, *segment,
+                                     bills=bills)
+        energy_value[i, :len(value)] = value
+    return energy_value, periods, years_old
+
+
+def window_segments(window, analysis_period):
+    """
+    (years_old, period, first block rate, remaining kWh rate) of each
+    segment of the install year window[0][0], in chronological order.
+    """
+    first_year = window[0][0]
+    end_years = [row[0] for row in window[1:]] + \
+        [first_year + int(analysis_period)]
+    return [(row[0] - first_year, int(end_year - row[0]), row[1], row[2])
+            for row, end_year in zip(window, end_years)]
+
+
+def segment_energy_value(pv, ur, cl, base, gen_cache, years_old, period,
+                         first_block_rate, rest_rate, bills=None):
+    """
+    Utilityrate5 annual_energy_value (year 0 first) of one segment: period
+    years starting when the system is years_old, at the given rates.  With
+    bills (a bills.FlatBills for ur's tariff) the bills are worked out
+    analytically instead of running Utilityrate5, unless the segment is
+    one they do not handle.
+    """
+    capacity = base.system_capacity*(1 - 0.01*base.degradation)**years_old
+    if bills is not None:
+        try:
+            gen = gen_cache.gen(pv, capacity)
+            with instrument.span('bills.energy_value'):
+                return bills.energy_value(gen, period,
+                                          (first_block_rate, rest_rate),
+                                          key=(capacity, int(period)))
+        except UnsupportedTariff:
+            pass
+    set_rates(ur, first_block_rate, rest_rate)
+    # Utilityrate5 shares analysis_period with cl.
+    cl.FinancialParameters.analysis_period = float(period)
+    gen_cache.apply(pv, ur, capacity)
+    with instrument.span('ur.execute'):
+        ur.execute()
+    return ur.Outputs.annual_energy_value
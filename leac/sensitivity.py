@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+One-at-a-time sensitivity of the NPV to the case's inputs, for tornado
+charts and elasticities.
+
+    result = sensitivity(dic, rates, range(2020, 2030),
+                         names=['real_discount_rate', 'losses', 'rates'],
+                         ranges={'degradation': (0.25, 1.0)})
+    for row in tornado(result):     # The first install year, widest first.
+        print(row)
+
+Each input is set to a low and a high value, the others staying at the
+case's values, and every install year is evaluated at each setting as
+sweep.sweep(cash_flow='numpy') would.  By default low and high are the
+case's value -/+ step (10%); ranges gives them outright, which inputs that
+are zero in the case need (without a range they are an error).  The
+inputs are DEFAULT_INPUTS by default, less those that are zero in the
+case.  'rates' is not a SAM input but a factor on both columns of the
+rate table, the LEAC rates, with a base of 1.
+
+The settings share what they can.  An input is read by one or more of
+the compute modules, and that decides how much of the chain it re-runs:
+
+    generation  Pvwattsv7 inputs (losses, tilt, ...): Pvwattsv7 runs once
+                for the new plant, and everything after it.
+    energy      Utilityrate5 inputs and the degradation (inflation_rate,
+                degradation, rate_escalation, ... and 'rates'): the energy
+                values of every segment, on the base generation.
+    cash flow   the rest of the kernel's Cashloan inputs
+                (real_discount_rate, insurance_rate, om_fixed, ...): only
+                the cash flow kernel, on the base energy values.
+
+Settings are grouped into one job per distinct generation and energy
+input, and the jobs run in a process pool.  The cash flow settings all go
+with the base case's job, which works out the energy values once for all
+of them.  Like the cash flow kernel, this handles the nonprofit case
+only, and inputs holding more than one value (schedules) cannot be
+varied.
+
+The elasticity of an install year's NPV is the arc elasticity over the
+range, (npv_high - npv_low)/npv divided by (high - low)/base, NaN where
+the base value or the range is zero.
+
+License: MIT
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+
+import numpy as np
+
+from leac import cashflow, instrument, ratetable
+from leac.bills import FlatBills, flat_tariff
+from leac.models import Base, model_inputs
+from leac.segments import segment_energy_values
+from leac.sweep import _init_worker as _init_sweep_worker
+from leac.sweep import _worker, _numpy_results, map_jobs
+
+RATES = 'rates'
+
+DEFAULT_INPUTS = ('real_discount_rate', 'inflation_rate', 'insurance_rate',
+                  'degradation', 'losses', RATES)
+
+STEP = 0.1
+
+# Inputs that sensitivity() cannot vary: the segment loop sets them.
+FIXED = ('analysis_period', 'system_capacity')
+
+# names, base, low and high are per input; npv is (install years,) and
+# npv_low, npv_high and elasticity (inputs, install years).  plants is the
+# number of distinct generation settings, each one Pvwattsv7 plant.
+Sensitivity = collections.namedtuple('Sensitivity', [
+    'install_years', 'names', 'base', 'low', 'high', 'npv', 'npv_low',
+    'npv_high', 'elasticity', 'plants'])
+
+
+def stages(dic, inputs=None):
+    """
+    {input name: 'generation', 'energy' or 'cash_flow'} for every input of
+    the case that Pvwattsv7, Utilityrate5 or the cash flow kernel reads.
+    """
+    inputs = inputs if inputs is not None else model_inputs(dic)
+
+    def names(module):
+        return {name for group in inputs[module].values() for name in group}
+    stage = {name: 'cash_flow' for name in cashflow.Financials._fields
+             if name in names('cashloan')}
+    stage.update({name: 'energy' for name in names('utilityrate5')})
+    stage.update({name: 'generation' for name in names('pvwattsv7')})
+    stage[RATES] = 'energy'
+    for name in FIXED:
+        stage.pop(name, None)
+    return stage
+
+
+def _value(dic, name):
+    if name == RATES:
+        return 1.0
+    value = dic[name]
+    if isinstance(value, (list, tuple)):
+        if len(value) != 1:
+            raise ValueError('%s holds %d values; only single values can '
+                             'be varied.' % (name, len(value)))
+        value = value[0]
+    return float(value)
+
+
+def settings(dic, names=None, step=STEP, ranges=None):
+    """
+    {name: (base, low, high)} of names (and of the keys of ranges, which
+    give low and high outright).  names defaults to the DEFAULT_INPUTS
+    that are not zero in dic.
+    """
+    ranges = dict(ranges or {})
+    if names is None:
+        names = [name for name in DEFAULT_INPUTS
+                 if name in ranges or name == RATES or
+                 (name in dic and _value(dic, name) != 0)]
+    result = {}
+    for name in list(names) + [name for name in ranges if name not in names]:
+        if name != RATES and name not in dic:
+            raise ValueError('The case has no input called %r.' % name)
+        base = _value(dic, name)
+        if name not in ranges and base == 0:
+            raise ValueError('%s is 0 in the case, so -/+ step of it is no '
+                             'range; give its low and high in ranges.'
+                             % name)
+        low, high = ranges.get(name, (base*(1 - step), base*(1 + step)))
+        result[name] = (base, float(low), float(high))
+    return result
+
+
+@contextlib.contextmanager
+def _overrides(models, values):
+    """Set {name: value} in the data the models share, then put it back."""
+    saved = []
+    try:
+        for name, value in values.items():
+            for model in models:
+                try:
+                    old = model.value(name)
+                except AttributeError:
+                    continue  # Not one of this module's inputs.
+                saved.append((model, name, old))
+                model.value(name, (value,) if isinstance(old, tuple)
+                            else value)
+        yield
+    finally:
+        for model, name, old in reversed(saved):
+            model.value(name, old)
+
+
+def _init_worker(dic, inputs=None, exact_generation=False,
+                 analytic_bills=True, instrumentation=None):
+    _init_sweep_worker(dic, exact_generation, inputs, analytic_bills,
+                       instrumentation)
+    pv, ur, cl = _worker['models']
+    cashflow.check_nonprofit(cl)
+    _worker['financials'] = cashflow.financials(cl)
+
+
+def _replace(values, base, fin):
+    """base and fin with the fields of values that they have."""
+    return (base._replace(**{name: value for name, value in values.items()
+                             if name in Base._fields}),
+            fin._replace(**{name: value for name, value in values.items()
+                            if name in cashflow.Financials._fields}))
+
+
+def _run_setting(job):
+    """[(index, npv over install_years)] of one generation and energy."""
+    generation, energy, variants, rates, install_years = job
+    pv, ur, cl = _worker['models']
+    gen_cache = _worker['gen_cache']
+    energy = dict(energy)
+    scale = energy.pop(RATES, 1.0)
+    if scale != 1.0:
+        rates = ratetable.RateTable(rates.year, rates.first_block*scale,
+                                    rates.rest*scale)
+    results = []
+    with _overrides((pv, ur, cl), dict(generation, **energy)):
+        base, fin = _replace(dict(generation, **energy), _worker['base'],
+                             _worker['financials'])
+        # The same nameplate run as the base plant's, so results do not
+        # depend on which worker gets the job.
+        gen_cache.seed(pv, base.system_capacity)
+        bills = _worker['bills']
+        if bills is not None and (generation or energy):
+            # Quantities are keyed on capacity and the tariff is read once.
+            bills = FlatBills(flat_tariff(ur))
+        energy_values = []
+        for starting_year in install_years:
+            with instrument.span('install_year', year=starting_year):
+                energy_values.append(segment_energy_values(
+                    pv, ur, cl, rates.segments(starting_year,
+                                               base.analysis_period),
+                    base, gen_cache, bills))
+    for index, values in variants:
+        variant_base, variant_fin = _replace(values, base, fin)
+        with instrument.span('cash_flow'):
+            flows = _numpy_results([(value, variant_fin, variant_base)
+                                    for value in energy_values])
+        results.append((index, np.array([r.npv for r in flows])))
+    return results
+
+
+def _jobs(ranges, stage, rates, install_years):
+    """
+    One job per distinct generation and energy setting: the base case's
+    job carries every cash flow setting.  Setting 0 is the base case, and
+    2*i + 1 and 2*i + 2 the low and high of the i-th input.
+    """
+    groups = collections.OrderedDict()
+    groups[(), ()] = [(0, {})]
+    for i, (name, (_, low, high)) in enumerate(ranges.items()):
+        for index, value in ((2*i + 1, low), (2*i + 2, high)):
+            if stage[name] == 'cash_flow':
+                groups[(), ()].append((index, {name: value}))
+            elif stage[name] == 'generation':
+                groups.setdefault((((name, value),), ()), []).append(
+                    (index, {}))
+            else:
+                groups.setdefault(((), ((name, value),)), []).append(
+                    (index, {}))
+    return [(dict(generation), dict(energy), variants, rates, install_years)
+            for (generation, energy), variants in groups.items()]
+
+
+def sensitivity(dic, rates, install_years, names=None, step=STEP,
+                ranges=None, workers=None, exact_generation=False,
+                inputs=None, analytic_bills=True):
+    """
+    NPV of every install year with each of names (and of the keys of
+    ranges) set low and high in turn.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows without the title row.
+    names:      inputs to vary by -/+ step of their value; see stages()
+                for what can be varied, and RATES for the rate table.
+                None for the DEFAULT_INPUTS that are not zero in dic.
+    ranges:     {name: (low, high)}.
+    workers, exact_generation, inputs and analytic_bills are as for
+    sweep.sweep.
+
+    Returns a Sensitivity.
+    """
+    table = ratetable.as_table(rates)
+    install_years = [int(year) for year in install_years]
+    inputs = inputs if inputs is not None else model_inputs(dic)
+    stage = stages(dic, inputs)
+    ranges = settings(dic, names, step, ranges)
+    for name in ranges:
+        if name not in stage:
+            raise ValueError('%s is not an input sensitivity() can vary.'
+                             % name)
+    jobs = _jobs(ranges, stage, table, install_years)
+    if workers == 1 or len(jobs) <= 1:
+        _init_worker(dic, inputs, exact_generation, analytic_bills)
+        done = [_run_setting(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(dic, inputs, exact_generation, analytic_bills,
+                          instrument.settings())) as pool:
+            done = map_jobs(pool, _run_setting, jobs)
+    npv = np.empty((2*len(ranges) + 1, len(install_years)))
+    for results in done:
+        for index, values in results:
+            npv[index] = values
+    base, low, high = (np.array(column, dtype=float)
+                       for column in zip(*ranges.values()))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.where((base != 0) & (high != low),
+                            (high - low)/base, np.nan)
+        elasticity = (npv[2::2] - npv[1::2])/npv[0]/relative[:, None]
+    return Sensitivity(
+        install_years=np.array(install_years), names=list(ranges),
+        base=base, low=low, high=high, npv=npv[0], npv_low=npv[1::2],
+        npv_high=npv[2::2], elasticity=elasticity,
+        plants=1 + sum(1 for job in jobs if job[0]))
+
+
+def widest_first(result, k=0):
+    """The inputs' indices by NPV swing in install year k, widest first."""
+    swing = np.abs(result.npv_high[:, k] - result.npv_low[:, k])
+    return np.argsort(-swing, kind='stable')
+
+
+def tornado(result, k=0):
+    """
+    (name, low, high, npv_low, npv_high) of each input for install year
+    result.install_years[k], the widest NPV swing first.
+    """
+    return [(result.names[i], result.low[i], result.high[i],
+             result.npv_low[i, k], result.npv_high[i, k])
+            for i in widest_first(result, k)]
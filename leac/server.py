@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+A local evaluation service that keeps cases warm between requests.
+
+    python -m leac.server --case guam=100kW_PVWatts_05degr.json
+    python -m leac.server --socket /tmp/leac.sock --max-cases 16
+
+    curl -s localhost:8765/evaluate -d '{"case": "guam",
+        "rates": "Rates.xlsx", "install_years": [2020, 2021, 2022]}'
+    curl -s --unix-socket /tmp/leac.sock http://leac/status
+
+Starting a script or python -m leac pays for the interpreter, the PySAM
+and NumPy imports, reading the case and building the models every time.
+The service pays once: it keeps the most recently used cases (each an
+incremental.Evaluator with its Pvwattsv7, Utilityrate5 and Cashloan models
+and its memo of segments) in a bounded pool, least recently used first
+out, and likewise the rate tables it has read.  A case or rate file is
+read again when its modification time or size changes.
+
+POST /evaluate takes a JSON object with
+
+    case            a name given with --case, or the path of a SAM JSON
+    rates           a rate file path, or [year, first block rate,
+                    remaining kWh rate] rows
+    install_years   a list of years, or start and years as for python -m
+                    leac (the first rate year and 5 by default)
+
+and answers with what python -m leac --format json writes (the case, the
+rates and a results row per install year) and the seconds it took.  GET
+/status gives the cases held and how often the pool was hit.  Errors
+come back as {"error": message}, with status 400 for a bad request.
+
+Cases that the NumPy cash flow kernel cannot handle (see
+cashflow.check_nonprofit) are kept as well, and run Cashloan for every
+segment in the service's process.  One evaluation runs at a time, since
+the PySAM models are not shared between threads; /status answers while
+one runs.  The service reads any path it is asked to, so it only
+listens on 127.0.0.1 (or a Unix socket), and is for local use only.
+
+License: MIT
+"""
+
+import argparse
+import collections
+import http.server
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+from leac import api, ratetable
+
+DEFAULT_PORT = 8765
+# The service reads any path a request names, so it only ever listens on
+# the loopback interface (or a Unix socket).
+HOST = '127.0.0.1'
+
+
+def _stamp(path):
+    """What identifies the contents of the file at path."""
+    info = os.stat(path)
+    return os.path.abspath(path), info.st_mtime_ns, info.st_size
+
+
+class CasePool(object):
+    """
+    Warm cases and rate tables, least recently used first out.
+
+    cases:      {name: case JSON path} for the names requests may use.
+    max_cases:  cases (and rate tables) kept.
+    """
+
+    def __init__(self, cases=None, max_cases=8):
+        self.names = dict(cases or {})
+        self.max_cases = max_cases
+        self.counts = collections.Counter()
+        self._cases = collections.OrderedDict()
+        self._rates = collections.OrderedDict()
+        # Guards the memos and counts, which status() reads from another
+        # thread while an evaluation runs.  Not held while loading.
+        self._lock = threading.Lock()
+
+    def _get(self, memo, key, load, name):
+        with self._lock:
+            entry = memo.get(key)
+            if entry is not None:
+                memo.move_to_end(key)
+                self.counts[name + '_hits'] += 1
+                return entry
+        entry = load()
+        with self._lock:
+            self.counts[name + '_loads'] += 1
+            memo[key] = entry
+            while len(memo) > self.max_cases:
+                memo.popitem(last=False)
+        return entry
+
+    def case(self, name):
+        """(api.Case, incremental.Evaluator or None) for a name or path."""
+        path = self.names.get(name, name)
+        if not os.path.isfile(path):
+            raise ValueError('There is no case called %r.' % name)
+
+        def load():
+            case = api.load_case(path)
+            try:
+                return case, api.evaluator(case)
+            except ValueError:
+                return case, None  # Not a case the kernel handles.
+        return self._get(self._cases, _stamp(path), load, 'case')
+
+    def rates(self, rates):
+        """The RateTable of a file path or of rate rows."""
+        if isinstance(rates, str):
+            return self._get(self._rates, _stamp(rates),
+                             lambda: api.load_rates(rates), 'rates')
+        return ratetable.as_table(rates)
+
+    def evaluate(self, request):
+        """The JSON document for an /evaluate request."""
+        for name in ('case', 'rates'):
+            if name not in request:
+                raise ValueError('The request needs "%s".' % name)
+        case, evaluator = self.case(request['case'])
+        rates = self.rates(request['rates'])
+        if 'install_years' in request:
+            install_years = request['install_years']
+        else:
+            start = int(request.get('start', rates.year[0]))
+            install_years = range(start, start + int(
+                request.get('years', api.YEARS_TO_PLOT)))
+        if evaluator is not None:
+            evaluation = api.evaluate(case, rates, install_years,
+                                      evaluator=evaluator)
+        else:
+            evaluation = api.evaluate(case, rates, install_years, workers=1,
+                                      cash_flow='pysam')
+        with self._lock:
+            self.counts['evaluations'] += 1
+        return {'case': request['case'],
+                'rates': (request['rates']
+                          if isinstance(request['rates'], str) else None),
+                'results': api.rows(evaluation)}
+
+    def status(self):
+        with self._lock:
+            return {'cases': [path for path, _, _ in self._cases],
+                    'rate_files': [path for path, _, _ in self._rates],
+                    'max_cases': self.max_cases,
+                    'counts': dict(self.counts)}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """JSON over HTTP for the CasePool in self.server.pool."""
+
+    def _send(self, status, document):
+        body = json.dumps(document, indent=2).encode('utf-8') + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self._send(404, {'error': 'Use GET /status or POST '
+                                             '/evaluate.'})
+        self._send(200, self.server.pool.status())
+
+    def do_POST(self):
+        if self.path != '/evaluate':
+            return self._send(404, {'error': 'Use GET /status or POST '
+                                             '/evaluate.'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request is not a JSON object.')
+            started = time.perf_counter()
+            with self.server.lock:
+                document = self.server.pool.evaluate(request)
+            document['seconds'] = time.perf_counter() - started
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            return self._send(400, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': '%s: %s'
+                                    % (type(e).__name__, e)})
+        self._send(200, document)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address[0]) if self.client_address else '-'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class _TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(pool, port=DEFAULT_PORT, socket_path=None, quiet=False):
+    """An HTTP server for pool on HOST:port, or on the Unix socket_path."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError('%s exists and is not a socket.'
+                                 % socket_path)
+            os.remove(socket_path)
+        server = _UnixServer(socket_path, Handler)
+    else:
+        server = _TCPServer((HOST, port), Handler)
+    server.pool = pool
+    server.lock = threading.Lock()
+    server.quiet = quiet
+    return server
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m leac.server',
+        description='Serve NPV and payback evaluations over local HTTP, '
+                    'keeping cases warm between requests.')
+    p.add_argument('--case', action='append', default=[],
+                   metavar='NAME=PATH',
+                   help='a case requests can name; loaded at startup '
+                        '(repeatable)')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT,
+                   help='port to listen on at %s (default: %%(default)s)'
+                        % HOST)
+    p.add_argument('--socket', metavar='PATH',
+                   help='listen on this Unix socket instead')
+    p.add_argument('--max-cases', type=int, default=8,
+                   help='cases and rate tables kept warm (default: '
+                        '%(default)s)')
+    p.add_argument('--quiet', action='store_true',
+                   help='do not log requests')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    cases = {}
+    for item in args.case:
+        name, separator, path = item.partition('=')
+        if not separator:
+            parser().error('--case takes NAME=PATH, not %r' % item)
+        cases[name] = path
+    pool = CasePool(cases, max_cases=args.max_cases)
+    for name in cases:
+        pool.case(name)
+    server = make_server(pool, args.port, args.socket, args.quiet)
+    # Stopped with kill as well as ^C, the socket file still goes.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Serving on %s' % (args.socket or 'http://%s:%d' % (
+        HOST, server.server_address[1])), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
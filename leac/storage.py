@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Battery sizing: the NPV of each battery size for each install year under
+the changing rates.
+
+    result = size_sweep(dic, rates, range(2020, 2030),
+                        kwh=[0, 100, 200, 400], kw=[50, 100, 200])
+    print(result.kwh, result.kw, result.npv)   # npv is (sizes, years)
+
+The case's compute modules include Battwatts (SAM's PVWatts battery
+model) between Pvwattsv7 and Utilityrate5, with batt_simple_enable off,
+and the scripts never run it.  Here it is chained on the
+Pvwattsv7 -> Utilityrate5 -> Cashloan models with
+from_existing(pv, 'PVWattsBatteryCommercial'), and a battery of
+batt_simple_kwh and batt_simple_kw is dispatched for every size on the
+grid of kwh and kw.
+
+Pvwattsv7 runs once, in the calling process.  Its hourly ac and dc output
+goes to the workers, and each worker's Battwatts model reads them instead
+of running PV again.  Battwatts's gen (the PV output with the battery
+charging and discharging) is priced as in leac.lifetime: each project year
+at the rate row in force in its calendar year, with the analytic bills for
+flat tariffs, and the cash flow kernel for the NPV and paybacks.  Sizes
+with no kWh or no kW are the system without a battery.
+
+The battery adds per_kwh*kwh + per_kw*kw to total_installed_cost, by
+default the case's battery_per_kWh.  Like SAM without lifetime output,
+Battwatts dispatches year 1 and Utilityrate5 degrades the result with the
+PV.  Battery replacements, battery O&M and capacity fade are not
+modelled, and like the cash flow kernel this handles the nonprofit case
+only.
+
+License: MIT
+"""
+
+import collections
+import concurrent.futures
+import itertools
+
+import numpy as np
+import PySAM.Battwatts as Battwatts
+import PySAM.PySSC as pssc
+
+from leac import cashflow, instrument, lifetime, ratetable
+from leac.bills import FlatBills, UnsupportedTariff, flat_tariff
+from leac.models import build_models, base_values
+from leac.sweep import _worker, map_jobs
+
+BatteryCosts = collections.namedtuple('BatteryCosts', ['per_kwh', 'per_kw'],
+                                      defaults=[0.0])
+
+# npv, payback and discounted_payback are (sizes, install years), with
+# sizes in the order of kwh and kw.
+SizeSweep = collections.namedtuple('SizeSweep', [
+    'install_years', 'kwh', 'kw', 'npv', 'payback', 'discounted_payback'])
+
+# The Pvwattsv7 outputs Battwatts reads.
+PVOutput = collections.namedtuple('PVOutput', ['ac', 'dc', 'gen',
+                                               'inverter_efficiency'])
+
+
+def default_costs(dic):
+    """The case's battery_per_kWh."""
+    return BatteryCosts(per_kwh=float(dic.get('battery_per_kWh', 0.0)))
+
+
+def battery_inputs(dic):
+    """The Battwatts input groups of a SAM JSON dictionary."""
+    groups = Battwatts.wrap(pssc.dict_to_ssc_table(dic, 'battwatts')).export()
+    groups.pop('Outputs', None)
+    return groups
+
+
+def _init_worker(dic, pv_output, inputs=None, analytic_bills=True,
+                 instrumentation=None):
+    instrument.configure(instrumentation)
+    _worker.clear()
+    pv, ur, cl = build_models(dic, inputs)
+    cashflow.check_nonprofit(cl)
+    battery = Battwatts.from_existing(pv, 'PVWattsBatteryCommercial')
+    battery.assign(battery_inputs(dic))
+    battery.Battery.ac = tuple(pv_output.ac)
+    battery.Battery.dc = tuple(pv_output.dc)
+    battery.Battery.inverter_efficiency = pv_output.inverter_efficiency
+    battery.Battery.batt_simple_enable = 1
+    _worker['models'] = (pv, ur, cl)
+    _worker['battery'] = battery
+    _worker['pv_gen'] = np.asarray(pv_output.gen)
+    _worker['base'] = base_values(pv, cl)
+    _worker['financials'] = cashflow.financials(cl)
+    _worker['bills'] = None
+    if analytic_bills:
+        try:
+            _worker['bills'] = FlatBills(flat_tariff(ur))
+        except UnsupportedTariff:
+            pass  # Utilityrate5 it is.
+
+
+def _run_size(job):
+    """(npv, payback, discounted_payback) over install_years of one size."""
+    (kwh, kw), costs, rates, install_years = job
+    pv, ur, cl = _worker['models']
+    base = _worker['base']
+    gen = _worker['pv_gen']
+    if kwh > 0 and kw > 0:
+        battery = _worker['battery']
+        battery.Battery.batt_simple_kwh = kwh
+        battery.Battery.batt_simple_kw = kw
+        with instrument.span('battery.execute'):
+            battery.execute()
+        gen = np.asarray(battery.Outputs.gen)
+    value = lifetime.gen_energy_values(gen, ur, cl, rates, install_years,
+                                       base.analysis_period, _worker['bills'])
+    fin = _worker['financials']
+    fin = fin._replace(total_installed_cost=fin.total_installed_cost +
+                       costs.per_kwh*kwh + costs.per_kw*kw)
+    with instrument.span('cash_flow'):
+        flows = lifetime.cash_flows(value, fin, base)
+    return flows.npv, flows.payback, flows.discounted_payback
+
+
+def size_sweep(dic, rates, install_years, kwh, kw, costs=None, workers=None,
+               inputs=None, analytic_bills=True):
+    """
+    NPV and paybacks of every battery size for each install year.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows without the title row.
+    kwh, kw:    battery capacities (kWh) and powers (kW); every pair is a
+                size.
+    costs:      BatteryCosts; default_costs(dic) if None.
+    workers, inputs and analytic_bills are as for sweep.sweep.
+
+    Returns a SizeSweep.
+    """
+    table = ratetable.as_table(rates)
+    install_years = [int(year) for year in install_years]
+    costs = costs if costs is not None else default_costs(dic)
+    sizes = [(float(e), float(p)) for e, p in itertools.product(kwh, kw)]
+    if not sizes:
+        raise ValueError('kwh and kw need at least one value each.')
+    pv, ur, cl = build_models(dic, inputs)
+    cashflow.check_nonprofit(cl)
+    with instrument.span('pv.execute'):
+        pv.execute()
+    pv_output = PVOutput(np.asarray(pv.Outputs.ac), np.asarray(pv.Outputs.dc),
+                         np.asarray(pv.Outputs.gen),
+                         pv.Outputs.inverter_efficiency)
+    jobs = [(size, costs, table, install_years) for size in sizes]
+    if workers == 1:
+        _init_worker(dic, pv_output, inputs, analytic_bills)
+        results = [_run_size(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(dic, pv_output, inputs, analytic_bills,
+                          instrument.settings())) as pool:
+            results = map_jobs(pool, _run_size, jobs)
+    npv, payback, discounted_payback = (np.array(column)
+                                        for column in zip(*results))
+    return SizeSweep(install_years=np.array(install_years),
+                     kwh=np.array([size[0] for size in sizes]),
+                     kw=np.array([size[1] for size in sizes]),
+                     npv=npv, payback=payback,
+                     discounted_payback=discounted_payback)
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Install year sweep engine.
+
+Each install year is an independent job: it gets its own window of the rate
+table (see segments.rate_window) and runs on PySAM objects built from the
+SAM JSON dictionary, so no job can see what another one did.  The jobs run
+in a concurrent.futures process pool and come back in install year order.
+
+The generation of every segment comes from one LifetimeGeneration (see
+leac.generation): the plant's profile at each age, worked out from one
+Pvwattsv7 run at the nameplate capacity.  With a pool it is built before
+the workers start and written to a temporary .npy file that they all map,
+so Pvwattsv7 runs once for the sweep instead of in every worker.  The
+generation is then the same rows in every process, and the parallel
+results are bit-identical to sweep(..., workers=1), which runs the same
+jobs serially in this process.
+
+With cash_flow='numpy' the workers only run Utilityrate5 for each segment
+(or work the bills out with leac.bills, for flat tiered tariffs) and the
+cash flows of all install years and segments are computed in one call to
+cashflow.evaluate() (nonprofit cases only).
+
+    results = sweep(dic, rate_table[1:], range(2020, 2050))
+    npv_array = np.array([r.npv for r in results])
+
+stream() runs the same jobs but yields each install year's result as it
+finishes, for front ends that show results as they come and let the user
+cancel the rest.
+
+License: MIT
+"""
+
+import concurrent.futures
+import contextlib
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+from leac import cashflow, instrument, ratetable, results
+from leac.bills import FlatBills, UnsupportedTariff, flat_tariff
+from leac.generation import GenerationCache, LifetimeGeneration
+from leac.models import build_models, base_values
+from leac.segments import (rate_window, evaluate_segments,
+                           segment_energy_values, SegmentResult)
+
+_worker = {}  # Per process models and generation cache.
+
+
+def _lifetime_generation(gen_cache, pv, base, path=None):
+    return LifetimeGeneration.build(gen_cache, pv, base.system_capacity,
+                                    base.degradation, base.analysis_period,
+                                    path)
+
+
+@contextlib.contextmanager
+def _shared_generation(dic, exact_generation=False, inputs=None):
+    """
+    The case's LifetimeGeneration in a temporary file for workers to map
+    (None if its plant cannot be scaled), removed on exit.
+    """
+    pv, ur, cl = build_models(dic, inputs)
+    gen_cache = GenerationCache(exact=exact_generation)
+    with tempfile.TemporaryDirectory(prefix='leac-') as directory:
+        yield _lifetime_generation(gen_cache, pv, base_values(pv, cl),
+                                   os.path.join(directory, 'gen.npy'))
+
+
+def _init_worker(dic, exact_generation=False, inputs=None,
+                 analytic_bills=True, instrumentation=None, generation=None,
+                 seed=True):
+    instrument.configure(instrumentation)
+    _worker.clear()
+    pv, ur, cl = build_models(dic, inputs)
+    base = base_values(pv, cl)
+    gen_cache = GenerationCache(exact=exact_generation)
+    # Without seed the caller files its own plants (see optimize.py).
+    if seed and generation is None:
+        generation = _lifetime_generation(gen_cache, pv, base)
+    if seed and generation is not None:
+        gen_cache.add(generation)
+    elif seed:
+        gen_cache.seed(pv)  # Simulated capacity by capacity.
+    _worker['models'] = (pv, ur, cl)
+    _worker['base'] = base
+    _worker['gen_cache'] = gen_cache
+    _worker['bills'] = None
+    if analytic_bills:
+        try:
+            _worker['bills'] = FlatBills(flat_tariff(ur))
+        except UnsupportedTariff:
+            pass  # Utilityrate5 it is.
+
+
+def _run_install_year(job):
+    starting_year, rates = job
+    pv, ur, cl = _worker['models']
+    with instrument.span('install_year', year=starting_year):
+        return evaluate_segments(pv, ur, cl,
+                                 rate_window(rates, starting_year),
+                                 _worker['base'], _worker['gen_cache'])
+
+
+def _run_energy_values(job):
+    starting_year, rates = job
+    pv, ur, cl = _worker['models']
+    if 'financials' not in _worker:
+        cashflow.check_nonprofit(cl)
+        _worker['financials'] = cashflow.financials(cl)
+    with instrument.span('install_year', year=starting_year):
+        energy_values = segment_energy_values(
+            pv, ur, cl,
+            rates.segments(starting_year, _worker['base'].analysis_period),
+            _worker['base'], _worker['gen_cache'], _worker['bills'])
+    annual_energy = _worker['gen_cache'].gen(
+        pv, _worker['base'].system_capacity).sum()
+    return (energy_values, _worker['financials'], _worker['base'],
+            annual_energy)
+
+
+def _numpy_results(energy_values, out=None):
+    """
+    Stack the per install year segments and run the cash flow kernel,
+    into the results.CashFlowTable out if given.  energy_values are
+    (segment energy values, financials, base) or, from
+    _run_energy_values, those and the year 1 kWh.
+    """
+    fin, base = energy_values[0][1:3]
+    segments = max(len(values[0][1]) for values in energy_values)
+    shape = (len(energy_values), segments)
+    energy_value = np.zeros(shape + (fin.analysis_period + 1,))
+    periods = np.zeros(shape, dtype=int)
+    years_old = np.zeros(shape)
+    for k, ((value, period, old), *_) in enumerate(energy_values):
+        energy_value[k, :len(period)] = value
+        periods[k, :len(period)] = period
+        years_old[k, :len(period)] = old
+    cash_flows = cashflow.evaluate(energy_value, periods, years_old, fin,
+                                   base.system_capacity, out=out)
+    if out is not None and len(energy_values[0]) > 3:
+        out.set_generation([values[3] for values in energy_values],
+                           base.degradation)
+    savings = results.read_only(cash_flows.yearly_savings)
+    return [SegmentResult(cash_flows.npv[k], cash_flows.payback[k],
+                          savings[k],
+                          fin.total_installed_cost,
+                          cash_flows.discounted_payback[k])
+            for k in range(len(energy_values))]
+
+
+def map_jobs(pool, function, jobs, chunksize=1):
+    """
+    pool.map(function, jobs) as a list, bringing back what the workers
+    recorded when leac.instrument is on.
+    """
+    if not instrument.enabled():
+        return list(pool.map(function, jobs, chunksize=chunksize))
+    return instrument.gather(pool.map(
+        functools.partial(instrument.collected, function), jobs,
+        chunksize=chunksize))
+
+
+def _runner(cash_flow):
+    """The job function for cash_flow."""
+    if cash_flow not in ('pysam', 'numpy'):
+        raise ValueError("cash_flow must be 'pysam' or 'numpy', not %r"
+                         % (cash_flow,))
+    return _run_energy_values if cash_flow == 'numpy' else _run_install_year
+
+
+def sweep(dic, rates, install_years, workers=None, exact_generation=False,
+          cash_flow='pysam', inputs=None, analytic_bills=True, out=None):
+    """
+    Evaluate every install year in install_years.
+
+    dic:        SAM JSON dictionary.
+    rates:      ratetable.RateTable, or rate rows [year, first block rate,
+                rest rate] without the title row.
+    workers:    process count (None for one per CPU); 1 runs serially in
+                this process without a pool.
+    cash_flow:  'pysam' runs Cashloan for every segment, 'numpy' uses the
+                cash flow kernel instead.
+    inputs:     models.model_inputs(dic), if already at hand (see
+                leac.casecache); saves rebuilding the SSC tables.
+    analytic_bills:
+                with cash_flow='numpy', work out the bills with leac.bills
+                instead of running Utilityrate5 when the tariff allows it.
+    out:        with cash_flow='numpy', a results.CashFlowTable of
+                install_years to fill with the yearly cash flows.
+
+    Returns a list of segments.SegmentResult in install_years order.
+    """
+    run = _runner(cash_flow)
+    if out is not None and cash_flow != 'numpy':
+        raise ValueError("out needs cash_flow='numpy'")
+    rates = ratetable.as_table(rates)
+    jobs = [(int(starting_year), rates) for starting_year in install_years]
+    if workers == 1 or len(jobs) <= 1:
+        _init_worker(dic, exact_generation, inputs, analytic_bills)
+        results = [run(job) for job in jobs]
+    else:
+        with _shared_generation(dic, exact_generation, inputs) as generation, \
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker,
+                    initargs=(dic, exact_generation, inputs, analytic_bills,
+                              instrument.settings(), generation)) as pool:
+            results = map_jobs(pool, run, jobs)
+    if cash_flow == 'numpy' and results:
+        with instrument.span('cash_flow'):
+            results = _numpy_results(results, out)
+    return results
+
+
+def stream(dic, rates, install_years, workers=None, exact_generation=False,
+           cash_flow='pysam', inputs=None, analytic_bills=True, cancel=None):
+    """
+    sweep() one install year at a time: yields (index in install_years,
+    segments.SegmentResult) as each install year finishes, in the order
+    they finish.  With cash_flow='numpy' the cash flow kernel runs on each
+    install year as it comes back.
+
+    cancel:     a threading.Event.  Once it is set no more results are
+                yielded and the install years not yet started are
+                dropped; the ones running in the pool finish first.
+
+    Closing the generator early cancels the rest the same way.
+    """
+    run = _runner(cash_flow)
+    rates = ratetable.as_table(rates)
+    jobs = [(int(starting_year), rates) for starting_year in install_years]
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def finish(result):
+        if cash_flow != 'numpy':
+            return result
+        with instrument.span('cash_flow'):
+            return _numpy_results([result])[0]
+
+    if workers == 1 or len(jobs) <= 1:
+        _init_worker(dic, exact_generation, inputs, analytic_bills)
+        for index, job in enumerate(jobs):
+            if cancelled():
+                return
+            yield index, finish(run(job))
+        return
+    with _shared_generation(dic, exact_generation, inputs) as generation, \
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(dic, exact_generation, inputs, analytic_bills,
+                          instrument.settings(), generation)) as pool:
+        collect = instrument.enabled()
+        if collect:
+            run = functools.partial(instrument.collected, run)
+        futures = {pool.submit(run, job): index
+                   for index, job in enumerate(jobs)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                if cancelled():
+                    return
+                result = future.result()
+                if collect:
+                    result, = instrument.gather([result])
+                yield futures[future], finish(result)
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+A Tk window that runs the install year sweep in the background.
+
+    evaluation = run_sweep(case, rates, range(2020, 2050), workers=None)
+
+LEAC_plot_iter.py used to run the whole sweep on the Tk main thread and
+then block in plt.show(), with nothing to see and no way to stop it until
+the last install year was done.  Here a background thread drives
+api.evaluate_stream() (the process pool does the work) and hands each
+install year's result to the window through a queue.  The window polls
+the queue every POLL_MS milliseconds, moves the progress bar and redraws
+the NPV and simple payback bar charts with the install years done so far,
+so the first bars show up as soon as the first install year finishes.
+
+Cancel stops the sweep: the install years not yet started are dropped and
+the ones running finish first.  Closing the window cancels as well.
+run_sweep() returns once the window is closed, with an api.Evaluation of
+the install years that finished, in install year order, and raises what
+the sweep raised if it failed.
+
+tkinter and matplotlib (with its TkAgg backend) are imported when the
+window is made.
+
+License: MIT
+"""
+
+import queue
+import threading
+import time
+
+from leac import api, dialogs, plots
+
+POLL_MS = 100
+
+
+class SweepWindow(object):
+    """
+    The sweep of case under rates for install_years, with a progress bar,
+    live bar charts and a Cancel button.  options go to
+    api.evaluate_stream (workers, cash_flow, ...).
+    """
+
+    def __init__(self, case, rates, install_years, title=None, **options):
+        import tkinter as tk
+        from tkinter import ttk
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+
+        self.install_years = [int(year) for year in install_years]
+        self.results = {}
+        self.error = None
+        self.cancel = threading.Event()
+        self._queue = queue.Queue()
+        self._started = time.perf_counter()
+
+        self.window = tk.Toplevel(dialogs.root())
+        self.window.title(title or 'LEAC install year sweep')
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+        self.figure = Figure(figsize=(10, 4))
+        self.axes = self.figure.subplots(1, len(plots.CHARTS))
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.window)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        bar = ttk.Frame(self.window, padding=4)
+        bar.pack(fill=tk.X)
+        self.progress = ttk.Progressbar(bar, mode='determinate',
+                                        maximum=max(len(self.install_years),
+                                                    1))
+        self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.status = ttk.Label(bar, width=36)
+        self.status.pack(side=tk.LEFT, padx=4)
+        self.button = ttk.Button(bar, text='Cancel', command=self.stop)
+        self.button.pack(side=tk.RIGHT)
+        self._draw()
+
+        self._thread = threading.Thread(
+            target=self._run, args=(case, rates, options), daemon=True)
+        self._thread.start()
+        self._after = self.window.after(POLL_MS, self._poll)
+
+    def _run(self, case, rates, options):
+        """The sweep, on the background thread."""
+        try:
+            for item in api.evaluate_stream(case, rates, self.install_years,
+                                            cancel=self.cancel, **options):
+                self._queue.put(item)
+        except Exception as e:
+            self._queue.put(e)
+        self._queue.put(None)
+
+    def _drain(self):
+        """Take what the thread queued: (anything new, finished)."""
+        changed = False
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return changed, False
+            if item is None:
+                return changed, True
+            if isinstance(item, Exception):
+                self.error = item
+            else:
+                year, result = item
+                self.results[year] = result
+                changed = True
+
+    def _poll(self):
+        changed, finished = self._drain()
+        if changed:
+            self._draw()
+        if finished:
+            self._finish()
+        else:
+            self._show_status('cancelling' if self.cancel.is_set() else None)
+            self._after = self.window.after(POLL_MS, self._poll)
+
+    def _draw(self):
+        evaluation = self.evaluation()
+        for axes, (_, field, title, ylabel) in zip(self.axes, plots.CHARTS):
+            axes.clear()
+            axes.bar(evaluation.install_years, getattr(evaluation, field))
+            if self.install_years:
+                axes.set_xlim(min(self.install_years) - 0.5,
+                              max(self.install_years) + 0.5)
+            axes.set_title(title)
+            axes.set_xlabel('Install Date (Year)')
+            axes.set_ylabel(ylabel)
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
+
+    def _show_status(self, state=None):
+        self.progress['value'] = len(self.results)
+        self.status['text'] = '%d of %d install years, %.1f s%s' % (
+            len(self.results), len(self.install_years),
+            time.perf_counter() - self._started,
+            ' (%s)' % state if state else '')
+
+    def _finish(self):
+        if self.error is not None:
+            state = 'failed'
+            from tkinter import messagebox
+            messagebox.showerror('Sweep failed', str(self.error),
+                                 parent=self.window)
+        elif self.cancel.is_set():
+            state = 'cancelled'
+        else:
+            state = 'done'
+        self._show_status(state)
+        self.button.configure(text='Close', command=self.close,
+                              state='normal')
+
+    def stop(self):
+        """Cancel the sweep; the window stays open with what is done."""
+        self.cancel.set()
+        self.button.configure(state='disabled')
+
+    def close(self):
+        """Cancel the sweep if it is running, and close the window."""
+        self.cancel.set()
+        self.window.after_cancel(self._after)
+        self.window.destroy()
+
+    def evaluation(self):
+        """api.Evaluation of the install years done so far."""
+        return api.collect(sorted(self.results.items()))
+
+    def wait(self):
+        """Run the Tk event loop until the window is closed."""
+        self.window.wait_window()
+        self._thread.join()
+        self._drain()
+        if self.error is not None:
+            raise self.error
+        return self.evaluation()
+
+
+def run_sweep(case, rates, install_years, title=None, **options):
+    """
+    Show a SweepWindow until it is closed; returns the api.Evaluation of
+    the install years that finished.
+    """
+    return SweepWindow(case, rates, install_years, title, **options).wait()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Weather file ingestion cache.
+
+The JSON's solar_resource_file points to a weather file (the TMY3 file
+912120TYA.CSV for the Guam case) that Pvwattsv7 opens and parses on every
+execute().  A TMY3 file has 71 columns, of which PVWatts uses a handful.
+This module parses each weather file once, keeps the columns PVWatts reads,
+and points PVWatts at a slim SAM CSV copy holding only those.
+
+Handing PVWatts the columns in memory (solar_resource_data) would save a
+little more, but SSC insists on a minute column there, and a minute column
+makes it treat hourly data as instantaneous rather than hour ending as it
+does for TMY3.  The slim copy gives bit-identical generation.
+
+Parsed files are kept in two places:
+
+    memory  the most recently used files, up to WeatherCache.max_entries
+    disk    <cache dir>/weather/<key>.npz (one array per column) and
+            <key>.csv (the slim copy), up to WeatherCache.max_files
+            entries; the least recently used are removed
+
+The key is the file's absolute path, modification time and size, so an
+edited weather file is parsed again.  TMY3 and SAM CSV files are
+understood; anything else (EPW, TMY2, SMW) is left for PVWatts to read.
+
+License: MIT
+"""
+
+import collections
+import csv
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from leac import instrument
+from leac.casecache import cache_dir
+
+# solar_resource_data names and the SAM CSV column titles for them, in the
+# order they are written to the slim copy.
+FIELDS = (('year', 'Year'), ('month', 'Month'), ('day', 'Day'),
+          ('hour', 'Hour'), ('minute', 'Minute'), ('gh', 'GHI'),
+          ('dn', 'DNI'), ('df', 'DHI'), ('tdry', 'Temperature'),
+          ('tdew', 'Dew Point'), ('rhum', 'Relative Humidity'),
+          ('pres', 'Pressure'), ('wspd', 'Wind Speed'),
+          ('wdir', 'Wind Direction'), ('alb', 'Albedo'),
+          ('snow', 'Snow Depth'))
+
+# Column titles (lower case, without units) to solar_resource_data names.
+COLUMNS = dict((title.lower(), name) for name, title in FIELDS)
+COLUMNS.update({
+    'tdry': 'tdry', 'dry-bulb': 'tdry', 'wspd': 'wspd', 'pres': 'pres',
+    'dew-point': 'tdew', 'tdew': 'tdew', 'rhum': 'rhum', 'wdir': 'wdir',
+    'alb': 'alb', 'surface albedo': 'alb', 'snow depth': 'snow',
+})
+
+# Location fields: solar_resource_data name and SAM CSV header title.
+SITE = (('lat', 'Latitude'), ('lon', 'Longitude'), ('tz', 'Time Zone'),
+        ('elev', 'Elevation'))
+SITE_TITLES = dict((title.lower(), name) for name, title in SITE)
+
+
+def _title(column):
+    """'GHI (W/m^2)' -> 'ghi'"""
+    return column.split('(')[0].strip().lower()
+
+
+def _read_tmy3(rows):
+    # Line 1: station, name, state, time zone, latitude, longitude, elevation
+    site = rows[0]
+    data = {'tz': float(site[3]), 'lat': float(site[4]),
+            'lon': float(site[5]), 'elev': float(site[6])}
+    records = rows[2:]
+    dates = [record[0].split('/') for record in records]
+    data['month'] = np.array([float(d[0]) for d in dates])
+    data['day'] = np.array([float(d[1]) for d in dates])
+    data['year'] = np.array([float(d[2]) for d in dates])
+    # TMY3 times are the end of the hour, 01:00 to 24:00.  There is no
+    # minute, which tells SSC the data is hour ending.
+    data['hour'] = np.array([float(record[1].split(':')[0]) - 1
+                             for record in records])
+    for i, column in enumerate(rows[1]):
+        name = COLUMNS.get(_title(column))
+        if name and name not in data:
+            data[name] = np.array([float(record[i]) for record in records])
+    return data
+
+
+def _read_sam_csv(rows):
+    data = {}
+    for title, value in zip(rows[0], rows[1]):
+        name = SITE_TITLES.get(title.strip().lower())
+        if name:
+            data[name] = float(value)
+    columns = np.array(rows[3:], dtype=float)
+    for i, column in enumerate(rows[2]):
+        name = COLUMNS.get(_title(column))
+        if name and name not in data:
+            data[name] = columns[:, i]
+    return data
+
+
+def read_weather_file(path):
+    """
+    Parse a TMY3 or SAM CSV weather file into solar_resource_data columns:
+    NumPy arrays, and lat, lon, tz and elev as floats.  Raises ValueError
+    for other formats.
+    """
+    with instrument.span('weather.parse'), open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if row]
+    if len(rows) < 4:
+        raise ValueError('%s is too short to be a weather file.' % path)
+    if rows[1][0].strip().lower().startswith('date'):
+        return _read_tmy3(rows)
+    if any(title.strip().lower() in SITE_TITLES for title in rows[0]):
+        return _read_sam_csv(rows)
+    raise ValueError('%s is not a TMY3 or SAM CSV weather file.' % path)
+
+
+def write_sam_csv(data, f):
+    """Write read_weather_file() columns as a SAM CSV weather file."""
+    writer = csv.writer(f, lineterminator='\n')
+    site = [(name, title) for name, title in SITE if name in data]
+    writer.writerow(['Source'] + [title for _, title in site])
+    writer.writerow(['leac'] + [repr(data[name]) for name, _ in site])
+    fields = [(name, title) for name, title in FIELDS if name in data]
+    writer.writerow([title for _, title in fields])
+    columns = [data[name].tolist() for name, _ in fields]
+    writer.writerows(zip(*[[repr(value) for value in column]
+                           for column in columns]))
+
+
+def file_key(path):
+    status = os.stat(path)
+    key = '%s|%d|%d' % (os.path.abspath(path), status.st_mtime_ns,
+                        status.st_size)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class WeatherCache(object):
+    """
+    Parsed weather files, least recently used first out.
+
+    max_entries:    files kept in memory.
+    max_files:      files kept in directory.
+    directory:      defaults to <cache dir>/weather.
+
+    The parsed attribute counts the files actually parsed.
+    """
+
+    def __init__(self, max_entries=16, max_files=256, directory=None):
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.directory = directory
+        self.parsed = 0
+        self._entries = collections.OrderedDict()
+
+    def _directory(self):
+        return self.directory or os.path.join(cache_dir(), 'weather')
+
+    def _remember(self, key, data):
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune(self, directory):
+        stored = [os.path.join(directory, name)
+                  for name in os.listdir(directory) if name.endswith('.npz')]
+        stored.sort(key=os.path.getmtime)
+        for path in stored[:max(0, len(stored) - self.max_files)]:
+            for name in (path, path[:-len('.npz')] + '.csv'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def _store(self, directory, key, data):
+        """Write <key>.csv, then <key>.npz, each atomically."""
+        os.makedirs(directory, exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w', newline='') as f:
+            write_sam_csv(data, f)
+        os.replace(temp, os.path.join(directory, key + '.csv'))
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez_compressed(f, **data)
+        os.replace(temp, os.path.join(directory, key + '.npz'))
+        self._prune(directory)
+
+    def _load(self, path):
+        """(key, columns) for the weather file at path."""
+        key = file_key(path)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return key, self._entries[key]
+        directory = self._directory()
+        stored = os.path.join(directory, key + '.npz')
+        if os.path.isfile(stored):
+            os.utime(stored)  # Most recently used.
+            with np.load(stored) as npz:
+                data = {name: (float(npz[name]) if npz[name].ndim == 0
+                               else npz[name]) for name in npz.files}
+        else:
+            data = read_weather_file(path)
+            self.parsed += 1
+            self._store(directory, key, data)
+        self._remember(key, data)
+        return key, data
+
+    def columns(self, path):
+        """The read_weather_file() columns of the weather file at path."""
+        return self._load(path)[1]
+
+    def slim_path(self, path):
+        """The slim SAM CSV copy of the weather file at path."""
+        key, data = self._load(path)
+        slim = os.path.join(self._directory(), key + '.csv')
+        if not os.path.isfile(slim):
+            self._store(self._directory(), key, data)
+        return slim
+
+    def clear(self):
+        self._entries.clear()
+
+
+_default = WeatherCache()
+
+
+def columns(path, cache=None):
+    """Parsed columns of the weather file at path (see read_weather_file)."""
+    return (cache or _default).columns(path)
+
+
+def slim_file(path, cache=None):
+    """
+    The cached slim copy of the weather file at path, or path itself if it
+    is missing or in a format this module does not read, so that PVWatts
+    reports or handles it as before.
+    """
+    try:
+        return (cache or _default).slim_path(path)
+    except (OSError, ValueError):
+        return path